@@ -0,0 +1,399 @@
+"""Compressed columnar archive of expired mail_logs partitions, one segment file per day."""
+import itertools
+import json
+import logging
+import lzma
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from types import SimpleNamespace
+
+from sqlalchemy import text
+
+from .db import engine
+from .metrics import ARCHIVE_ROWS
+from .search import MailFilter
+
+log = logging.getLogger("mailrelay.archive")
+
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", "/archive"))
+GROUP_ROWS = int(os.getenv("ARCHIVE_GROUP_ROWS", "16384"))
+CODEC = os.getenv("ARCHIVE_CODEC", "zlib")
+MAGIC = b"MRARCH1\n"
+EPOCH = datetime(1970, 1, 1)
+TABLE = "mail_logs"
+# (column, kind) in storage order
+COLUMNS = [
+    ("id", "int"),
+    ("created_at", "time"),
+    ("sender", "str"),
+    ("recipient", "str"),
+    ("client_ip", "str"),
+    ("helo", "str"),
+    ("rdns", "str"),
+    ("target", "str"),
+    ("status", "str"),
+    ("smtp_code", "str"),
+    ("smtp_text", "str"),
+    ("tls_used", "bool"),
+    ("subject", "str"),
+    ("queue_id", "str"),
+    ("message_id", "str"),
+]
+KINDS = dict(COLUMNS)
+COMPRESS = {"zlib": lambda b: zlib.compress(b, 6), "lzma": lambda b: lzma.compress(b, preset=6)}
+DECOMPRESS = {"zlib": zlib.decompress, "lzma": lzma.decompress}
+_write_lock = threading.Lock()
+
+
+def retention_days() -> int:
+    return int(os.getenv("ARCHIVE_RETENTION_DAYS", "0"))
+
+
+def enabled() -> bool:
+    return retention_days() > 0
+
+
+def micros(dt: datetime) -> int:
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def domain_of(address: str | None) -> str:
+    # same as lower(split_part(sender, '@', 2)) in search.domain_of
+    parts = (address or "").split("@")
+    return parts[1].lower() if len(parts) > 1 else ""
+
+
+def _ints(values) -> bytes:
+    a = array("q", values)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a.tobytes()
+
+
+def _from_ints(data: bytes) -> array:
+    a = array("q")
+    a.frombytes(data)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+
+def encode(kind: str, values: list) -> bytes:
+    if kind in ("int", "time"):
+        ints = [micros(v) for v in values] if kind == "time" else values
+        return _ints(b - a for a, b in itertools.pairwise([0, *ints]))
+    if kind == "bool":
+        return bytes(bool(v) for v in values)
+    codes: dict = {}
+    idx = array("I", (codes.setdefault(v, len(codes)) for v in values))
+    if sys.byteorder != "little":
+        idx.byteswap()
+    head = json.dumps(list(codes), separators=(",", ":")).encode()
+    return struct.pack("<I", len(head)) + head + idx.tobytes()
+
+
+def decode(kind: str, data: bytes):
+    """ints for int/time columns (time as micros), bytes for bool, (distinct values, codes) for strings."""
+    if kind in ("int", "time"):
+        return list(itertools.accumulate(_from_ints(data)))
+    if kind == "bool":
+        return data
+    (n,) = struct.unpack_from("<I", data)
+    values = json.loads(data[4 : 4 + n])
+    codes = array("I")
+    codes.frombytes(data[4 + n :])
+    if sys.byteorder != "little":
+        codes.byteswap()
+    return values, codes
+
+
+class SegmentWriter:
+    def __init__(self, path: Path, codec: str = CODEC):
+        self.path, self.codec = path, codec
+        self.tmp = path.with_suffix(".tmp")
+        self.f = open(self.tmp, "wb")
+        self.f.write(MAGIC)
+        self.groups: list[dict] = []
+        self.domains: dict[str, set[int]] = {}
+        self.rows = 0
+
+    def add_group(self, rows: list):
+        g = len(self.groups)
+        offsets = []
+        for i, (name, kind) in enumerate(COLUMNS):
+            blob = COMPRESS[self.codec](encode(kind, [r[i] for r in rows]))
+            offsets.append((self.f.tell(), len(blob)))
+            self.f.write(blob)
+        sender = COLUMNS.index(("sender", "str"))
+        for r in rows:
+            self.domains.setdefault(domain_of(r[sender]), set()).add(g)
+        created = COLUMNS.index(("created_at", "time"))
+        self.groups.append({"rows": len(rows), "min": micros(rows[0][created]), "max": micros(rows[-1][created]), "offsets": offsets})
+        self.rows += len(rows)
+
+    def close(self) -> int:
+        n = len(self.groups)
+        # a domain found in most groups prunes nothing, so it is stored as "all groups" (null)
+        index = {d: (sorted(gs) if len(gs) * 2 <= n else None) for d, gs in self.domains.items()}
+        footer = zlib.compress(json.dumps({"version": 1, "codec": self.codec, "columns": COLUMNS, "rows": self.rows, "groups": self.groups, "sender_domains": index}, separators=(",", ":")).encode())
+        self.f.write(footer)
+        self.f.write(struct.pack("<I", len(footer)) + MAGIC)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        os.replace(self.tmp, self.path)
+        return self.path.stat().st_size
+
+    def abort(self):
+        self.f.close()
+        self.tmp.unlink(missing_ok=True)
+
+
+@lru_cache(maxsize=1024)
+def _footer(path: str, mtime: float) -> dict:
+    with open(path, "rb") as f:
+        f.seek(-4 - len(MAGIC), os.SEEK_END)
+        tail = f.read()
+        if tail[4:] != MAGIC:
+            raise ValueError(f"{path} is not an archive segment")
+        (n,) = struct.unpack("<I", tail[:4])
+        f.seek(-4 - len(MAGIC) - n, os.SEEK_END)
+        return json.loads(zlib.decompress(f.read(n)))
+
+
+def footer(path: Path) -> dict:
+    return _footer(str(path), path.stat().st_mtime)
+
+
+def table_dir() -> Path:
+    return ARCHIVE_DIR / TABLE
+
+
+_catalog_cache: dict = {}
+
+
+def catalog() -> dict:
+    """Segments and archived window; re-read when the leader rewrites the file."""
+    path = table_dir() / "catalog.json"
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return {"segments": [], "archived_until": None}
+    if _catalog_cache.get("mtime") != mtime:
+        _catalog_cache.update(mtime=mtime, data=json.loads(path.read_text()))
+    return _catalog_cache["data"]
+
+
+def write_catalog(data: dict):
+    path = table_dir() / "catalog.json"
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, indent=1))
+    os.replace(tmp, path)
+
+
+def archive_range(table: str, source: str, start: datetime, end: datetime) -> bool:
+    """Writes the rows of `source` in [start, end) to the day's segment; retention drops the source only on True."""
+    if table != TABLE:
+        return True
+    select_cols = ", ".join(name for name, _ in COLUMNS)
+    path = table_dir() / start.strftime("%Y") / f"{start:%Y%m%d}.seg"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer = SegmentWriter(path)
+    try:
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=GROUP_ROWS).execute(
+                text(f"SELECT {select_cols} FROM {source} WHERE created_at >= :start AND created_at < :end ORDER BY created_at, id"),
+                {"start": start, "end": end},
+            )
+            for part in result.partitions():
+                writer.add_group(part)
+        if writer.rows:
+            size = writer.close()
+        else:
+            writer.abort()
+            path.unlink(missing_ok=True)
+    except Exception:
+        writer.abort()
+        log.exception("archiving %s %s failed", source, start.date())
+        return False
+    with _write_lock:
+        data = catalog()
+        segments = [s for s in data["segments"] if s["day"] != start.date().isoformat()]
+        if writer.rows:
+            g = writer.groups
+            segments.append({
+                "day": start.date().isoformat(),
+                "file": str(path.relative_to(table_dir())),
+                "rows": writer.rows,
+                "bytes": size,
+                "min": g[0]["min"],
+                "max": g[-1]["max"],
+            })
+        until = max(filter(None, [data.get("archived_until"), end.isoformat()]))
+        write_catalog({"segments": sorted(segments, key=lambda s: s["day"]), "archived_until": until})
+    ARCHIVE_ROWS.inc(writer.rows)
+    return True
+
+
+def prune(now: datetime | None = None) -> list[str]:
+    """Removes segments older than ARCHIVE_RETENTION_DAYS."""
+    if not enabled():
+        return []
+    cutoff = ((now or datetime.utcnow()) - timedelta(days=retention_days())).date().isoformat()
+    with _write_lock:
+        data = catalog()
+        expired = [s for s in data["segments"] if s["day"] < cutoff]
+        if not expired:
+            return []
+        for s in expired:
+            (table_dir() / s["file"]).unlink(missing_ok=True)
+        write_catalog({**data, "segments": [s for s in data["segments"] if s["day"] >= cutoff]})
+    return [s["day"] for s in expired]
+
+
+def hot_since(f: MailFilter) -> datetime | None:
+    """Where mail_logs takes over if the search window reaches into the archive, else None."""
+    if not enabled():
+        return None
+    until = catalog().get("archived_until")
+    if not until:
+        return None
+    until = datetime.fromisoformat(until)
+    return until if datetime.utcnow() - timedelta(hours=f.hours) < until else None
+
+
+def text_predicate(value: str, match: str):
+    v = value.lower()
+    if match == "exact":
+        return lambda s: s is not None and s.lower() == v
+    if match == "prefix":
+        return lambda s: s is not None and s.lower().startswith(v)
+    return lambda s: s is not None and v in s.lower()
+
+
+def domain_predicate(value: str, match: str):
+    v = value.lower().lstrip("@")
+    if match == "prefix":
+        return lambda s: domain_of(s).startswith(v)
+    return lambda s: domain_of(s) == v
+
+
+def predicates(f: MailFilter) -> list[tuple[str, object]]:
+    """(column, test on a distinct value) mirroring search.mail_conditions; several tests on one column are ANDed."""
+    preds = [(col, text_predicate(v, f.match)) for col, v in (("sender", f.sender), ("recipient", f.recipient), ("client_ip", f.ip), ("target", f.target)) if v]
+    if f.status:
+        preds.append(("status", text_predicate(f.status, "contains" if f.match == "contains" else "exact")))
+    if f.sender_domain:
+        preds.append(("sender", domain_predicate(f.sender_domain, f.match)))
+    if f.recipient_domain:
+        preds.append(("recipient", domain_predicate(f.recipient_domain, f.match)))
+    return preds
+
+
+def candidate_groups(meta: dict, f: MailFilter, lo: int, hi: int) -> list[int]:
+    groups = [i for i, g in enumerate(meta["groups"]) if g["max"] >= lo and g["min"] < hi]
+    if f.sender_domain:
+        v, index = f.sender_domain.lower().lstrip("@"), meta["sender_domains"]
+        keys = [k for k in index if k.startswith(v)] if f.match == "prefix" else [v] if v in index else []
+        if not any(index[k] is None for k in keys):
+            hit = {g for k in keys for g in index[k]}
+            groups = [g for g in groups if g in hit]
+    return groups
+
+
+def _scan_group(fh, meta: dict, g: int, preds: list, f: MailFilter, lo: int, hi: int, before: tuple[int, int] | None):
+    """Matching rows of one group, newest first."""
+    info = meta["groups"][g]
+    decompress = DECOMPRESS[meta["codec"]]
+    names = [c for c, _ in meta["columns"]]
+    cache: dict = {}
+
+    def column(name: str):
+        if name not in cache:
+            off, length = info["offsets"][names.index(name)]
+            fh.seek(off)
+            cache[name] = decode(KINDS[name], decompress(fh.read(length)))
+        return cache[name]
+
+    times = column("created_at")
+    hits = range(info["rows"])
+    if info["min"] < lo or info["max"] >= hi:
+        hits = [i for i in hits if lo <= times[i] < hi]
+    if before:
+        ids = column("id")
+        hits = [i for i in hits if (times[i], ids[i]) < before]
+    for name, test in preds:
+        values, codes = column(name)
+        ok = {c for c, v in enumerate(values) if test(v)}
+        hits = [i for i in hits if codes[i] in ok]
+        if not hits:
+            return
+    if f.tls is not None:
+        flags = column("tls_used")
+        hits = [i for i in hits if bool(flags[i]) is f.tls]
+    if not hits:
+        return
+    decoded = {name: column(name) for name in names}
+    for i in reversed(hits):
+        row = {}
+        for name, kind in meta["columns"]:
+            col = decoded[name]
+            if kind == "str":
+                row[name] = col[0][col[1][i]]
+            elif kind == "bool":
+                row[name] = bool(col[i])
+            elif kind == "time":
+                row[name] = EPOCH + timedelta(microseconds=col[i])
+            else:
+                row[name] = col[i]
+        yield SimpleNamespace(**row)
+
+
+def rows(f: MailFilter, until: datetime, before: tuple[datetime, int] | None = None):
+    """Archived rows matching `f` in [now - f.hours, until), newest first, as MailLog-like objects."""
+    lo = micros(datetime.utcnow() - timedelta(hours=f.hours))
+    hi = micros(until)
+    if before:
+        hi = min(hi, micros(before[0]) + 1)
+        before = (micros(before[0]), before[1])
+    preds = predicates(f)
+    for seg in sorted(catalog()["segments"], key=lambda s: s["day"], reverse=True):
+        if seg["max"] < lo or seg["min"] >= hi:
+            continue
+        path = table_dir() / seg["file"]
+        try:
+            meta = footer(path)
+        except (OSError, ValueError):
+            log.warning("archive segment %s unreadable, skipped", path)
+            continue
+        groups = candidate_groups(meta, f, lo, hi)
+        if not groups:
+            continue
+        with open(path, "rb") as fh:
+            for g in reversed(groups):
+                yield from _scan_group(fh, meta, g, preds, f, lo, hi, before)
+
+
+def search(f: MailFilter, until: datetime, limit: int, before: tuple[datetime, int] | None = None) -> list:
+    return list(itertools.islice(rows(f, until, before), limit))
+
+
+def stats() -> dict:
+    data = catalog()
+    segments = data["segments"]
+    return {
+        "enabled": enabled(),
+        "retention_days": retention_days(),
+        "archived_until": data.get("archived_until"),
+        "segments": len(segments),
+        "rows": sum(s["rows"] for s in segments),
+        "bytes": sum(s["bytes"] for s in segments),
+        "oldest": segments[0]["day"] if segments else None,
+    }
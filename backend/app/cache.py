@@ -0,0 +1,90 @@
+import logging
+import os
+import threading
+import time
+
+import psycopg
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+log = logging.getLogger("mailrelay.cache")
+CHANNEL = "cache_invalidate"
+
+
+class TTLCache:
+    """In-process TTL cache for hot lookups; a load that races an invalidation is returned but not stored."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: dict = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        generation = self._generation
+        value = loader()
+        if self.ttl > 0 and value is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._data[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    async def aget(self, key, loader):
+        """`get` for coroutine loaders (async sessions)."""
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        generation = self._generation
+        value = await loader()
+        if self.ttl > 0 and value is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._data[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+
+_ttl = float(os.getenv("CACHE_TTL_SECONDS", "30"))
+CACHES = {"settings": TTLCache(_ttl), "users": TTLCache(_ttl)}
+
+
+def invalidate(db: Session, name: str):
+    """Drops cache `name` here and, once `db` commits, in every other worker via NOTIFY."""
+    CACHES[name].invalidate()
+    db.execute(text("SELECT pg_notify(:c, :n)"), {"c": CHANNEL, "n": name})
+
+
+def start_listener(dsn: str):
+    threading.Thread(target=_listen, args=(dsn,), name="cache-listener", daemon=True).start()
+
+
+def _listen(dsn: str):
+    while True:
+        try:
+            with psycopg.connect(dsn, autocommit=True) as conn:
+                conn.execute(f"LISTEN {CHANNEL}")
+                # anything may have changed while we were not listening
+                for c in CACHES.values():
+                    c.invalidate()
+                for n in conn.notifies():
+                    if n.payload in CACHES:
+                        CACHES[n.payload].invalidate()
+        except Exception:
+            log.exception("cache LISTEN connection lost")
+            time.sleep(5)
@@ -0,0 +1,103 @@
+import csv
+import io
+import json
+import re
+
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from . import routing
+from .models import DomainPolicy, RelayRoute
+from .schemas import RouteRequest
+
+DOMAIN_RE = re.compile(r"^(?=.{1,253}$)(\*\.)?([a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9_])?\.)*[a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9_])?$")
+ROUTE_COLUMNS = ["sender_domain", "target_host", "target_port", "tls_mode", "tls_verify", "auth_username", "auth_password", "targets", *routing.TUNING_FIELDS]
+CHUNK = 5000
+
+
+def _bool(v) -> bool:
+    return v if isinstance(v, bool) else str(v).strip().lower() in ("1", "true", "yes", "on")
+
+
+def parse(body: bytes, content_type: str) -> dict:
+    """{"domains": [...], "routes": [...]} from a JSON document or a CSV file."""
+    if "csv" in content_type:
+        rows = list(csv.DictReader(io.StringIO(body.decode("utf-8-sig"))))
+        fields = set(rows[0]) if rows else set()
+        items = [{k: v for k, v in r.items() if k and v not in (None, "")} for r in rows]
+        if "sender_domain" in fields:
+            for r in items:
+                if "targets" in r:
+                    r["targets"] = json.loads(r["targets"])
+            return {"domains": [], "routes": items}
+        if "domain" in fields:
+            return {"domains": items, "routes": []}
+        raise ValueError("CSV needs a domain or a sender_domain column")
+    payload = json.loads(body or b"{}")
+    if not isinstance(payload, dict):
+        raise ValueError("expected an object with domains and/or routes")
+    domains = [d if isinstance(d, dict) else {"domain": d} for d in payload.get("domains", [])]
+    return {"domains": domains, "routes": list(payload.get("routes", []))}
+
+
+def validate(data: dict) -> tuple[dict[str, bool], dict[str, dict], list[dict]]:
+    """Normalized domains (domain -> enabled) and routes (sender_domain -> row), plus one error per bad entry."""
+    domains, routes, errors = {}, {}, []
+    for i, item in enumerate(data["domains"]):
+        domain = str(item.get("domain") or "").strip().lower()
+        if not DOMAIN_RE.match(domain):
+            errors.append({"kind": "domain", "index": i, "value": domain, "error": "invalid domain"})
+        elif domain in domains:
+            errors.append({"kind": "domain", "index": i, "value": domain, "error": "duplicate in import"})
+        else:
+            domains[domain] = _bool(item.get("enabled", True))
+    for i, item in enumerate(data["routes"]):
+        sender_domain = str(item.get("sender_domain") or "").strip().lower()
+        try:
+            req = RouteRequest.model_validate({**item, "sender_domain": sender_domain})
+            if not DOMAIN_RE.match(sender_domain):
+                raise ValueError("invalid sender_domain")
+            if sender_domain in routes:
+                raise ValueError("duplicate in import")
+            if not req.targets and not req.target_host:
+                raise ValueError("target_host or targets required")
+            row = req.model_dump(exclude={"targets"})
+            routing.validate_tuning(row)
+            row["targets"] = None
+            if req.targets:
+                targets = routing.normalize_targets([t.model_dump() for t in req.targets])
+                # same shape as set_route_targets: target_host/target_port hold the preferred target
+                row["targets"] = targets if len(targets) > 1 else None
+                row["target_host"], row["target_port"] = targets[0]["host"], targets[0]["port"]
+            routes[sender_domain] = row
+        except (ValidationError, ValueError) as e:
+            detail = e.errors()[0]["msg"] if isinstance(e, ValidationError) else str(e)
+            errors.append({"kind": "route", "index": i, "value": sender_domain, "error": detail})
+    return domains, routes, errors
+
+
+def plan(db: Session, domains: dict[str, bool], routes: dict[str, dict]) -> tuple[dict, dict, dict]:
+    """Compares against the tables once and returns (domain upserts, route upserts, counts)."""
+    existing_domains = dict(db.execute(select(DomainPolicy.domain, DomainPolicy.enabled)).all())
+    domain_rows = {d: e for d, e in domains.items() if existing_domains.get(d) != e}
+    existing_routes = {r.sender_domain: {k: getattr(r, k) for k in ROUTE_COLUMNS} for r in db.execute(select(*(getattr(RelayRoute, k) for k in ROUTE_COLUMNS))).all()}
+    route_rows = {d: r for d, r in routes.items() if existing_routes.get(d) != r}
+    counts = {
+        "domains": {"inserted": sum(d not in existing_domains for d in domain_rows), "updated": sum(d in existing_domains for d in domain_rows), "unchanged": len(domains) - len(domain_rows)},
+        "routes": {"inserted": sum(d not in existing_routes for d in route_rows), "updated": sum(d in existing_routes for d in route_rows), "unchanged": len(routes) - len(route_rows)},
+    }
+    return domain_rows, route_rows, counts
+
+
+def apply(db: Session, domain_rows: dict[str, bool], route_rows: dict[str, dict]):
+    """Multi-row upserts in the caller's transaction; entries not in the import are left alone."""
+    items = [{"domain": d, "enabled": e} for d, e in domain_rows.items()]
+    for i in range(0, len(items), CHUNK):
+        stmt = insert(DomainPolicy).values(items[i : i + CHUNK])
+        db.execute(stmt.on_conflict_do_update(index_elements=[DomainPolicy.domain], set_={"enabled": stmt.excluded.enabled}))
+    items = list(route_rows.values())
+    for i in range(0, len(items), CHUNK):
+        stmt = insert(RelayRoute).values(items[i : i + CHUNK])
+        db.execute(stmt.on_conflict_do_update(index_elements=[RelayRoute.sender_domain], set_={k: stmt.excluded[k] for k in ROUTE_COLUMNS if k != "sender_domain"}))
@@ -0,0 +1,69 @@
+import csv
+import io
+import itertools
+import json
+import os
+import zlib
+
+from sqlalchemy import desc
+
+from . import archive
+from .db import SessionLocal
+from .models import MailLog
+from .search import MailFilter, filtered_mail_query
+
+EXPORT_COLUMNS = ["timestamp", "sender", "recipient", "ip", "status", "target", "tls", "smtp_code", "smtp_text"]
+CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "2000"))
+
+
+def _rows(f: MailFilter):
+    # Own session: the request-scoped one is closed before a StreamingResponse body is sent.
+    hot_since = archive.hot_since(f)
+    db = SessionLocal()
+    try:
+        q = (
+            filtered_mail_query(db, f, hot_since)
+            .with_entities(MailLog.created_at, MailLog.sender, MailLog.recipient, MailLog.client_ip, MailLog.status, MailLog.target, MailLog.tls_used, MailLog.smtp_code, MailLog.smtp_text)
+            .order_by(desc(MailLog.created_at))
+        )
+        # yield_per implies stream_results, i.e. a server-side cursor on postgres
+        yield from db.execute(q.statement, execution_options={"yield_per": CHUNK_ROWS}).partitions()
+    finally:
+        db.close()
+    if hot_since:
+        older = ((r.created_at, r.sender, r.recipient, r.client_ip, r.status, r.target, r.tls_used, r.smtp_code, r.smtp_text) for r in archive.rows(f, hot_since))
+        while part := list(itertools.islice(older, CHUNK_ROWS)):
+            yield part
+
+
+def _csv_chunks(f: MailFilter):
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(EXPORT_COLUMNS)
+    for part in _rows(f):
+        for r in part:
+            w.writerow([r[0].isoformat(), *r[1:]])
+        yield out.getvalue().encode()
+        out.seek(0)
+        out.truncate()
+    if out.tell():
+        yield out.getvalue().encode()
+
+
+def _ndjson_chunks(f: MailFilter):
+    for part in _rows(f):
+        yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, [r[0].isoformat(), *r[1:]]))) + "\n" for r in part).encode()
+
+
+def _gzip(chunks):
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = z.compress(chunk)
+        if data:
+            yield data
+    yield z.flush()
+
+
+def export_stream(f: MailFilter, fmt: str = "csv", compress: bool = False):
+    chunks = _ndjson_chunks(f) if fmt == "ndjson" else _csv_chunks(f)
+    return _gzip(chunks) if compress else chunks
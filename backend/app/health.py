@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import random
+import socket
+import ssl
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from .metrics import RETENTION_ROWS
+from .models import RelayHealthHistory, RelayRoute, RelayTargetHealth
+from .routing import route_targets, target_key
+
+log = logging.getLogger("mailrelay.health")
+BUCKET_MINUTES = 5
+HISTORY_RETENTION = timedelta(days=7)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> tuple[int, list[str]]:
+    """One SMTP reply: `250-...` continuation lines up to the final `250 ...` line."""
+    lines = []
+    while True:
+        line = (await reader.readline()).decode(errors="replace").rstrip("\r\n")
+        if not line:
+            raise ConnectionError("connection closed by server")
+        lines.append(line[4:])
+        if len(line) < 4 or line[3] != "-":
+            return int(line[:3]), lines
+
+
+class HealthChecker:
+    """Probes every relay target (TCP connect, 220 banner, optionally EHLO and STARTTLS) on its own event loop."""
+
+    def __init__(
+        self,
+        load_targets,
+        record,
+        interval: float = 30.0,
+        timeout: float = 5.0,
+        concurrency: int = 200,
+        max_backoff: float = 600.0,
+        ehlo: bool = True,
+        starttls: bool = True,
+        helo_name: str | None = None,
+        flush_interval: float = 2.0,
+    ):
+        self.load_targets = load_targets
+        self.record = record
+        self.interval = interval
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.max_backoff = max_backoff
+        self.ehlo = ehlo
+        self.starttls = starttls
+        self.helo_name = helo_name or socket.getfqdn()
+        self.flush_interval = flush_interval
+        # availability probe, not a policy check: the route's own tls_verify applies to real deliveries
+        self.tls_context = ssl.create_default_context()
+        self.tls_context.check_hostname = False
+        self.tls_context.verify_mode = ssl.CERT_NONE
+        self.targets: dict[str, tuple[str, int]] = {}
+        # target -> (next due on the monotonic clock, consecutive failures)
+        self.schedule: dict[str, tuple[float, int]] = {}
+        self.stats = {"probes": 0, "failures": 0}
+        self._inflight: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._results: list[dict] = []
+
+    async def probe(self, host: str, port: int) -> dict:
+        started = time.perf_counter()
+        result = {"up": False, "latency_ms": None, "banner": None, "tls": None, "error": None}
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+            code, lines = await asyncio.wait_for(read_reply(reader), self.timeout)
+            # connect + greeting is what a delivery waits for before it can send anything
+            result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            result["banner"] = lines[0][:255]
+            if code != 220:
+                result["error"] = f"greeting {code}"
+                return result
+            if self.ehlo:
+                writer.write(f"EHLO {self.helo_name}\r\n".encode())
+                code, lines = await asyncio.wait_for(read_reply(reader), self.timeout)
+                if code != 250:
+                    result["error"] = f"EHLO {code}"
+                    return result
+                if self.starttls:
+                    result["tls"] = False
+                    if any(ext.upper().split(" ")[0] == "STARTTLS" for ext in lines[1:]):
+                        writer.write(b"STARTTLS\r\n")
+                        code, _ = await asyncio.wait_for(read_reply(reader), self.timeout)
+                        if code == 220:
+                            await asyncio.wait_for(writer.start_tls(self.tls_context, server_hostname=host), self.timeout)
+                            result["tls"] = True
+                        else:
+                            result["error"] = f"STARTTLS {code}"
+            writer.write(b"QUIT\r\n")
+            result["up"] = True
+        except (OSError, ValueError, ssl.SSLError, asyncio.TimeoutError) as e:
+            result["error"] = (f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)[:255]
+        finally:
+            if writer is not None:
+                writer.close()
+        return result
+
+    async def _check(self, key: str, host: str, port: int, sem: asyncio.Semaphore):
+        try:
+            async with sem:
+                result = await self.probe(host, port)
+            failures = 0 if result["up"] else self.schedule.get(key, (0, 0))[1] + 1
+            delay = self.interval if not failures else min(self.interval * 2 ** (failures - 1), self.max_backoff)
+            if key in self.targets:
+                self.schedule[key] = (time.monotonic() + delay, failures)
+            self.stats["probes"] += 1
+            self.stats["failures"] += not result["up"]
+            self._results.append({"target": key, "host": host, "port": port, "failures": failures, "checked_at": datetime.utcnow(), **result})
+        finally:
+            self._inflight.discard(key)
+
+    def set_targets(self, targets: list[tuple[str, int]]):
+        self.targets = {target_key(h, p): (h, p) for h, p in targets}
+        now = time.monotonic()
+        for key in self.targets:
+            if key not in self.schedule:
+                # spread the first round over one interval instead of opening every connection at once
+                self.schedule[key] = (now + random.random() * self.interval, 0)
+        for key in [k for k in self.schedule if k not in self.targets]:
+            del self.schedule[key]
+
+    async def _flush_loop(self, loop):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._results:
+                batch, self._results = self._results, []
+                try:
+                    await loop.run_in_executor(None, self.record, batch, list(self.targets))
+                except Exception:
+                    log.exception("recording %d health results failed", len(batch))
+
+    async def run(self, active=lambda: True):
+        loop = asyncio.get_running_loop()
+        sem = asyncio.Semaphore(self.concurrency)
+        flusher = loop.create_task(self._flush_loop(loop))
+        loaded = 0.0
+        try:
+            while True:
+                if not active():
+                    await asyncio.sleep(1)
+                    continue
+                if time.monotonic() - loaded >= self.interval:
+                    try:
+                        self.set_targets(await loop.run_in_executor(None, self.load_targets))
+                    except Exception:
+                        log.exception("loading relay targets failed")
+                    loaded = time.monotonic()
+                now = time.monotonic()
+                for key, (due, _) in self.schedule.items():
+                    if due <= now and key not in self._inflight:
+                        self._inflight.add(key)
+                        task = loop.create_task(self._check(key, *self.targets[key], sem))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+                await asyncio.sleep(0.2)
+        finally:
+            flusher.cancel()
+
+    def start(self, active=lambda: True) -> threading.Thread:
+        t = threading.Thread(target=lambda: asyncio.run(self.run(active)), name="relay-health", daemon=True)
+        t.start()
+        return t
+
+
+def load_targets(db: Session) -> list[tuple[str, int]]:
+    return sorted({(t["host"], t["port"]) for r in db.query(RelayRoute).all() for t in route_targets(r) if t["host"]})
+
+
+def health_upsert(rows: list[dict]):
+    stmt = pg_insert(RelayTargetHealth).values(rows)
+    ex = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[RelayTargetHealth.target],
+        set_={
+            "up": ex.up,
+            "latency_ms": ex.latency_ms,
+            "failures": ex.failures,
+            "banner": func.coalesce(ex.banner, RelayTargetHealth.banner),
+            "tls": ex.tls,
+            "error": ex.error,
+            "checked_at": ex.checked_at,
+            "last_up": func.coalesce(ex.last_up, RelayTargetHealth.last_up),
+        },
+    )
+
+
+def history_upsert(rows: list[dict]):
+    stmt = pg_insert(RelayHealthHistory).values(rows)
+    ex = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[RelayHealthHistory.target, RelayHealthHistory.bucket],
+        set_={
+            "checks": RelayHealthHistory.checks + ex.checks,
+            "ok": RelayHealthHistory.ok + ex.ok,
+            "latency_sum": RelayHealthHistory.latency_sum + ex.latency_sum,
+            "latency_max": func.greatest(RelayHealthHistory.latency_max, ex.latency_max),
+        },
+    )
+
+
+def record_results(db: Session, results: list[dict], targets: list[str]):
+    """Latest state per target plus one history row per target and BUCKET_MINUTES; removed targets are dropped."""
+    latest: dict[str, dict] = {}
+    buckets: dict[tuple, dict] = defaultdict(lambda: {"checks": 0, "ok": 0, "latency_sum": 0.0, "latency_max": 0.0})
+    for r in results:
+        latest[r["target"]] = r
+        t = r["checked_at"]
+        b = buckets[(r["target"], t.replace(minute=t.minute - t.minute % BUCKET_MINUTES, second=0, microsecond=0))]
+        b["checks"] += 1
+        if r["up"]:
+            b["ok"] += 1
+            b["latency_sum"] += r["latency_ms"]
+            b["latency_max"] = max(b["latency_max"], r["latency_ms"])
+    # sorted keys: the same lock order as a previous leader that may still be flushing
+    db.execute(health_upsert([
+        {
+            "target": k, "host": r["host"], "port": r["port"], "up": r["up"], "latency_ms": r["latency_ms"], "failures": r["failures"],
+            "banner": r["banner"], "tls": r["tls"], "error": r["error"], "checked_at": r["checked_at"], "last_up": r["checked_at"] if r["up"] else None,
+        }
+        for k, r in sorted(latest.items())
+    ]))
+    db.execute(history_upsert([{"target": t, "bucket": b, **v} for (t, b), v in sorted(buckets.items())]))
+    if targets:
+        db.query(RelayTargetHealth).filter(RelayTargetHealth.target.not_in(targets)).delete(synchronize_session=False)
+    db.commit()
+
+
+def availability_select(since: datetime):
+    return (
+        select(RelayHealthHistory.target, func.sum(RelayHealthHistory.ok), func.sum(RelayHealthHistory.checks))
+        .where(RelayHealthHistory.bucket >= since)
+        .group_by(RelayHealthHistory.target)
+    )
+
+
+def history_select(target: str, since: datetime):
+    return select(RelayHealthHistory).where(RelayHealthHistory.target == target, RelayHealthHistory.bucket >= since).order_by(RelayHealthHistory.bucket)
+
+
+def summary_select():
+    return select(RelayTargetHealth.up, func.count()).group_by(RelayTargetHealth.up)
+
+
+def health_out(h: RelayTargetHealth, availability: tuple[int, int] | None = None) -> dict:
+    ok, checks = availability or (0, 0)
+    return {
+        "target": h.target,
+        "host": h.host,
+        "port": h.port,
+        "up": h.up,
+        "latency_ms": h.latency_ms,
+        "consecutive_failures": h.failures,
+        "tls": h.tls,
+        "banner": h.banner,
+        "error": h.error,
+        "checked_at": h.checked_at.isoformat(),
+        "last_up": h.last_up.isoformat() if h.last_up else None,
+        "availability": round(ok / checks, 4) if checks else None,
+    }
+
+
+def history_out(b: RelayHealthHistory) -> dict:
+    return {
+        "bucket": b.bucket.isoformat(),
+        "checks": b.checks,
+        "ok": b.ok,
+        "availability": round(b.ok / b.checks, 4) if b.checks else None,
+        "latency_avg_ms": round(b.latency_sum / b.ok, 2) if b.ok else None,
+        "latency_max_ms": b.latency_max if b.ok else None,
+    }
+
+
+def prune(db: Session):
+    RETENTION_ROWS.labels("relay_health_history").inc(db.query(RelayHealthHistory).filter(RelayHealthHistory.bucket < datetime.utcnow() - HISTORY_RETENTION).delete())
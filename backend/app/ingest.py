@@ -0,0 +1,256 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+from .livetail import notify_statement
+from .metrics import INGEST_BATCH_ROWS, INGEST_DROPPED, INGEST_ROWS, INGEST_WRITE_SECONDS
+from .models import MailLog, RejectionLog
+from .rollups import apply_rollups, collect
+from .traces import apply_traces
+
+log = logging.getLogger("mailrelay.ingest")
+# the log tables have daily partitions from RETENTION_DAYS back to 7 days ahead and no DEFAULT partition
+RETENTION = timedelta(days=int(os.getenv("RETENTION_DAYS", "14")))
+CLOCK_SKEW = timedelta(minutes=5)
+
+
+class BufferFull(Exception):
+    pass
+
+
+def event_time(event: dict) -> datetime:
+    v = event.get("created_at")
+    if isinstance(v, datetime):
+        ts = v
+    elif v:
+        try:
+            ts = datetime.fromisoformat(str(v).replace("Z", "+00:00"))
+        except ValueError:
+            return datetime.utcnow()
+    else:
+        return datetime.utcnow()
+    ts = ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo else ts
+    # a replayed or mis-clocked event keeps its row instead of failing without a partition
+    now = datetime.utcnow()
+    return min(max(ts, now - RETENTION), now + CLOCK_SKEW)
+
+
+def mail_row(event: dict) -> dict:
+    return {
+        "sender": event.get("sender"),
+        "recipient": event.get("recipient"),
+        "client_ip": event.get("client_ip"),
+        "helo": event.get("helo"),
+        "status": event.get("status", "processed"),
+        "target": event.get("target"),
+        "tls_used": bool(event.get("tls_used", False)),
+        "smtp_code": event.get("smtp_code"),
+        "smtp_text": event.get("smtp_text"),
+        "queue_id": (event.get("queue_id") or None) and str(event["queue_id"])[:32],
+        "message_id": (event.get("message_id") or None) and str(event["message_id"]).strip("<>")[:255],
+        "created_at": event_time(event),
+    }
+
+
+def reject_row(event: dict, default_reason: str) -> dict:
+    return {
+        "sender": event.get("sender"),
+        "recipient": event.get("recipient"),
+        "client_ip": event.get("client_ip"),
+        "reason": event.get("reason") or default_reason,
+        "created_at": event_time(event),
+    }
+
+
+def parse_events(body: bytes, content_type: str) -> list[dict]:
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        events = [json.loads(line) for line in body.splitlines() if line.strip()]
+    else:
+        payload = json.loads(body or b"[]")
+        events = payload if isinstance(payload, list) else [payload]
+    if not all(isinstance(e, dict) for e in events):
+        raise ValueError("events must be JSON objects")
+    return events
+
+
+class IngestBuffer:
+    """Collects smtp events in memory and writes them with multi-row INSERTs."""
+
+    def __init__(self, session_factory, reject_reason, batch_size=500, flush_interval=0.2, max_pending=50000):
+        self.session_factory = session_factory
+        self.reject_reason = reject_reason
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: list[dict] = []
+        # taken by the writer but not committed yet; counts against max_pending until written
+        self._inflight = 0
+        # rollup counts of rows written elsewhere (/api/smtp-event), upserted with the next flush
+        self._rollups: Counter = Counter()
+        self._oldest = 0.0
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def submit(self, events: list[dict], timeout: float = 5.0):
+        if len(events) > self.max_pending:
+            raise BufferFull(f"batch of {len(events)} exceeds buffer capacity {self.max_pending}")
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self._pending) + self._inflight + len(events) > self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BufferFull("ingest buffer full")
+                self._cond.wait(remaining)
+            # the first event arms the writer's flush_interval timer, a full batch flushes at once
+            if not self._pending:
+                self._oldest = time.monotonic()
+                self._cond.notify_all()
+            self._pending.extend(events)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    def add_rollups(self, counts: Counter):
+        with self._cond:
+            if not self._pending and not self._rollups:
+                self._oldest = time.monotonic()
+                self._cond.notify_all()
+            self._rollups.update(counts)
+
+    def _take(self) -> tuple[list[dict], Counter]:
+        with self._cond:
+            while not self._stop:
+                if len(self._pending) >= self.batch_size:
+                    break
+                if self._pending or self._rollups:
+                    wait = self._oldest + self.flush_interval - time.monotonic()
+                    if wait <= 0:
+                        break
+                else:
+                    wait = None
+                self._cond.wait(wait)
+            batch, self._pending = self._pending, []
+            counts, self._rollups = self._rollups, Counter()
+            self._inflight = len(batch)
+            self._oldest = time.monotonic()
+            return batch, counts
+
+    def _run(self):
+        while True:
+            batch, counts = self._take()
+            if batch:
+                self.flush(batch)
+            if counts:
+                self._flush_rollups(counts)
+            with self._cond:
+                if self._stop and not self._pending and not self._rollups:
+                    return
+
+    def _flush_rollups(self, counts: Counter):
+        db = self.session_factory()
+        try:
+            apply_rollups(db, counts)
+            db.commit()
+        except Exception:
+            db.rollback()
+            log.exception("rollup flush failed, retrying with the next one")
+            with self._cond:
+                self._rollups.update(counts)
+            time.sleep(1)
+        finally:
+            db.close()
+
+    def flush(self, events: list[dict]):
+        for i in range(0, len(events), self.batch_size):
+            chunk = events[i : i + self.batch_size]
+            try:
+                self._write(chunk)
+            except OperationalError:
+                # the database is gone; the rest goes back in order and stays within max_pending
+                log.exception("ingest flush failed, requeueing %d events", len(events) - i)
+                with self._cond:
+                    self._pending[:0] = events[i:]
+                    self._inflight = 0
+                time.sleep(1)
+                return
+            except Exception:
+                log.exception("ingest batch rejected, retrying row by row")
+                for ev in chunk:
+                    try:
+                        self._write([ev])
+                    except Exception:
+                        INGEST_DROPPED.inc()
+                        log.exception("dropping smtp event: %r", ev)
+            with self._cond:
+                self._inflight = max(0, self._inflight - len(chunk))
+                self._cond.notify_all()
+
+    def _write(self, events: list[dict]):
+        mails = [mail_row(e) for e in events if e.get("type") != "reject"]
+        rejects = [e for e in events if e.get("type") == "reject"]
+        started = time.perf_counter()
+        db = self.session_factory()
+        try:
+            if mails:
+                db.execute(insert(MailLog), mails)
+            if rejects:
+                reason = self.reject_reason(db) if any(not e.get("reason") for e in rejects) else "rejected"
+                rejects = [reject_row(e, reason) for e in rejects]
+                db.execute(insert(RejectionLog), rejects)
+            apply_rollups(db, collect(mails, rejects))
+            apply_traces(db, mails)
+            db.commit()
+            self._notify(db, mails, rejects)
+            INGEST_WRITE_SECONDS.observe(time.perf_counter() - started)
+            INGEST_BATCH_ROWS.observe(len(events))
+            INGEST_ROWS.labels("mail").inc(len(mails))
+            INGEST_ROWS.labels("reject").inc(len(rejects))
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _notify(self, db, mails: list[dict], rejects: list[dict]):
+        # the rows are committed; a live-tail hiccup must not requeue them
+        if notify := notify_statement(mails, rejects):
+            try:
+                db.execute(*notify)
+                db.commit()
+            except Exception:
+                db.rollback()
+                log.warning("live-tail notify failed, viewers miss %d events", len(mails) + len(rejects), exc_info=True)
+
+
+def buffer_from_env(session_factory, reject_reason) -> IngestBuffer:
+    return IngestBuffer(
+        session_factory,
+        reject_reason,
+        batch_size=int(os.getenv("INGEST_BATCH_SIZE", "500")),
+        flush_interval=int(os.getenv("INGEST_FLUSH_MS", "200")) / 1000,
+        max_pending=int(os.getenv("INGEST_MAX_PENDING", "50000")),
+    )
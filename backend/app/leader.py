@@ -0,0 +1,84 @@
+import logging
+import os
+import socket
+import threading
+import time
+
+import psycopg
+
+log = logging.getLogger("mailrelay.leader")
+# pg advisory lock keys (arbitrary, but fixed for every worker of every version)
+JOBS_LOCK_KEY = 0x6D61696C0001
+STARTUP_LOCK_KEY = 0x6D61696C0002
+LEADER_ROW = "jobs_leader"
+
+
+class LeaderElection:
+    """Elects one process among all API workers to run the background jobs."""
+
+    def __init__(self, dsn: str, interval: float = 5.0, key: int = JOBS_LOCK_KEY):
+        self.dsn = dsn
+        self.interval = interval
+        self.key = key
+        self.identity = f"{socket.gethostname()}:{os.getpid()}"[:64]
+        self.on_elected: list = []
+        self._leader = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader.is_set()
+
+    def wait(self):
+        self._leader.wait()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="leader-election", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with psycopg.connect(self.dsn, autocommit=True) as conn:
+                    while True:
+                        if not self.is_leader and conn.execute("SELECT pg_try_advisory_lock(%s)", (self.key,)).fetchone()[0]:
+                            log.warning("%s elected to run background jobs", self.identity)
+                            self._leader.set()
+                            for fn in self.on_elected:
+                                try:
+                                    fn()
+                                except Exception:
+                                    log.exception("leader callback failed")
+                        if self.is_leader:
+                            # doubles as the liveness check of the connection that holds the lock
+                            conn.execute(
+                                "INSERT INTO cluster_locks (lock_name, node_id, heartbeat) VALUES (%s, %s, now() AT TIME ZONE 'utc') "
+                                "ON CONFLICT (lock_name) DO UPDATE SET node_id = EXCLUDED.node_id, heartbeat = EXCLUDED.heartbeat",
+                                (LEADER_ROW, self.identity),
+                            )
+                        time.sleep(self.interval)
+            except Exception:
+                if self.is_leader:
+                    log.exception("lost the leader connection, stepping down")
+                self._leader.clear()
+                time.sleep(self.interval)
+
+
+class startup_lock:
+    """Serializes schema migration and seeding when several workers start at once."""
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = psycopg.connect(self.dsn, autocommit=True)
+        self.conn.execute("SELECT pg_advisory_lock(%s)", (STARTUP_LOCK_KEY,))
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.conn.execute("SELECT pg_advisory_unlock(%s)", (STARTUP_LOCK_KEY,))
+        finally:
+            self.conn.close()
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import psycopg
+from sqlalchemy import text
+
+from .metrics import LIVE_DROPPED, LIVE_SUBSCRIBERS
+
+log = logging.getLogger("mailrelay.livetail")
+CHANNEL = "mail_events"
+# NOTIFY payloads are limited to 8000 bytes
+PAYLOAD_BYTES = 7900
+TEXT_CHARS = 500
+# touched by every worker that has viewers; ingest skips pg_notify once it is older than VIEWERS_TTL
+VIEWERS = Path(os.getenv("LIVE_TAIL_VIEWERS_FILE", "/tmp/mailrelay-live-viewers"))
+VIEWERS_TTL = 60.0
+HEARTBEAT = 10.0
+
+
+def enabled() -> bool:
+    return os.getenv("LIVE_TAIL", "1") == "1"
+
+
+def watched() -> bool:
+    """True while a worker of this node has had a viewer within VIEWERS_TTL. One stat(), no DB round trip."""
+    try:
+        return enabled() and time.time() - VIEWERS.stat().st_mtime < VIEWERS_TTL
+    except OSError:
+        return False
+
+
+def mail_event(row: dict) -> dict:
+    return {
+        "type": "mail",
+        "timestamp": row["created_at"].isoformat(),
+        "sender": row.get("sender"),
+        "recipient": row.get("recipient"),
+        "ip": row.get("client_ip"),
+        "status": row.get("status"),
+        "target": row.get("target"),
+        "tls": row.get("tls_used"),
+        "smtp_code": row.get("smtp_code"),
+        "smtp_text": (row.get("smtp_text") or "")[:TEXT_CHARS] or None,
+        "queue_id": row.get("queue_id"),
+    }
+
+
+def reject_event(row: dict) -> dict:
+    return {
+        "type": "reject",
+        "timestamp": row["created_at"].isoformat(),
+        "sender": row.get("sender"),
+        "recipient": row.get("recipient"),
+        "ip": row.get("client_ip"),
+        "status": "rejected",
+        "reason": (row.get("reason") or "")[:TEXT_CHARS],
+    }
+
+
+def payloads(mails: list[dict], rejects: list[dict]) -> list[str]:
+    """Packs the events of one ingest write into JSON arrays that fit a NOTIFY payload."""
+    out, part, size = [], [], 2
+    for ev in [*map(mail_event, mails), *map(reject_event, rejects)]:
+        item = json.dumps(ev, separators=(",", ":"))
+        if part and size + len(item) + 1 > PAYLOAD_BYTES:
+            out.append("[" + ",".join(part) + "]")
+            part, size = [], 2
+        part.append(item)
+        size += len(item) + 1
+    if part:
+        out.append("[" + ",".join(part) + "]")
+    return out
+
+
+def notify_statement(mails: list[dict], rejects: list[dict]):
+    """(statement, params) publishing the rows, or None; run it in its own transaction after the ingest commit."""
+    if not (mails or rejects) or not watched():
+        return None
+    return text("SELECT pg_notify(:channel, p) FROM unnest(CAST(:payloads AS text[])) AS p"), {"channel": CHANNEL, "payloads": payloads(mails, rejects)}
+
+
+@dataclass(frozen=True)
+class TailFilter:
+    sender: str | None = None
+    recipient: str | None = None
+    ip: str | None = None
+    status: str | None = None
+    target: str | None = None
+    kind: str | None = None
+
+    def matches(self, ev: dict) -> bool:
+        # case-insensitive substring, like the "contains" search mode
+        if self.kind and ev["type"] != self.kind:
+            return False
+        for field, value in (("sender", self.sender), ("recipient", self.recipient), ("ip", self.ip), ("status", self.status), ("target", self.target)):
+            if value and value.lower() not in (ev.get(field) or "").lower():
+                return False
+        return True
+
+
+class Subscription:
+    """One viewer. Holds at most `maxlen` undelivered SSE frames; on overflow the oldest are dropped and counted."""
+
+    def __init__(self, tail_filter: TailFilter, loop: asyncio.AbstractEventLoop, maxlen: int):
+        self.filter = tail_filter
+        self.maxlen = maxlen
+        self.dropped = 0
+        self._events: deque = deque()
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def offer(self, events: list[str]):
+        with self._lock:
+            was_empty = not self._events
+            self._events.extend(events)
+            over = len(self._events) - self.maxlen
+            if over > 0:
+                for _ in range(over):
+                    self._events.popleft()
+                self.dropped += over
+                LIVE_DROPPED.inc(over)
+        if was_empty:
+            self._loop.call_soon_threadsafe(self._ready.set)
+
+    async def next_batch(self, timeout: float) -> tuple[list[str], int]:
+        """Waits up to `timeout` for events; returns them with the number dropped since the last call."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                await asyncio.wait_for(self._ready.wait(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+            with self._lock:
+                self._ready.clear()
+                events, self._events = list(self._events), deque()
+                dropped, self.dropped = self.dropped, 0
+            # a wake-up scheduled before the previous drain finds nothing; keep waiting
+            if events or dropped or time.monotonic() >= deadline:
+                return events, dropped
+
+
+class LiveHub:
+    """Fans out ingested mail/reject events to the live-tail viewers of this worker."""
+
+    def __init__(self, max_subscribers: int = 500, buffer_events: int = 1000):
+        self.max_subscribers = max_subscribers
+        self.buffer_events = buffer_events
+        self._groups: dict[TailFilter, list[Subscription]] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._listener: threading.Thread | None = None
+        self._beat = 0.0
+
+    def subscribe(self, tail_filter: TailFilter) -> Subscription | None:
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            sub = Subscription(tail_filter, asyncio.get_running_loop(), self.buffer_events)
+            self._groups.setdefault(tail_filter, []).append(sub)
+            self._count += 1
+        LIVE_SUBSCRIBERS.inc()
+        self.heartbeat(force=True)
+        return sub
+
+    def heartbeat(self, force: bool = False):
+        """Marks this node as watched while there are viewers; at most every HEARTBEAT seconds."""
+        now = time.time()
+        if not self._count or (not force and now - self._beat < HEARTBEAT):
+            return
+        self._beat = now
+        try:
+            VIEWERS.touch()
+        except OSError:
+            log.exception("cannot touch %s, ingest will not publish live events", VIEWERS)
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            group = self._groups.get(sub.filter, [])
+            if sub in group:
+                group.remove(sub)
+                self._count -= 1
+                LIVE_SUBSCRIBERS.dec()
+            if not group:
+                self._groups.pop(sub.filter, None)
+
+    def subscribers(self) -> int:
+        return self._count
+
+    def publish(self, events: list[dict]):
+        with self._lock:
+            groups = [(f, list(subs)) for f, subs in self._groups.items()]
+        # every event is encoded once, not once per viewer; subscriptions queue the finished SSE frames
+        frames = [sse(ev["type"], ev) for ev in events]
+        for tail_filter, subs in groups:
+            matched = frames if tail_filter == TailFilter() else [frame for ev, frame in zip(events, frames) if tail_filter.matches(ev)]
+            if matched:
+                for sub in subs:
+                    sub.offer(matched)
+
+    def dispatch(self, payload: str):
+        if not self._count:
+            return
+        try:
+            events = json.loads(payload)
+        except ValueError:
+            log.warning("ignoring malformed %s payload", CHANNEL)
+            return
+        self.publish(events)
+
+    def start_listener(self, dsn: str):
+        if self._listener is None:
+            self._listener = threading.Thread(target=self._listen, args=(dsn,), name="livetail-listener", daemon=True)
+            self._listener.start()
+
+    def _listen(self, dsn: str):
+        while True:
+            try:
+                with psycopg.connect(dsn, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {CHANNEL}")
+                    for n in conn.notifies():
+                        self.dispatch(n.payload)
+            except Exception:
+                log.exception("live-tail LISTEN connection lost")
+                time.sleep(5)
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def stream(hub: LiveHub, sub: Subscription, keepalive: float = 15.0):
+    """Server-sent events for one subscription: `mail`/`reject` per event, `dropped` after an overflow."""
+    try:
+        yield sse("hello", {"filter": asdict(sub.filter), "buffer": sub.maxlen})
+        while True:
+            hub.heartbeat()
+            events, dropped = await sub.next_batch(keepalive)
+            if dropped:
+                yield sse("dropped", {"count": dropped})
+            if events:
+                yield "".join(events)
+            elif not dropped:
+                yield ": keepalive\n\n"
+    finally:
+        hub.unsubscribe(sub)
+
+
+def hub_from_env() -> LiveHub:
+    return LiveHub(
+        max_subscribers=int(os.getenv("LIVE_TAIL_MAX_SUBSCRIBERS", "500")),
+        buffer_events=int(os.getenv("LIVE_TAIL_BUFFER_EVENTS", "1000")),
+    )
@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .ingest import BufferFull
+
+log = logging.getLogger("mailrelay.logtail")
+
+LINE_RE = re.compile(
+    r"^(?P<ts>\d{4}-\d\d-\d\dT\S+|[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d) \S+ postfix(?:/[\w-]+)*/(?P<svc>[\w-]+)\[(?P<pid>\d+)\]: (?P<msg>.*)$"
+)
+QID_RE = re.compile(r"^(?P<qid>[0-9A-F]{6,}|[0-9A-Za-z]{10,}): (?P<rest>.*)$")
+CLIENT_RE = re.compile(r"client=(?P<name>[^\[\s]*)\[(?P<ip>[^\]]+)\]")
+FROM_RE = re.compile(r"from=<(?P<v>[^>]*)>")
+TO_RE = re.compile(r"to=<(?P<v>[^>]*)>")
+HELO_RE = re.compile(r"helo=<(?P<v>[^>]*)>")
+RELAY_RE = re.compile(r"relay=(?P<v>[^,\s]+)")
+STATUS_RE = re.compile(r"status=(?P<status>\w+)(?: \((?P<text>.*)\))?$")
+DSN_RE = re.compile(r"dsn=(?P<v>[\d.]+)")
+CODE_RE = re.compile(r"^(?:host \S+ said: )?(?P<code>[245]\d\d)\b")
+TLS_RE = re.compile(r"TLS connection established (?:from|to) ")
+REJECT_RE = re.compile(r"^NOQUEUE: reject: \w+ from [^\[]*\[(?P<ip>[^\]]+)\]: (?P<reason>.*?); (?P<tail>from=.*)$")
+
+STATUS_MAP = {"sent": "ok", "deferred": "deferred", "bounced": "bounced", "expired": "bounced"}
+
+
+def parse_timestamp(ts: str, now: datetime | None = None) -> datetime:
+    if ts[:4].isdigit():
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+        return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt.tzinfo else dt
+    now = now or datetime.utcnow()
+    dt = datetime.strptime(f"{now.year} {ts}", "%Y %b %d %H:%M:%S")
+    # syslog timestamps carry no year; a date in the future belongs to last year
+    return dt.replace(year=now.year - 1) if (dt - now).days > 1 else dt
+
+
+class PostfixLogParser:
+    """Correlates smtpd/cleanup/qmgr/smtp lines by queue-ID into delivery events."""
+
+    def __init__(self, max_inflight: int = 100000, skip_reject: re.Pattern | None = None):
+        self.max_inflight = max_inflight
+        # rejects matching skip_reject are recorded elsewhere (e.g. by the policy service)
+        self.skip_reject = skip_reject
+        self.inflight: OrderedDict[str, dict] = OrderedDict()
+        self.tls_pids: OrderedDict[str, bool] = OrderedDict()
+        self.evicted = 0
+
+    def _remember(self, table: OrderedDict, key: str, value):
+        table[key] = value
+        table.move_to_end(key)
+        if len(table) > self.max_inflight:
+            table.popitem(last=False)
+            if table is self.inflight:
+                self.evicted += 1
+
+    def _msg(self, qid: str) -> dict:
+        m = self.inflight.get(qid)
+        if m is None:
+            m = {}
+            self._remember(self.inflight, qid, m)
+        else:
+            self.inflight.move_to_end(qid)
+        return m
+
+    def feed(self, line: str) -> dict | None:
+        m = LINE_RE.match(line)
+        if not m:
+            return None
+        svc, pid, msg = m.group("svc"), m.group("pid"), m.group("msg")
+        proc = f"{svc}[{pid}]"
+        if TLS_RE.search(msg):
+            self._remember(self.tls_pids, proc, True)
+            return None
+        if msg.startswith(("disconnect from", "connect from")) and svc == "smtpd":
+            self.tls_pids.pop(proc, None)
+            return None
+        if msg.startswith("NOQUEUE: reject:"):
+            if self.skip_reject and self.skip_reject.search(msg):
+                return None
+            return self._reject(m.group("ts"), msg)
+        q = QID_RE.match(msg)
+        if not q:
+            return None
+        qid, rest = q.group("qid"), q.group("rest")
+        if rest == "removed":
+            self.inflight.pop(qid, None)
+            return None
+        state = self._msg(qid)
+        if svc == "smtpd" and rest.startswith("client="):
+            c = CLIENT_RE.search(rest)
+            if c:
+                state["client_ip"] = c.group("ip")
+            state["tls_in"] = self.tls_pids.get(proc, False)
+        h = HELO_RE.search(rest)
+        if h:
+            state["helo"] = h.group("v")
+        if svc == "qmgr" and rest.startswith("from="):
+            f = FROM_RE.search(rest)
+            if f:
+                state["sender"] = f.group("v")
+            return None
+        if svc == "cleanup" and rest.startswith("message-id="):
+            state["message_id"] = rest[len("message-id=") :].strip("<>")
+            return None
+        if " status=" in rest and rest.startswith("to="):
+            return self._delivery(m.group("ts"), qid, state, proc, rest)
+        return None
+
+    def _delivery(self, ts: str, qid: str, state: dict, proc: str, rest: str) -> dict | None:
+        st = STATUS_RE.search(rest)
+        to = TO_RE.search(rest)
+        if not st or not to:
+            return None
+        text = st.group("text") or ""
+        code = CODE_RE.match(text)
+        relay = RELAY_RE.search(rest)
+        dsn = DSN_RE.search(rest)
+        tls_out = self.tls_pids.pop(proc, False)
+        return {
+            "queue_id": qid,
+            "message_id": state.get("message_id"),
+            "sender": state.get("sender"),
+            "recipient": to.group("v"),
+            "client_ip": state.get("client_ip"),
+            "helo": state.get("helo"),
+            "target": relay.group("v") if relay else None,
+            "tls_used": bool(state.get("tls_in") or tls_out),
+            "smtp_code": code.group("code") if code else (dsn.group("v") if dsn else None),
+            "smtp_text": text or None,
+            "status": STATUS_MAP.get(st.group("status"), st.group("status")),
+            "created_at": parse_timestamp(ts),
+        }
+
+    def _reject(self, ts: str, msg: str) -> dict | None:
+        r = REJECT_RE.match(msg)
+        if not r:
+            return None
+        tail = r.group("tail")
+        f, to, h = FROM_RE.search(tail), TO_RE.search(tail), HELO_RE.search(tail)
+        return {
+            "type": "reject",
+            "sender": f.group("v") if f else None,
+            "recipient": to.group("v") if to else None,
+            "client_ip": r.group("ip"),
+            "helo": h.group("v") if h else None,
+            "reason": r.group("reason"),
+            "created_at": parse_timestamp(ts),
+        }
+
+
+class LogTailer:
+    """Follows a Postfix log file across rotations and hands parsed events to `sink` in batches."""
+
+    def __init__(self, path, state_path, sink, parser: PostfixLogParser | None = None, batch_size: int = 500, poll_interval: float = 0.5):
+        self.path = Path(path)
+        self.state_path = Path(state_path)
+        self.sink = sink
+        self.parser = parser or PostfixLogParser()
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.fh = None
+        self.inode = None
+        self.offset = 0
+        self.lines = 0
+
+    def _load_state(self) -> dict:
+        try:
+            return json.loads(self.state_path.read_text())
+        except Exception:
+            return {}
+
+    def _save_state(self):
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"inode": self.inode, "offset": self.offset}))
+        os.replace(tmp, self.state_path)
+
+    def _open(self, resume: bool) -> bool:
+        try:
+            fh = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        st = os.fstat(fh.fileno())
+        state = self._load_state() if resume else {}
+        self.offset = state.get("offset", 0) if state.get("inode") == st.st_ino and state.get("offset", 0) <= st.st_size else 0
+        fh.seek(self.offset)
+        self.fh, self.inode = fh, st.st_ino
+        return True
+
+    def _rotated(self) -> bool:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return st.st_ino != self.inode or st.st_size < self.offset
+
+    def _emit(self, events: list[dict]):
+        while True:
+            try:
+                self.sink(events)
+                break
+            except BufferFull:
+                time.sleep(self.poll_interval)
+        self._save_state()
+
+    def _drain(self) -> int:
+        events, n = [], 0
+        while True:
+            line = self.fh.readline()
+            if not line or not line.endswith(b"\n"):
+                # leave a partially written line for the next poll
+                self.fh.seek(self.offset)
+                break
+            self.offset += len(line)
+            n += 1
+            ev = self.parser.feed(line.decode("utf-8", "replace").rstrip("\n"))
+            if ev:
+                events.append(ev)
+                if len(events) >= self.batch_size:
+                    self._emit(events)
+                    events = []
+        if events:
+            self._emit(events)
+        elif n:
+            self._save_state()
+        self.lines += n
+        return n
+
+    def poll(self) -> int:
+        if self.fh is None and not self._open(resume=True):
+            return 0
+        n = self._drain()
+        if self._rotated():
+            n += self._drain()
+            self.fh.close()
+            self.fh = None
+            if self._open(resume=False):
+                n += self._drain()
+        return n
+
+    def run_forever(self, active=lambda: True):
+        # returns once `active()` turns false (e.g. leadership lost); the saved offset lets the next tailer resume
+        while active():
+            try:
+                if self.poll() == 0:
+                    time.sleep(self.poll_interval)
+            except Exception:
+                log.exception("postfix log tailer failed")
+                if self.fh:
+                    self.fh.close()
+                self.fh = None
+                time.sleep(5)
+        if self.fh:
+            self.fh.close()
+            self.fh = None
@@ -0,0 +1,366 @@
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+
+from fastapi import Query
+
+from .render import write_atomic
+from .rollups import normalize_reason
+
+log = logging.getLogger("mailrelay.mailqueue")
+SPOOL = Path(os.getenv("POSTFIX_SPOOL", "/var/spool/postfix"))
+# written by the leader's index, read by the other workers of the container
+SNAPSHOT = Path(os.getenv("QUEUE_INDEX_SNAPSHOT", "/tmp/mailrelay-queue-index.pickle"))
+QUEUES = ("maildrop", "incoming", "active", "deferred", "hold", "corrupt")
+# Postfix only renames files into and out of these queues, it never rewrites them in place
+STABLE_QUEUES = ("deferred", "hold", "corrupt")
+ACTIONS = ("flush", "hold", "release", "delete")
+QUEUE_ID_RE = re.compile(r"^[0-9A-Za-z]{6,32}$")
+AGGREGATES = ("queue", "sender", "sender_domain", "recipient_domain", "reason")
+MAX_RCPTS_LISTED = 20
+
+# Postfix record types (src/global/rec_type.h) that matter for the envelope
+REC_SIZE, REC_TIME, REC_FROM, REC_RCPT, REC_MESG, REC_PTR, REC_END = b"C", b"T", b"S", b"R", b"M", b"p", b"E"
+
+
+def read_records(f):
+    """Yields (type, data) of a Postfix queue file, following pointer records and skipping the message content."""
+    content_size = 0
+    while True:
+        t = f.read(1)
+        if not t:
+            return
+        length, shift = 0, 0
+        while True:
+            c = f.read(1)
+            if not c:
+                return
+            length |= (c[0] & 0x7F) << shift
+            if not c[0] & 0x80:
+                break
+            shift += 7
+        data = f.read(length)
+        if t == REC_SIZE:
+            content_size = int(data.split()[0])
+        elif t == REC_MESG:
+            # same as qmgr: jump over the content to the extracted segment
+            f.seek(content_size, os.SEEK_CUR)
+        elif t == REC_PTR:
+            offset = int(data or 0)
+            if offset:
+                f.seek(offset)
+            continue
+        yield t, data
+        if t == REC_END:
+            return
+
+
+def read_envelope(path: str) -> dict | None:
+    sender, rcpts, arrival = None, [], None
+    try:
+        with open(path, "rb") as f:
+            for t, data in read_records(f):
+                if t == REC_TIME:
+                    arrival = int(data.split()[0])
+                elif t == REC_FROM:
+                    sender = data.decode(errors="replace").lower()
+                elif t == REC_RCPT:
+                    # delivered recipients get their record type overwritten, so only pending ones remain R
+                    rcpts.append(data.decode(errors="replace").lower())
+    except (OSError, ValueError):
+        return None
+    if sender is None:
+        # cleanup has not finished writing the file yet
+        return None
+    return {"sender": sender, "recipients": rcpts, "arrival": arrival}
+
+
+def read_defer_log(path: str) -> str | None:
+    """First deferral reason from the bounce/defer log of a message (name=value lines, blank line per recipient)."""
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                if line.startswith(b"reason="):
+                    return line[7:].decode(errors="replace").strip()
+    except OSError:
+        pass
+    return None
+
+
+def domain_of(address: str) -> str:
+    return address.rpartition("@")[2]
+
+
+@dataclass
+class QueueFilter:
+    queue: str | None = None
+    sender: str | None = None
+    recipient_domain: str | None = None
+    reason: str | None = None
+    min_age: int | None = None
+
+
+def queue_filter(
+    queue: str | None = Query(default=None, pattern="^(" + "|".join(QUEUES) + ")$"),
+    sender: str | None = None,
+    recipient_domain: str | None = None,
+    reason: str | None = None,
+    min_age: int | None = Query(default=None, ge=0, description="seconds since arrival"),
+) -> QueueFilter:
+    return QueueFilter(queue, sender, recipient_domain, reason, min_age)
+
+
+class QueueIndex:
+    """In-memory index of the Postfix spool by queue ID, queue, sender, recipient domain and deferral reason."""
+
+    def __init__(self, spool: Path = SPOOL, min_interval: float = 2.0, snapshot: Path | None = None, owner=lambda: True):
+        self.spool = spool
+        self.min_interval = min_interval
+        self.snapshot = snapshot
+        self.owner = owner
+        self._snapshot_sig = None
+        self._changed = False
+        self.entries: dict[str, dict] = {}
+        self._keys: dict[str, tuple] = {}
+        # directory -> ((inode, mtime_ns), {queue ID: (queue, path, key)}, subdirectories)
+        self._dirs: dict[Path, tuple] = {}
+        self._by: dict[str, defaultdict[str, set]] = {k: defaultdict(set) for k in ("queue", "sender", "recipient_domain", "reason")}
+        self._order: list[str] | None = None
+        self._scanned = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"scans": 0, "parsed": 0, "last_scan_seconds": 0.0}
+
+    def _index(self, qid: str, e: dict, add: bool):
+        values = {"queue": [e["queue"]], "sender": [e["sender"]], "recipient_domain": e["domains"], "reason": [e["reason_key"]] if e["reason_key"] else []}
+        for dim, keys in values.items():
+            for k in keys:
+                s = self._by[dim][k]
+                if add:
+                    s.add(qid)
+                else:
+                    s.discard(qid)
+                    if not s:
+                        del self._by[dim][k]
+
+    def _drop(self, qid: str):
+        e = self.entries.pop(qid, None)
+        if e:
+            self._index(qid, e, False)
+        self._keys.pop(qid, None)
+        self._order = None
+        self._changed = True
+
+    def _put(self, qid: str, e: dict):
+        self._drop(qid)
+        self.entries[qid] = e
+        self._index(qid, e, True)
+        self._order = None
+        self._changed = True
+
+    def _list(self, root: Path, q: str, out: dict):
+        # deferred and defer are hashed into subdirectories (hash_queue_names)
+        try:
+            st = root.stat()
+        except FileNotFoundError:
+            return
+        sig = (st.st_ino, st.st_mtime_ns)
+        cached = self._dirs.get(root)
+        if cached and cached[0] == sig and q in STABLE_QUEUES:
+            files, subdirs = cached[1], cached[2]
+        else:
+            files, subdirs = {}, []
+            try:
+                with os.scandir(root) as it:
+                    for e in it:
+                        if e.is_dir(follow_symlinks=False):
+                            subdirs.append(Path(e.path))
+                        elif e.is_file(follow_symlinks=False):
+                            try:
+                                fst = e.stat(follow_symlinks=False)
+                            except FileNotFoundError:
+                                continue
+                            files[e.name] = (q, e.path, (fst.st_ino, fst.st_size, fst.st_mtime_ns))
+            except FileNotFoundError:
+                return
+            self._dirs[root] = (sig, files, subdirs)
+        out.update(files)
+        for d in subdirs:
+            self._list(d, q, out)
+
+    def refresh(self, force: bool = False):
+        if self.snapshot and not self.owner():
+            self._load()
+            return
+        with self._lock:
+            if not force and time.monotonic() - self._scanned < self.min_interval:
+                return
+            started = time.perf_counter()
+            seen = {}
+            for q in QUEUES:
+                self._list(self.spool / q, q, seen)
+            for qid in [q for q in self.entries if q not in seen]:
+                self._drop(qid)
+            parsed = 0
+            for qid, (q, path, key) in seen.items():
+                old = self.entries.get(qid)
+                if old is not None and self._keys.get(qid) == key:
+                    if old["queue"] != q:
+                        # moved between queues (e.g. deferred -> active): same file, only the queue changes
+                        self._index(qid, old, False)
+                        old["queue"], old["path"] = q, path
+                        old["next_attempt"] = key[2] // 1_000_000_000 if q == "deferred" else None
+                        self._index(qid, old, True)
+                        self._changed = True
+                    continue
+                env = read_envelope(path)
+                if env is None:
+                    continue
+                parsed += 1
+                # the defer log mirrors the hashed path of the deferred queue file
+                reason = read_defer_log(str(self.spool / "defer" / os.path.relpath(path, self.spool / "deferred"))) if q == "deferred" else None
+                self._put(
+                    qid,
+                    {
+                        "id": qid,
+                        "queue": q,
+                        "path": path,
+                        **env,
+                        "domains": sorted({domain_of(r) for r in env["recipients"]}),
+                        "size": key[1],
+                        # for deferred mail Postfix keeps the next retry time in the file mtime
+                        "next_attempt": key[2] // 1_000_000_000 if q == "deferred" else None,
+                        "reason": reason,
+                        "reason_key": normalize_reason(reason) if reason else "",
+                    },
+                )
+                self._keys[qid] = key
+            self._scanned = time.monotonic()
+            self.stats["scans"] += 1
+            self.stats["parsed"] += parsed
+            self.stats["last_scan_seconds"] = round(time.perf_counter() - started, 4)
+            if self.snapshot and (self._changed or not self.snapshot.exists()):
+                self._save()
+            self._changed = False
+
+    def _save(self):
+        # one pickle for all structures, so the strings shared between entries and sets are stored once
+        state = (self.entries, self._by, self._keys, self._dirs, self.stats)
+        try:
+            write_atomic(self.snapshot, pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+            self._snapshot_sig = self._sig()
+        except OSError:
+            log.exception("writing queue index snapshot %s failed", self.snapshot)
+
+    def _sig(self):
+        try:
+            st = self.snapshot.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def _load(self):
+        sig = self._sig()
+        if sig is None or sig == self._snapshot_sig:
+            return
+        with self._lock:
+            try:
+                with open(self.snapshot, "rb") as f:
+                    state = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                log.exception("reading queue index snapshot %s failed", self.snapshot)
+                return
+            # keys and directory signatures come along, so a worker that becomes the owner scans incrementally
+            self.entries, self._by, self._keys, self._dirs, stats = state
+            self.stats = {**stats}
+            self._order = None
+            self._snapshot_sig = sig
+
+    def counts(self) -> dict[str, int]:
+        """Messages per queue from the index (queue-depth metric, dashboard)."""
+        self.refresh()
+        with self._lock:
+            return {q: len(self._by["queue"].get(q, ())) for q in QUEUES}
+
+    def _ordered(self) -> list[str]:
+        if self._order is None:
+            self._order = sorted(self.entries, key=lambda q: (self.entries[q]["arrival"] or 0, q))
+        return self._order
+
+    def select(self, f: QueueFilter) -> list[str]:
+        """Queue IDs matching `f`, oldest first."""
+        with self._lock:
+            sets = []
+            if f.queue:
+                sets.append(self._by["queue"].get(f.queue, set()))
+            if f.sender:
+                sets.append(self._by["sender"].get(f.sender.lower(), set()))
+            if f.recipient_domain:
+                sets.append(self._by["recipient_domain"].get(f.recipient_domain.lower().lstrip("@"), set()))
+            if f.reason:
+                needle = f.reason.lower()
+                sets.append(set().union(*(ids for k, ids in self._by["reason"].items() if needle in k.lower())))
+            cutoff = time.time() - f.min_age if f.min_age else None
+            if sets:
+                sets.sort(key=len)
+                ids = sets[0].intersection(*sets[1:])
+                ordered = sorted(ids, key=lambda q: (self.entries[q]["arrival"] or 0, q))
+            else:
+                ordered = self._ordered()
+            if cutoff is not None:
+                ordered = [q for q in ordered if (self.entries[q]["arrival"] or 0) <= cutoff]
+            return list(ordered)
+
+    def get(self, qid: str) -> dict | None:
+        return self.entries.get(qid)
+
+    def aggregate(self, ids: list[str], by: str, limit: int) -> list[dict]:
+        counts, oldest = Counter(), {}
+        for qid in ids:
+            e = self.entries.get(qid)
+            if e is None:
+                continue
+            if by == "recipient_domain":
+                keys = e["domains"]
+            elif by == "sender_domain":
+                keys = [domain_of(e["sender"])]
+            elif by == "reason":
+                keys = [e["reason_key"]]
+            else:
+                keys = [e[by]]
+            for k in keys:
+                counts[k] += 1
+                if k not in oldest or (e["arrival"] or 0) < oldest[k]:
+                    oldest[k] = e["arrival"] or 0
+        return [{"key": k, "count": n, "oldest_arrival": oldest[k]} for k, n in counts.most_common(limit)]
+
+
+def entry_out(e: dict, full: bool = False) -> dict:
+    rcpts = e["recipients"] if full else e["recipients"][:MAX_RCPTS_LISTED]
+    return {
+        "id": e["id"],
+        "queue": e["queue"],
+        "sender": e["sender"],
+        "recipients": rcpts,
+        "recipient_count": len(e["recipients"]),
+        "size": e["size"],
+        "arrival": e["arrival"],
+        "age_seconds": int(time.time() - e["arrival"]) if e["arrival"] else None,
+        "next_attempt": e["next_attempt"],
+        "reason": e["reason"],
+    }
+
+
+def request_action(directory: Path, action: str, ids: list[str]) -> str:
+    """Hands a bulk action to the Postfix container (postfix/entrypoint.sh runs postsuper/postqueue on it)."""
+    ids = [q for q in ids if QUEUE_ID_RE.match(q)]
+    d = directory / "queue-actions"
+    d.mkdir(parents=True, exist_ok=True)
+    name = f"{time.time_ns()}.{action}"
+    write_atomic(d / name, "".join(f"{q}\n" for q in ids))
+    return name
@@ -1,51 +1,205 @@
+import asyncio
 import csv
-import io
 import json
+import logging
 import os
-import socket
-import subprocess
 import threading
 import time
 from datetime import datetime, timedelta
 from pathlib import Path
 
+import httpx
 import requests
-from fastapi import Depends, FastAPI, Header, HTTPException, Query
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy import desc, func, text
+from sqlalchemy import desc, func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from . import archive, cache, configimport, health, livetail, metrics, migrations, partitions, render, replication, rollups, routing, traces
 from .auth import create_token, decode_token, hash_password, verify_password
-from .db import get_db
-from .models import AuditLog, ClusterLock, ClusterSetting, ConfigVersion, DomainPolicy, MailLog, RelayRoute, RejectionLog, User
-from .schemas import ClusterSettingsRequest, DomainRequest, LoginRequest, RouteRequest, UserCreateRequest, UserUpdateRequest
+from .db import SessionLocal, async_engine, get_async_db, get_db, psycopg_dsn
+from .export import export_stream
+from .ingest import BufferFull, buffer_from_env, mail_row, parse_events, reject_row
+from .leader import LEADER_ROW, LeaderElection, startup_lock
+from .logtail import LogTailer, PostfixLogParser
+from .mailqueue import ACTIONS, AGGREGATES, QUEUE_ID_RE, QUEUES, SNAPSHOT, QueueFilter, QueueIndex, entry_out, queue_filter, request_action
+from .models import AuditLog, ClusterLock, ClusterSetting, ConfigVersion, DomainPolicy, MailLog, RateLimit, RelayRoute, RelayTargetHealth, RejectionLog, TrafficRollup, User
+from .policy import RECORDED_REJECTS, PolicyIndex, PolicyServer, listen_address, load_index
+from .ratelimit import RateLimiter, limit_out
+from .schemas import ClusterSettingsRequest, DomainRequest, LoginRequest, QueueActionRequest, RateLimitRequest, RouteRequest, RouteTargetsRequest, RouteTransportRequest, UserCreateRequest, UserUpdateRequest
+from .search import MailFilter, decode_cursor, encode_cursor, filtered_mail_query, filtered_mail_select, keyset_page, mail_conditions, mail_filter, mail_out
 
 app = FastAPI(title="Mail Relay HA API")
 security = HTTPBearer()
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(metrics.RequestMetrics)
 GENERATED = Path("/generated")
 GENERATED.mkdir(parents=True, exist_ok=True)
 RUNTIME = Path("/runtime")
 RUNTIME.mkdir(parents=True, exist_ok=True)
 CERT_DIR = Path("/certs")
 CERT_DIR.mkdir(parents=True, exist_ok=True)
+config_notifier = replication.ConfigNotifier()
+live_hub = livetail.hub_from_env()
+ingest_buffer = buffer_from_env(SessionLocal, lambda db: get_effective_cluster_settings(db).get("reject_response_message", "rejected"))
+rate_limiter = RateLimiter(max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
+peer_http = httpx.AsyncClient(timeout=2, verify=False)
+# sync, retention, log tailing and runtime artifacts run in exactly one of the API worker processes
+leader = LeaderElection(psycopg_dsn(), interval=float(os.getenv("LEADER_INTERVAL_SECONDS", "5")))
+# the spool index too: the leader scans, the other workers load its snapshot
+queue_index = QueueIndex(snapshot=SNAPSHOT, owner=lambda: leader.is_leader)
+metrics.queue_depth_source = queue_index.counts
+policy_server = PolicyServer(PolicyIndex([]), lambda events: ingest_buffer.submit(events, timeout=1), limiter=rate_limiter)
+health_checker = health.HealthChecker(
+    lambda: with_session(health.load_targets),
+    lambda results, targets: with_session(health.record_results, results, targets),
+    interval=float(os.getenv("HEALTH_INTERVAL_SECONDS", "30")),
+    timeout=float(os.getenv("HEALTH_TIMEOUT_SECONDS", "5")),
+    concurrency=int(os.getenv("HEALTH_CONCURRENCY", "200")),
+    max_backoff=float(os.getenv("HEALTH_MAX_BACKOFF_SECONDS", "600")),
+    ehlo=os.getenv("HEALTH_EHLO", "1") == "1",
+    starttls=os.getenv("HEALTH_STARTTLS", "1") == "1",
+)
+READY_DB_TIMEOUT = float(os.getenv("READY_DB_TIMEOUT_SECONDS", "0.5"))
+# Postfix picks up .reload within a few seconds; a request older than this means Postfix is not applying config
+READY_RELOAD_MAX_AGE = float(os.getenv("READY_RELOAD_MAX_AGE_SECONDS", "60"))
+
+
+
+
+TRAFFIC_ROLLUPS_DDL = """CREATE TABLE IF NOT EXISTS traffic_rollups (
+  granularity VARCHAR(1) NOT NULL, bucket TIMESTAMP NOT NULL, kind VARCHAR(8) NOT NULL,
+  status VARCHAR(32) NOT NULL DEFAULT '', target VARCHAR(255) NOT NULL DEFAULT '', tls_used BOOLEAN NOT NULL DEFAULT FALSE,
+  reason VARCHAR(255) NOT NULL DEFAULT '', count BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (granularity, bucket, kind, status, target, tls_used, reason)
+)"""
+RATE_LIMITS_DDL = """CREATE TABLE IF NOT EXISTS rate_limits (
+  id SERIAL PRIMARY KEY, scope VARCHAR(32) NOT NULL, match VARCHAR(255) NOT NULL DEFAULT '*',
+  max_messages INTEGER NOT NULL, window_seconds INTEGER NOT NULL DEFAULT 60, enabled BOOLEAN NOT NULL DEFAULT TRUE,
+  UNIQUE (scope, match)
+)"""
+# counters are rebuilt within one window after a crash, so they skip the WAL
+RATE_COUNTERS_DDL = """CREATE UNLOGGED TABLE IF NOT EXISTS rate_counters (
+  scope VARCHAR(32) NOT NULL, key VARCHAR(255) NOT NULL, window_seconds INTEGER NOT NULL, window_start BIGINT NOT NULL,
+  count BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (scope, key, window_seconds, window_start)
+)"""
+# one summary row per message, updated in place by the ingest path; fillfactor leaves room for HOT updates
+MAIL_TRACES_DDL = """CREATE TABLE IF NOT EXISTS mail_traces (
+  queue_id VARCHAR(32) PRIMARY KEY, message_id VARCHAR(255), sender VARCHAR(255), client_ip VARCHAR(64),
+  first_seen TIMESTAMP NOT NULL, last_seen TIMESTAMP NOT NULL,
+  attempts INTEGER NOT NULL DEFAULT 0, delivered INTEGER NOT NULL DEFAULT 0, deferred INTEGER NOT NULL DEFAULT 0, bounced INTEGER NOT NULL DEFAULT 0,
+  status VARCHAR(32) NOT NULL, last_target VARCHAR(255), last_smtp_code VARCHAR(32), last_smtp_text TEXT, tls_used BOOLEAN NOT NULL DEFAULT FALSE
+) WITH (fillfactor = 80)"""
+# current probe state per relay target; rewritten every check interval, so HOT updates matter
+RELAY_TARGET_HEALTH_DDL = """CREATE TABLE IF NOT EXISTS relay_target_health (
+  target VARCHAR(300) PRIMARY KEY, host VARCHAR(255) NOT NULL, port INTEGER NOT NULL,
+  up BOOLEAN NOT NULL DEFAULT FALSE, latency_ms DOUBLE PRECISION, failures INTEGER NOT NULL DEFAULT 0,
+  banner VARCHAR(255), tls BOOLEAN, error VARCHAR(255), checked_at TIMESTAMP NOT NULL, last_up TIMESTAMP
+) WITH (fillfactor = 70)"""
+RELAY_HEALTH_HISTORY_DDL = """CREATE TABLE IF NOT EXISTS relay_health_history (
+  target VARCHAR(300) NOT NULL, bucket TIMESTAMP NOT NULL,
+  checks INTEGER NOT NULL DEFAULT 0, ok INTEGER NOT NULL DEFAULT 0,
+  latency_sum DOUBLE PRECISION NOT NULL DEFAULT 0, latency_max DOUBLE PRECISION NOT NULL DEFAULT 0,
+  PRIMARY KEY (target, bucket)
+)"""
+
+
+LOG_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_mail_logs_created_at ON mail_logs (created_at DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_mail_logs_sender_lower ON mail_logs (lower(sender) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_mail_logs_recipient_lower ON mail_logs (lower(recipient) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_mail_logs_sender_domain ON mail_logs (lower(split_part(sender, '@', 2)) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_mail_logs_recipient_domain ON mail_logs (lower(split_part(recipient, '@', 2)) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_mail_logs_sender_trgm ON mail_logs USING gin (sender gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_mail_logs_recipient_trgm ON mail_logs USING gin (recipient gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_mail_logs_client_ip_trgm ON mail_logs USING gin (client_ip gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_mail_logs_target_trgm ON mail_logs USING gin (target gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_mail_logs_queue_id ON mail_logs (queue_id)",
+    "CREATE INDEX IF NOT EXISTS ix_mail_logs_message_id ON mail_logs (message_id)",
+    "CREATE INDEX IF NOT EXISTS ix_rejection_logs_created_at ON rejection_logs (created_at DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_mail_traces_message_id ON mail_traces (message_id)",
+]
+
+
+def migrate_baseline(db: Session):
+    # Handles upgrades on existing postgres volumes where init.sql is not re-run.
+    statements = [
+        "ALTER TABLE cluster_settings ADD COLUMN IF NOT EXISTS reject_response_message TEXT NOT NULL DEFAULT 'Relay konnte die Nachricht nicht verarbeiten. Bitte später erneut versuchen.'",
+        TRAFFIC_ROLLUPS_DDL,
+        RATE_LIMITS_DDL,
+        RATE_COUNTERS_DDL,
+        "ALTER TABLE mail_logs ADD COLUMN IF NOT EXISTS queue_id VARCHAR(32)",
+        "ALTER TABLE mail_logs ADD COLUMN IF NOT EXISTS message_id VARCHAR(255)",
+        "ALTER TABLE relay_routes ADD COLUMN IF NOT EXISTS targets JSONB",
+        "ALTER TABLE relay_routes ADD COLUMN IF NOT EXISTS concurrency_limit INTEGER",
+        "ALTER TABLE relay_routes ADD COLUMN IF NOT EXISTS rate_delay INTEGER",
+        "ALTER TABLE relay_routes ADD COLUMN IF NOT EXISTS recipient_limit INTEGER",
+        "ALTER TABLE relay_routes ADD COLUMN IF NOT EXISTS connection_cache BOOLEAN NOT NULL DEFAULT FALSE",
+        MAIL_TRACES_DDL,
+        RELAY_TARGET_HEALTH_DDL,
+        RELAY_HEALTH_HISTORY_DDL,
+        "CREATE INDEX IF NOT EXISTS ix_relay_health_history_bucket ON relay_health_history (bucket)",
+    ]
+    # every statement is idempotent; a failure aborts the step so it is not recorded and runs again next start
+    for stmt in statements:
+        db.execute(text(stmt))
+        db.commit()
+    retention_days = int(os.getenv("RETENTION_DAYS", "14"))
+    db.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    db.commit()
+    partitions.migrate_to_partitioned(db, retention_days)
+    partitions.ensure_partitions(db, days_back=retention_days)
+    # tables still being filled from <table>_legacy get their indexes after the load (legacy_migration_loop)
+    build_log_indexes(db, skip=set(partitions.legacy_tables(db)))
 
 
+def build_log_indexes(db: Session, only: set[str] | None = None, skip: set[str] | None = None):
+    # Index builds on big tables must not block ingest, so they run CONCURRENTLY outside a transaction.
+    # Partitioned parents don't support CONCURRENTLY; they get per-partition indexes attached to the parent.
+    partitioned = {t for t in partitions.PARTITIONED_TABLES if partitions.is_partitioned(db, t)}
+    db.commit()
+    failed = []
+    with db.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for stmt in LOG_INDEXES:
+            table = stmt.split(" ON ", 1)[1].split()[0]
+            if table in (skip or ()) or (only is not None and table not in only):
+                continue
+            # the other indexes are still built, then the step fails as a whole
+            try:
+                if table in partitioned:
+                    partitions.create_index_online(conn, stmt, table)
+                else:
+                    partitions.create_index_concurrently(conn, stmt)
+            except Exception:
+                logging.getLogger("mailrelay").exception("building index failed: %s", stmt)
+                failed.append(stmt)
+    if failed:
+        raise RuntimeError(f"{len(failed)} log indexes could not be built")
+
+
+# append new steps with the next version; a step that has run is never changed afterwards
+def migrate_config_history(db: Session):
+    # existing rows stay full; replication.compact_history turns them into deltas in the background
+    db.execute(text("ALTER TABLE config_versions ADD COLUMN IF NOT EXISTS kind VARCHAR(8) NOT NULL DEFAULT 'full'"))
+    db.commit()
+
+
+SCHEMA_MIGRATIONS = [
+    (1, "baseline", migrate_baseline),
+    (2, "config_versions.kind", migrate_config_history),
+]
 
 
 def migrate_schema_if_needed(db: Session):
-    # Handles upgrades on existing postgres volumes where init.sql is not re-run.
-    statements = [
-        "ALTER TABLE cluster_settings ADD COLUMN IF NOT EXISTS reject_response_message TEXT NOT NULL DEFAULT 'Relay konnte die Nachricht nicht verarbeiten. Bitte später erneut versuchen.'"
-    ]
-    for stmt in statements:
-        try:
-            db.execute(text(stmt))
-            db.commit()
-        except Exception:
-            db.rollback()
+    migrations.migrate(db, SCHEMA_MIGRATIONS)
+    # today's and the coming partitions, in case the node was down longer than the retention loop's look-ahead
+    partitions.ensure_partitions(db, days_back=0)
+
 
 def ensure_cluster_settings(db: Session):
     row = db.query(ClusterSetting).order_by(desc(ClusterSetting.id)).first()
@@ -102,6 +256,14 @@ def write_runtime_artifacts(settings: ClusterSetting):
 
 
 def get_effective_cluster_settings(db: Session):
+    return dict(cache.CACHES["settings"].get("effective", lambda: _load_effective_cluster_settings(db)))
+
+
+async def get_effective_cluster_settings_async(db: AsyncSession):
+    return dict(await cache.CACHES["settings"].aget("effective", lambda: db.run_sync(_load_effective_cluster_settings)))
+
+
+def _load_effective_cluster_settings(db: Session):
     s = ensure_cluster_settings(db)
     return {
         "node_id": s.node_id,
@@ -122,7 +284,8 @@ def get_effective_cluster_settings(db: Session):
 
 
 def seed_demo_mails(db: Session):
-    if db.query(MailLog).count() > 0 or db.query(RejectionLog).count() > 0:
+    # EXISTS stops at the first row; count() would scan both log tables on every start
+    if os.getenv("SEED_DEMO_MAILS", "1") != "1" or db.query(select(MailLog.id).exists()).scalar() or db.query(select(RejectionLog.id).exists()).scalar():
         return
     now = datetime.utcnow()
     demo = [
@@ -150,7 +313,7 @@ def seed_demo_mails(db: Session):
     db.commit()
 
 def init_admin(db: Session):
-    if db.query(User).count() == 0:
+    if not db.query(select(User.id).exists()).scalar():
         db.add(
             User(
                 username=os.getenv("ADMIN_DEFAULT_USER", "admin"),
@@ -164,72 +327,202 @@ def init_admin(db: Session):
 
 @app.on_event("startup")
 def startup():
+    started = time.perf_counter()
     db = next(get_db())
-    migrate_schema_if_needed(db)
-    init_admin(db)
-    seed_demo_mails(db)
-    write_runtime_artifacts(ensure_cluster_settings(db))
+    # with several workers starting at once, only one migrates and seeds at a time
+    with startup_lock(psycopg_dsn()):
+        migrate_schema_if_needed(db)
+        init_admin(db)
+        seed_demo_mails(db)
+        if db.query(TrafficRollup).first() is None:
+            rollups.backfill(db, datetime.utcnow() - timedelta(days=int(os.getenv("RETENTION_DAYS", "14"))))
+    replication.seed_notifier(db, config_notifier)
+    config_notifier.start_listener(psycopg_dsn())
+    cache.start_listener(psycopg_dsn())
+    if livetail.enabled():
+        live_hub.start_listener(psycopg_dsn())
+    ingest_buffer.start()
+    if addr := listen_address():
+        policy_server.index = load_index(db)
+        policy_server.routes = routing.load_route_index(db)
+        rate_limiter.load(db)
+        rate_limiter.start_sync(SessionLocal, interval=float(os.getenv("RATE_LIMIT_SYNC_SECONDS", "1")))
+        policy_server.watch(SessionLocal, config_notifier)
+        policy_server.start(*addr)
+    leader.on_elected.append(refresh_runtime_artifacts)
+    leader.start()
+    threading.Thread(target=postfix_log_loop, daemon=True).start()
     threading.Thread(target=sync_from_master_loop, daemon=True).start()
     threading.Thread(target=retention_loop, daemon=True).start()
+    threading.Thread(target=legacy_migration_loop, daemon=True).start()
+    threading.Thread(target=queue_index_loop, daemon=True).start()
+    if health_checker.interval > 0:
+        health_checker.start(active=lambda: leader.is_leader)
+    logging.getLogger("mailrelay").info("startup finished in %.2fs", time.perf_counter() - started)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await run_in_threadpool(ingest_buffer.stop)
+    await peer_http.aclose()
+
+
+def refresh_runtime_artifacts():
+    db = SessionLocal()
+    try:
+        write_runtime_artifacts(ensure_cluster_settings(db))
+    finally:
+        db.close()
+
+
+def with_session(fn, *args):
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+def postfix_log_loop():
+    path = os.getenv("POSTFIX_LOG_PATH", "/postfix-logs/postfix.log")
+    if not path:
+        return
+    while True:
+        leader.wait()
+        LogTailer(
+            path,
+            RUNTIME / "postfix-log.offset",
+            lambda events: ingest_buffer.submit(events, timeout=1),
+            parser=PostfixLogParser(
+                max_inflight=int(os.getenv("POSTFIX_LOG_MAX_INFLIGHT", "100000")),
+                skip_reject=RECORDED_REJECTS if listen_address() else None,
+            ),
+            batch_size=ingest_buffer.batch_size,
+        ).run_forever(active=lambda: leader.is_leader)
 
 
 def sync_from_master_loop():
+    # Long-polls the master for version deltas over one pooled keep-alive session; returns as soon as the master snapshots.
     interval = int(os.getenv("SYNC_INTERVAL_SECONDS", "5"))
+    http = requests.Session()
+    http.verify = False
     while True:
+        leader.wait()
         try:
-            db = next(get_db())
-            cfg = get_effective_cluster_settings(db)
-            if cfg["cluster_mode"].lower() != "slave":
+            db = SessionLocal()
+            try:
+                cfg = get_effective_cluster_settings(db)
+                latest = db.query(func.max(ConfigVersion.version)).scalar() or 0
+            finally:
+                db.close()
+            if cfg["cluster_mode"].lower() != "slave" or not cfg.get("master_api_url") or not cfg.get("master_api_token"):
                 time.sleep(interval)
                 continue
-            if not cfg.get("master_api_url") or not cfg.get("master_api_token"):
+            wait = replication.long_poll_timeout()
+            headers = {"x-api-token": cfg["master_api_token"]}
+            r = http.get(f"{cfg['master_api_url']}/config/changes", params={"since": latest, "timeout": wait}, headers=headers, timeout=wait + 10)
+            if r.status_code == 404:
+                # master without the changes endpoint: fall back to the full export
+                r = http.get(f"{cfg['master_api_url']}/config/export", headers=headers, timeout=10)
+                payload = {**r.json(), "full": True} if r.ok else {}
+                if payload.get("version", 0) <= latest:
+                    time.sleep(interval)
+                    continue
+            elif r.ok:
+                payload = r.json()
+            else:
                 time.sleep(interval)
                 continue
-            latest = db.query(func.max(ConfigVersion.version)).scalar() or 0
-            r = requests.get(
-                f"{cfg['master_api_url']}/config/export",
-                headers={"x-api-token": cfg["master_api_token"]},
-                timeout=3,
-                verify=False,
-            )
-            if r.ok:
-                payload = r.json()
-                if payload.get("version", 0) > latest:
-                    d = payload.get("data", {})
-                    db.query(DomainPolicy).delete()
-                    db.query(RelayRoute).delete()
-                    for dm in d.get("domains", []):
-                        db.add(DomainPolicy(domain=dm, enabled=True))
-                    for rr in d.get("routes", []):
-                        db.add(RelayRoute(**rr))
-                    db.add(ConfigVersion(version=payload["version"], data=json.dumps(d), created_by="master-sync", applied=False))
-                    db.commit()
-                    render_postfix(db)
-                    (GENERATED / ".reload").touch()
+            master = max(latest, payload.get("version", 0))
+            metrics.observe_sync(latest, master)
+            if payload.get("version", 0) > latest:
+                db = SessionLocal()
+                try:
+                    replication.apply_changes(db, payload)
+                    metrics.observe_sync(payload["version"], master)
+                    config_notifier.notify(payload["version"])
+                    if render_postfix(db):
+                        render.request_reload(GENERATED)
+                finally:
+                    db.close()
         except Exception:
-            pass
-        time.sleep(interval)
+            time.sleep(interval)
 
 
 def retention_loop():
+    log = logging.getLogger("mailrelay")
     while True:
+        leader.wait()
+        days = int(os.getenv("RETENTION_DAYS", "14"))
+        db = SessionLocal()
+        # own step: without the look-ahead partitions every insert fails once they run out
+        try:
+            partitions.ensure_partitions(db, days_back=days)
+        except Exception:
+            db.rollback()
+            log.exception("creating partitions failed")
         try:
-            db = next(get_db())
-            cutoff = datetime.utcnow() - timedelta(days=int(os.getenv("RETENTION_DAYS", "14")))
-            db.query(MailLog).filter(MailLog.created_at < cutoff).delete()
-            db.query(RejectionLog).filter(RejectionLog.created_at < cutoff).delete()
+            cutoff = datetime.utcnow() - timedelta(days=days)
+            partitions.drop_expired_partitions(db, cutoff, archive.archive_range if archive.enabled() else None)
+            archive.prune()
+            rollups.prune(db, cutoff)
+            traces.prune(db, cutoff)
+            health.prune(db)
+            replication.compact_history(db)
             db.commit()
         except Exception:
-            pass
+            db.rollback()
+            log.exception("retention run failed")
+        finally:
+            db.close()
         time.sleep(3600)
 
 
-def current_user(creds: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+def legacy_migration_loop():
+    # moves the rows of tables migrate_to_partitioned swapped out while ingest keeps writing, then indexes them
+    while True:
+        leader.wait()
+        db = SessionLocal()
+        try:
+            tables = partitions.legacy_tables(db)
+            for table in tables:
+                partitions.move_legacy_rows(db, table)
+                build_log_indexes(db, only={table})
+                partitions.drop_legacy(db, table)
+            if not tables:
+                return
+        except Exception:
+            db.rollback()
+            logging.getLogger("mailrelay").exception("moving legacy log rows failed")
+        finally:
+            db.close()
+        time.sleep(60)
+
+
+def queue_index_loop():
+    # keeps the shared snapshot current even when all queue requests land on other workers
+    interval = float(os.getenv("QUEUE_INDEX_INTERVAL_SECONDS", "5"))
+    while True:
+        leader.wait()
+        try:
+            queue_index.refresh(force=True)
+        except Exception:
+            logging.getLogger("mailrelay").exception("queue index refresh failed")
+        time.sleep(interval)
+
+
+async def current_user(creds: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_async_db)):
     payload = decode_token(creds.credentials)
-    u = db.query(User).filter(User.username == payload["sub"]).first()
+    # cached detached copy; endpoints only read id/username/role from it
+    u = await cache.CACHES["users"].aget(payload["sub"], lambda: _load_user(db, payload["sub"]))
     if not u:
         raise HTTPException(status_code=401, detail="user not found")
-    return u
+    return User(**u)
+
+
+async def _load_user(db: AsyncSession, username: str):
+    u = await db.scalar(select(User).where(User.username == username))
+    return {"id": u.id, "username": u.username, "role": u.role, "must_change_password": u.must_change_password} if u else None
 
 
 def require_role(user: User, roles: list[str]):
@@ -248,31 +541,35 @@ def snapshot_config(db: Session, actor: str):
             "tls_verify": r.tls_verify,
             "auth_username": r.auth_username,
             "auth_password": r.auth_password,
+            "targets": r.targets,
+            **{k: getattr(r, k) for k in routing.TUNING_FIELDS},
         }
         for r in db.query(RelayRoute).all()
     ]
-    v = (db.query(func.max(ConfigVersion.version)).scalar() or 0) + 1
-    db.add(ConfigVersion(version=v, data=json.dumps({"domains": domains, "routes": routes}), created_by=actor))
+    rate_limits = [limit_out(r) for r in db.query(RateLimit).order_by(RateLimit.scope, RateLimit.match).all()]
+    v = replication.record_version(db, {"domains": sorted(domains), "routes": sorted(routes, key=lambda r: r["sender_domain"]), "rate_limits": rate_limits}, actor)
     db.add(AuditLog(actor=actor, action="config_saved", payload=f"version={v}"))
+    db.execute(text("SELECT pg_notify(:channel, :v)"), {"channel": replication.CHANNEL, "v": str(v)})
     db.commit()
+    config_notifier.notify(v)
     return v
 
 
-def render_postfix(db: Session):
-    domains = [d.domain for d in db.query(DomainPolicy).filter(DomainPolicy.enabled.is_(True)).all()]
-    routes = db.query(RelayRoute).all()
+def render_postfix(db: Session, reject_message: str | None = None) -> list[str]:
+    with metrics.RENDER_SECONDS.time():
+        domains = [d.domain for d in db.query(DomainPolicy).filter(DomainPolicy.enabled.is_(True)).all()]
+        routes = db.query(RelayRoute).all()
 
-    allowed_sender_lines = [f"{domain} OK" for domain in domains if domain]
-    sender_relay_lines = [f"@{r.sender_domain} [{r.target_host}]:{r.target_port}" for r in routes]
-    transport_lines = [f"{r.sender_domain} smtp:[{r.target_host}]:{r.target_port}" for r in routes]
-    sasl_passwd_lines = [f"[{r.target_host}]:{r.target_port} {r.auth_username}:{r.auth_password}" for r in routes if r.auth_username]
+        allowed_sender_lines = [f"{domain} OK" for domain in domains if domain]
 
-    (GENERATED / "allowed_sender_domains").write_text("\n".join(allowed_sender_lines) + ("\n" if allowed_sender_lines else ""))
-    (GENERATED / "sender_relay").write_text("\n".join(sender_relay_lines) + ("\n" if sender_relay_lines else ""))
-    (GENERATED / "transport").write_text("\n".join(transport_lines) + ("\n" if transport_lines else ""))
-    (GENERATED / "sasl_passwd").write_text("\n".join(sasl_passwd_lines) + ("\n" if sasl_passwd_lines else ""))
-    msg = get_effective_cluster_settings(db).get("reject_response_message") or "Relay konnte die Nachricht nicht verarbeiten. Bitte später erneut versuchen."
-    (GENERATED / "reject_response_message").write_text(msg.strip() + "\n")
+        # a settings change passes its new message: the cache still holds the committed one
+        msg = (reject_message if reject_message is not None else get_effective_cluster_settings(db).get("reject_response_message")) or "Relay konnte die Nachricht nicht verarbeiten. Bitte später erneut versuchen."
+        files = {
+            "allowed_sender_domains": "\n".join(allowed_sender_lines) + ("\n" if allowed_sender_lines else ""),
+            **routing.render_route_files(routes),
+            "reject_response_message": msg.strip() + "\n",
+        }
+        return render.publish(GENERATED, files, modes={"sasl_passwd": 0o600})
 
 
 @app.post("/api/login")
@@ -343,6 +640,7 @@ def update_user(user_id: int, req: UserUpdateRequest, user: User = Depends(curre
         updates.append(f"must_change_password={req.must_change_password}")
 
     db.add(AuditLog(actor=user.username, action="user_updated", payload=f"username={target.username};" + ",".join(updates)))
+    cache.invalidate(db, "users")
     db.commit()
     return {"status": "updated", "id": target.id}
 
@@ -365,133 +663,440 @@ def add_domain(req: DomainRequest, user: User = Depends(current_user), db: Sessi
     return {"status": "saved", "version": snapshot_config(db, user.username)}
 
 
+def route_targets_or_400(targets: list) -> list[dict]:
+    try:
+        return routing.normalize_targets([t.model_dump() for t in targets])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def tuning_or_400(values: dict):
+    try:
+        routing.validate_tuning(values)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def set_route_targets(route: RelayRoute, targets: list[dict]):
+    # target_host/target_port keep the preferred target, for readers that only know a single target
+    route.targets = targets if len(targets) > 1 else None
+    route.target_host, route.target_port = targets[0]["host"], targets[0]["port"]
+
+
 @app.post("/api/routes")
 def add_route(req: RouteRequest, user: User = Depends(current_user), db: Session = Depends(get_db)):
     require_role(user, ["Admin", "Operator"])
-    db.add(RelayRoute(**req.model_dump()))
+    data = req.model_dump(exclude={"targets"})
+    if not req.targets and not req.target_host:
+        raise HTTPException(status_code=400, detail="target_host or targets required")
+    tuning_or_400(data)
+    route = RelayRoute(**data)
+    if req.targets:
+        set_route_targets(route, route_targets_or_400(req.targets))
+    db.add(route)
+    db.commit()
+    return {"status": "saved", "version": snapshot_config(db, user.username)}
+
+
+@app.put("/api/routes/{route_id}/transport")
+def set_route_transport(route_id: int, req: RouteTransportRequest, user: User = Depends(current_user), db: Session = Depends(get_db)):
+    # takes effect with the next render_postfix + .reload (config apply, or the sync loop on the slave)
+    require_role(user, ["Admin", "Operator"])
+    route = db.query(RelayRoute).filter(RelayRoute.id == route_id).first()
+    if not route:
+        raise HTTPException(status_code=404, detail="route not found")
+    values = req.model_dump()
+    tuning_or_400(values)
+    for k, v in values.items():
+        setattr(route, k, v)
+    db.add(AuditLog(actor=user.username, action="route_transport_updated", payload=json.dumps({"sender_domain": route.sender_domain, **values})))
+    db.commit()
+    return {"status": "saved", "transport": routing.transport_name(route.sender_domain) if routing.route_tuning(route) or route.targets else "smtp", "version": snapshot_config(db, user.username)}
+
+
+@app.put("/api/routes/{route_id}/targets")
+def replace_route_targets(route_id: int, req: RouteTargetsRequest, user: User = Depends(current_user), db: Session = Depends(get_db)):
+    require_role(user, ["Admin", "Operator"])
+    route = db.query(RelayRoute).filter(RelayRoute.id == route_id).first()
+    if not route:
+        raise HTTPException(status_code=404, detail="route not found")
+    if not req.targets:
+        raise HTTPException(status_code=400, detail="at least one target required")
+    targets = route_targets_or_400(req.targets)
+    set_route_targets(route, targets)
+    db.add(AuditLog(actor=user.username, action="route_targets_updated", payload=json.dumps({"sender_domain": route.sender_domain, "targets": targets})))
+    db.commit()
+    return {"status": "saved", "targets": routing.route_targets(route), "version": snapshot_config(db, user.username)}
+
+
+@app.get("/api/rate-limits")
+def list_rate_limits(user: User = Depends(current_user), db: Session = Depends(get_db)):
+    return [{"id": r.id, **limit_out(r)} for r in db.query(RateLimit).order_by(RateLimit.scope, RateLimit.match).all()]
+
+
+@app.post("/api/rate-limits")
+def set_rate_limit(req: RateLimitRequest, user: User = Depends(current_user), db: Session = Depends(get_db)):
+    # one limit per (scope, match); match "*" applies to every key of the scope without an own entry
+    require_role(user, ["Admin", "Operator"])
+    if req.scope not in ("sender_domain", "sender", "client_ip") or req.max_messages < 1 or req.window_seconds < 1:
+        raise HTTPException(status_code=400, detail="invalid rate limit")
+    match = (req.match or "*").strip().lower()
+    row = db.query(RateLimit).filter(RateLimit.scope == req.scope, RateLimit.match == match).first() or RateLimit(scope=req.scope, match=match)
+    row.max_messages, row.window_seconds, row.enabled = req.max_messages, req.window_seconds, req.enabled
+    db.add(row)
     db.commit()
     return {"status": "saved", "version": snapshot_config(db, user.username)}
 
 
+@app.delete("/api/rate-limits/{limit_id}")
+def delete_rate_limit(limit_id: int, user: User = Depends(current_user), db: Session = Depends(get_db)):
+    require_role(user, ["Admin", "Operator"])
+    if not db.query(RateLimit).filter(RateLimit.id == limit_id).delete():
+        raise HTTPException(status_code=404, detail="rate limit not found")
+    db.commit()
+    return {"status": "deleted", "version": snapshot_config(db, user.username)}
+
+
+@app.post("/api/config/import")
+async def import_config(request: Request, dry_run: bool = False, user: User = Depends(current_user)):
+    """Upserts domains and routes from JSON or CSV in one transaction and records one config version."""
+    require_role(user, ["Admin", "Operator"])
+    try:
+        data = configimport.parse(await request.body(), request.headers.get("content-type", ""))
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"invalid import: {e}")
+    return await run_in_threadpool(_import_config, data, dry_run, user.username)
+
+
+def _import_config(data: dict, dry_run: bool, actor: str):
+    domains, routes, errors = configimport.validate(data)
+    db = SessionLocal()
+    try:
+        domain_rows, route_rows, counts = configimport.plan(db, domains, routes)
+        report = {**counts, "errors": errors[:1000], "error_count": len(errors), "dry_run": dry_run, "version": None}
+        if errors:
+            db.rollback()
+            return JSONResponse(status_code=422, content=report)
+        if dry_run or not (domain_rows or route_rows):
+            db.rollback()
+            return report
+        configimport.apply(db, domain_rows, route_rows)
+        db.add(AuditLog(actor=actor, action="config_imported", payload=json.dumps(counts)))
+        report["version"] = snapshot_config(db, actor)
+        return report
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@app.get("/api/config/history")
+def config_history(limit: int = Query(default=50, ge=1, le=1000), user: User = Depends(current_user), db: Session = Depends(get_db)):
+    rows = db.query(ConfigVersion.version, ConfigVersion.kind, ConfigVersion.created_by, ConfigVersion.created_at, func.length(ConfigVersion.data)).order_by(desc(ConfigVersion.version)).limit(limit)
+    return [{"version": v, "kind": k, "created_by": by, "created_at": at.isoformat() if at else None, "bytes": n} for v, k, by, at, n in rows]
+
+
+@app.post("/api/config/rollback/{version}")
+def config_rollback(version: int, user: User = Depends(current_user), db: Session = Depends(get_db)):
+    # restores an older version as a new one; like any change it takes effect with the next apply/.reload
+    require_role(user, ["Admin"])
+    data = replication.materialize(db, version)
+    if data is None:
+        raise HTTPException(status_code=404, detail="version not found")
+    replication.replace_config(db, data)
+    db.add(AuditLog(actor=user.username, action="config_rollback", payload=f"to={version}"))
+    return {"status": "restored", "from_version": version, "version": snapshot_config(db, user.username)}
+
+
 @app.post("/api/config/test")
 def config_test(user: User = Depends(current_user), db: Session = Depends(get_db)):
-    render_postfix(db)
-    return {"ok": True}
+    return {"ok": True, "changed": render_postfix(db)}
 
 
 @app.post("/api/config/apply")
 def config_apply(user: User = Depends(current_user), db: Session = Depends(get_db)):
     require_role(user, ["Admin", "Operator"])
     render_postfix(db)
-    subprocess.run(["/bin/sh", "-c", "touch /generated/.reload"], capture_output=True, text=True)
+    render.request_reload(GENERATED)
     db.add(AuditLog(actor=user.username, action="config_applied", payload="reload"))
     db.commit()
     return {"status": "applied"}
 
 
 @app.get("/api/dashboard")
-def dashboard(user: User = Depends(current_user), db: Session = Depends(get_db)):
+async def dashboard(user: User = Depends(current_user), db: AsyncSession = Depends(get_async_db)):
     n = datetime.utcnow()
-    rejected = db.query(RejectionLog).order_by(desc(RejectionLog.created_at)).limit(100).all()
+    rejected = (await db.scalars(select(RejectionLog).order_by(desc(RejectionLog.created_at)).limit(100))).all()
+    relay_up = dict((await db.execute(health.summary_select())).all())
+    relay_down = (await db.scalars(select(RelayTargetHealth.target).where(RelayTargetHealth.up.is_(False)).order_by(RelayTargetHealth.target).limit(20))).all()
     return {
-        "processed_24h": db.query(MailLog).filter(MailLog.created_at >= n - timedelta(hours=24)).count(),
-        "processed_1h": db.query(MailLog).filter(MailLog.created_at >= n - timedelta(hours=1)).count(),
-        "rejected_16h": db.query(RejectionLog).filter(RejectionLog.created_at >= n - timedelta(hours=16)).count(),
-        "queue_size": 0,
-        "active_node": get_effective_cluster_settings(db)["node_id"],
+        "processed_24h": int(await db.scalar(rollups.count_since_select("mail", n - timedelta(hours=24)))),
+        "processed_1h": int(await db.scalar(rollups.count_since_select("mail", n - timedelta(hours=1)))),
+        "rejected_16h": int(await db.scalar(rollups.count_since_select("reject", n - timedelta(hours=16)))),
+        "queue_size": sum((await run_in_threadpool(metrics.queue_depth)).values()),
+        "active_node": (await get_effective_cluster_settings_async(db))["node_id"],
+        "relay_targets": {"up": relay_up.get(True, 0), "down": relay_up.get(False, 0), "down_targets": list(relay_down)},
         "rejected_last_100": [
             {"sender": r.sender, "recipient": r.recipient, "reason": r.reason, "created_at": r.created_at.isoformat()} for r in rejected
         ],
     }
 
 
+@app.get("/api/relay-health")
+async def relay_health(
+    user: User = Depends(current_user),
+    db: AsyncSession = Depends(get_async_db),
+    down_only: bool = False,
+    hours: int = Query(default=24, ge=1, le=168, description="window for availability"),
+):
+    require_role(user, ["Admin", "Operator", "ReadOnly"])
+    stmt = select(RelayTargetHealth).order_by(RelayTargetHealth.up, RelayTargetHealth.target)
+    if down_only:
+        stmt = stmt.where(RelayTargetHealth.up.is_(False))
+    rows = (await db.scalars(stmt)).all()
+    availability = {t: (ok, checks) for t, ok, checks in (await db.execute(health.availability_select(datetime.utcnow() - timedelta(hours=hours)))).all()}
+    return [health.health_out(h, availability.get(h.target)) for h in rows]
+
+
+@app.get("/api/relay-health/history")
+async def relay_health_history(
+    target: str,
+    user: User = Depends(current_user),
+    db: AsyncSession = Depends(get_async_db),
+    hours: int = Query(default=24, ge=1, le=168),
+):
+    require_role(user, ["Admin", "Operator", "ReadOnly"])
+    rows = (await db.scalars(health.history_select(target, datetime.utcnow() - timedelta(hours=hours)))).all()
+    return {"target": target, "bucket_minutes": health.BUCKET_MINUTES, "buckets": [health.history_out(b) for b in rows]}
+
+
+@app.get("/api/archive")
+def archive_stats(user: User = Depends(current_user)):
+    require_role(user, ["Admin", "Operator", "ReadOnly"])
+    return archive.stats()
+
+
+async def queue_ids(f: QueueFilter) -> list[str]:
+    await run_in_threadpool(queue_index.refresh)
+    return await run_in_threadpool(queue_index.select, f)
+
+
+@app.get("/api/queue")
+async def queue_list(
+    user: User = Depends(current_user),
+    f: QueueFilter = Depends(queue_filter),
+    limit: int = Query(default=100, ge=1, le=1000),
+    offset: int = Query(default=0, ge=0),
+):
+    require_role(user, ["Admin", "Operator", "ReadOnly"])
+    ids = await queue_ids(f)
+    page = [queue_index.get(q) for q in ids[offset : offset + limit]]
+    return {"total": len(ids), "offset": offset, "items": [entry_out(e) for e in page if e]}
+
+
+@app.get("/api/queue/count")
+async def queue_count(user: User = Depends(current_user), f: QueueFilter = Depends(queue_filter)):
+    require_role(user, ["Admin", "Operator", "ReadOnly"])
+    ids = await queue_ids(f)
+    return {"total": len(ids), "by_queue": {r["key"]: r["count"] for r in queue_index.aggregate(ids, "queue", len(QUEUES))}}
+
+
+@app.get("/api/queue/summary")
+async def queue_summary(
+    user: User = Depends(current_user),
+    f: QueueFilter = Depends(queue_filter),
+    by: str = Query(default="recipient_domain", pattern="^(" + "|".join(AGGREGATES) + ")$"),
+    limit: int = Query(default=50, ge=1, le=1000),
+):
+    require_role(user, ["Admin", "Operator", "ReadOnly"])
+    ids = await queue_ids(f)
+    return {"by": by, "total": len(ids), "groups": await run_in_threadpool(queue_index.aggregate, ids, by, limit)}
+
+
+@app.get("/api/queue/{queue_id}")
+async def queue_message(queue_id: str, user: User = Depends(current_user)):
+    require_role(user, ["Admin", "Operator", "ReadOnly"])
+    await run_in_threadpool(queue_index.refresh)
+    e = queue_index.get(queue_id)
+    if not e:
+        raise HTTPException(status_code=404, detail="not in queue")
+    return entry_out(e, full=True)
+
+
+@app.post("/api/queue/actions", status_code=202)
+def queue_action(req: QueueActionRequest, user: User = Depends(current_user), db: Session = Depends(get_db)):
+    require_role(user, ["Admin", "Operator"])
+    if req.action not in ACTIONS:
+        raise HTTPException(status_code=400, detail=f"action must be one of {', '.join(ACTIONS)}")
+    f = QueueFilter(req.queue, req.sender, req.recipient_domain, req.reason)
+    if req.queue_ids:
+        ids = [q for q in req.queue_ids if QUEUE_ID_RE.match(q)]
+    elif any((f.queue, f.sender, f.recipient_domain, f.reason)):
+        queue_index.refresh()
+        ids = queue_index.select(f)
+    else:
+        # an empty selector would hit the whole queue
+        raise HTTPException(status_code=400, detail="queue_ids or a filter is required")
+    if not ids:
+        return {"status": "noop", "messages": 0}
+    name = request_action(GENERATED, req.action, ids)
+    db.add(AuditLog(actor=user.username, action=f"queue_{req.action}", payload=json.dumps({"messages": len(ids), **req.model_dump(exclude={"action", "queue_ids"}, exclude_none=True)})))
+    db.commit()
+    return {"status": "queued", "request": name, "messages": len(ids)}
+
+
+@app.get("/api/stats/timeseries")
+def stats_timeseries(
+    user: User = Depends(current_user),
+    db: Session = Depends(get_db),
+    kind: str = Query(default="mail", pattern="^(mail|reject)$"),
+    granularity: str = Query(default="h", pattern="^(m|h)$"),
+    group_by: str | None = Query(default=None, pattern="^(status|target|tls|reason)$"),
+    hours: int = Query(default=24, ge=1, le=24 * 30),
+):
+    if granularity == "m":
+        hours = min(hours, 48)
+    since = datetime.utcnow() - timedelta(hours=hours)
+    return {"kind": kind, "granularity": granularity, "group_by": group_by, "points": rollups.timeseries(db, kind, since, granularity, group_by)}
+
+
 @app.get("/api/mail/search")
-def search_mail(
+async def search_mail(
+    user: User = Depends(current_user),
+    db: AsyncSession = Depends(get_async_db),
+    f: MailFilter = Depends(mail_filter),
+    limit: int = Query(default=500, ge=1, le=5000),
+    per_message: bool = False,
+):
+    if per_message:
+        # one summary row per queue-ID instead of one row per delivery attempt
+        rows = (await db.scalars(traces.per_message_select(mail_conditions(f), limit))).all()
+        return [traces.trace_out(t) for t in rows]
+    # a window reaching past the database continues in the archive
+    hot_since = archive.hot_since(f)
+    rows = (await db.scalars(filtered_mail_select(f, hot_since).order_by(desc(MailLog.created_at)).limit(limit))).all()
+    if hot_since and len(rows) < limit:
+        rows += await run_in_threadpool(archive.search, f, hot_since, limit - len(rows))
+    return [mail_out(r) for r in rows]
+
+
+@app.get("/api/mail/trace/{trace_id}")
+async def mail_trace(trace_id: str, user: User = Depends(current_user), db: AsyncSession = Depends(get_async_db)):
+    found = (await db.scalars(traces.trace_select(trace_id))).all()
+    if not found:
+        raise HTTPException(status_code=404, detail="no message with this queue-ID or Message-ID")
+    events = (await db.scalars(traces.events_select(found))).all()
+    return {
+        "id": trace_id,
+        "messages": [{**traces.trace_out(t), "events": [mail_out(e) for e in events if e.queue_id == t.queue_id]} for t in found],
+    }
+
+
+@app.get("/api/mail/search/page")
+def search_mail_page(
     user: User = Depends(current_user),
     db: Session = Depends(get_db),
+    f: MailFilter = Depends(mail_filter),
+    cursor: str | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+):
+    hot_since = archive.hot_since(f)
+    rows, next_cursor = keyset_page(filtered_mail_query(db, f, hot_since), cursor, limit)
+    if hot_since and len(rows) < limit:
+        # the page continues below hot_since, or below the cursor if it already points into the archive
+        rows += archive.search(f, hot_since, limit - len(rows) + 1, decode_cursor(cursor) if cursor and not rows else None)
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        rows = rows[:limit]
+    return {"items": [mail_out(r) for r in rows], "next_cursor": next_cursor}
+
+
+@app.get("/api/mail/export.csv")
+def export_mail_csv(user: User = Depends(current_user), f: MailFilter = Depends(mail_filter), gzip: bool = False):
+    return export_response(f, "csv", gzip)
+
+
+@app.get("/api/mail/export.ndjson")
+def export_mail_ndjson(user: User = Depends(current_user), f: MailFilter = Depends(mail_filter), gzip: bool = False):
+    return export_response(f, "ndjson", gzip)
+
+
+def export_response(f: MailFilter, fmt: str, compress: bool):
+    filename = "mail-log.csv" if fmt == "csv" else "mail-log.ndjson"
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    if compress:
+        filename, media_type = filename + ".gz", "application/gzip"
+    return StreamingResponse(export_stream(f, fmt, compress), media_type=media_type, headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
+@app.get("/api/mail/live")
+async def mail_live(
+    user: User = Depends(current_user),
+    db: AsyncSession = Depends(get_async_db),
     sender: str | None = None,
     recipient: str | None = None,
     ip: str | None = None,
     status: str | None = None,
     target: str | None = None,
-    tls: bool | None = None,
-    hours: int = Query(default=24, ge=1, le=24 * 30),
-    limit: int = Query(default=500, ge=1, le=5000),
+    kind: str | None = Query(default=None, pattern="^(mail|reject)$"),
 ):
-    q = db.query(MailLog).filter(MailLog.created_at >= datetime.utcnow() - timedelta(hours=hours))
-    if sender:
-        q = q.filter(MailLog.sender.ilike(f"%{sender}%"))
-    if recipient:
-        q = q.filter(MailLog.recipient.ilike(f"%{recipient}%"))
-    if ip:
-        q = q.filter(MailLog.client_ip.ilike(f"%{ip}%"))
-    if status:
-        q = q.filter(MailLog.status.ilike(f"%{status}%"))
-    if target:
-        q = q.filter(MailLog.target.ilike(f"%{target}%"))
-    if tls is not None:
-        q = q.filter(MailLog.tls_used.is_(tls))
-    rows = q.order_by(desc(MailLog.created_at)).limit(limit).all()
-    return [
-        {
-            "sender": r.sender,
-            "recipient": r.recipient,
-            "ip": r.client_ip,
-            "status": r.status,
-            "target": r.target,
-            "tls": r.tls_used,
-            "timestamp": r.created_at.isoformat(),
-            "smtp_code": r.smtp_code,
-            "smtp_text": r.smtp_text,
-        }
-        for r in rows
-    ]
+    """Server-sent events for newly ingested mail/reject rows matching the filters (case-insensitive substrings)."""
+    require_role(user, ["Admin", "Operator", "ReadOnly"])
+    # the stream may stay open for hours; it must not keep the auth lookup's pooled connection
+    await db.close()
+    if not livetail.enabled():
+        raise HTTPException(status_code=404, detail="live tail disabled")
+    sub = live_hub.subscribe(livetail.TailFilter(sender, recipient, ip, status, target, kind))
+    if sub is None:
+        return JSONResponse(status_code=503, content={"detail": "too many live viewers"}, headers={"Retry-After": "10"})
+    return StreamingResponse(livetail.stream(live_hub, sub), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
-@app.get("/api/mail/export.csv")
-def export_mail_csv(user: User = Depends(current_user), db: Session = Depends(get_db), hours: int = 24):
-    rows = (
-        db.query(MailLog)
-        .filter(MailLog.created_at >= datetime.utcnow() - timedelta(hours=hours))
-        .order_by(desc(MailLog.created_at))
-        .limit(10000)
-        .all()
-    )
-    out = io.StringIO()
-    w = csv.writer(out)
-    w.writerow(["timestamp", "sender", "recipient", "ip", "status", "target", "tls", "smtp_code", "smtp_text"])
-    for r in rows:
-        w.writerow([r.created_at.isoformat(), r.sender, r.recipient, r.client_ip, r.status, r.target, r.tls_used, r.smtp_code, r.smtp_text])
-    return StreamingResponse(iter([out.getvalue()]), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=mail-log.csv"})
+@app.get("/api/config/export")
+async def export_config(x_api_token: str = Header(default=""), db: AsyncSession = Depends(get_async_db)):
+    if x_api_token != os.getenv("API_TOKEN", "bootstrap-token"):
+        raise HTTPException(status_code=403, detail="forbidden")
+    latest = await db.scalar(select(func.max(ConfigVersion.version)))
+    if not latest:
+        return {"version": 0, "data": {"domains": [], "routes": []}}
+    return {"version": latest, "data": await db.run_sync(replication.materialize, latest)}
 
 
-@app.get("/api/config/export")
-def export_config(x_api_token: str = Header(default=""), db: Session = Depends(get_db)):
+@app.get("/api/config/changes")
+async def config_changes(
+    since: int = Query(default=0, ge=0),
+    timeout: float = Query(default=25, ge=0, le=60),
+    x_api_token: str = Header(default=""),
+):
+    # Long-poll: answers immediately when a newer version exists, otherwise once snapshot_config publishes one.
     if x_api_token != os.getenv("API_TOKEN", "bootstrap-token"):
         raise HTTPException(status_code=403, detail="forbidden")
-    latest = db.query(ConfigVersion).order_by(desc(ConfigVersion.version)).first()
-    return {"version": 0, "data": {"domains": [], "routes": []}} if not latest else {"version": latest.version, "data": json.loads(latest.data)}
+    # waits on the event loop; only the short delta read below takes a threadpool thread
+    if await config_notifier.wait_async(since, timeout) <= since:
+        return {"version": since, "from": since, "changed": False}
+    payload = await run_in_threadpool(with_session, replication.changes_since, since)
+    return {**payload, "changed": True} if payload else {"version": since, "from": since, "changed": False}
 
 
 @app.post("/api/sync-lock/acquire")
-def acquire_lock(payload: dict, x_api_token: str = Header(default=""), db: Session = Depends(get_db)):
+async def acquire_lock(payload: dict, x_api_token: str = Header(default=""), db: AsyncSession = Depends(get_async_db)):
     if x_api_token != os.getenv("API_TOKEN", "bootstrap-token"):
         raise HTTPException(status_code=403, detail="forbidden")
     if not payload.get("is_vip_owner", False):
         raise HTTPException(status_code=400, detail="not active")
     node_id = payload.get("node_id", "unknown")
     now = datetime.utcnow()
-    ex = db.query(ClusterLock).filter(ClusterLock.lock_name == "queue_sync").first()
+    ex = await db.scalar(select(ClusterLock).where(ClusterLock.lock_name == "queue_sync"))
     if ex and ex.node_id != node_id and (now - ex.heartbeat).total_seconds() < 20:
         db.add(AuditLog(actor=node_id, action="split_brain_detected", payload=json.dumps(payload)))
-        db.commit()
+        await db.commit()
         raise HTTPException(status_code=409, detail="lock owned by other node")
     if ex:
         ex.node_id = node_id
         ex.heartbeat = now
     else:
         db.add(ClusterLock(lock_name="queue_sync", node_id=node_id, heartbeat=now))
-    db.commit()
+    await db.commit()
     return {"status": "ok"}
 
 
@@ -510,47 +1115,117 @@ def set_cluster_settings(req: ClusterSettingsRequest, user: User = Depends(curre
             setattr(r, k, v)
     r.updated_at = datetime.utcnow()
     write_runtime_artifacts(r)
-    render_postfix(db)
-    (GENERATED / ".reload").touch()
+    if render_postfix(db, r.reject_response_message) or req.tls_crt or req.tls_key:
+        render.request_reload(GENERATED, extra=["tls"] if req.tls_crt or req.tls_key else None)
     db.add(AuditLog(actor=user.username, action="cluster_settings_updated", payload=json.dumps({"node_id": r.node_id, "mode": r.cluster_mode})))
+    # the NOTIFY is delivered after commit and also reaches this worker's listener, closing the reload-before-commit gap
+    cache.invalidate(db, "settings")
     db.commit()
     return {"status": "saved"}
 
 
+@app.get("/api/cluster/leader")
+async def cluster_leader(user: User = Depends(current_user), db: AsyncSession = Depends(get_async_db)):
+    require_role(user, ["Admin", "Operator", "ReadOnly"])
+    row = await db.scalar(select(ClusterLock).where(ClusterLock.lock_name == LEADER_ROW))
+    return {
+        "leader": row.node_id if row else None,
+        "heartbeat": row.heartbeat.isoformat() if row else None,
+        "worker": leader.identity,
+        "is_leader": leader.is_leader,
+    }
+
+
 @app.post("/api/cluster/test-peer")
-def cluster_test_peer(user: User = Depends(current_user), db: Session = Depends(get_db)):
-    cfg = get_effective_cluster_settings(db)
+async def cluster_test_peer(user: User = Depends(current_user), db: AsyncSession = Depends(get_async_db)):
+    cfg = await get_effective_cluster_settings_async(db)
     peer = cfg.get("peer_node_ip")
     result = {"peer": peer, "tcp_8080": False, "api_reachable": False}
     try:
-        with socket.create_connection((peer, 8080), timeout=2):
-            result["tcp_8080"] = True
+        _, writer = await asyncio.wait_for(asyncio.open_connection(peer, 8080), timeout=2)
+        writer.close()
+        result["tcp_8080"] = True
     except Exception:
         pass
     try:
-        r = requests.get(f"http://{peer}:8080/docs", timeout=2)
-        result["api_reachable"] = r.ok
+        r = await peer_http.get(f"http://{peer}:8080/docs")
+        result["api_reachable"] = r.is_success
     except Exception:
         pass
     return result
 
 
 @app.post("/api/smtp-event")
-def smtp_event(event: dict, db: Session = Depends(get_db)):
+async def smtp_event(event: dict, db: AsyncSession = Depends(get_async_db)):
     if event.get("type") == "reject":
-        db.add(RejectionLog(sender=event.get("sender"), recipient=event.get("recipient"), client_ip=event.get("client_ip"), reason=event.get("reason") or get_effective_cluster_settings(db).get("reject_response_message", "rejected")))
+        row = reject_row(event, event.get("reason") or (await get_effective_cluster_settings_async(db)).get("reject_response_message", "rejected"))
+        db.add(RejectionLog(**row))
+        counts = rollups.collect([], [row])
     else:
-        db.add(
-            MailLog(
-                sender=event.get("sender"),
-                recipient=event.get("recipient"),
-                client_ip=event.get("client_ip"),
-                status=event.get("status", "processed"),
-                target=event.get("target"),
-                tls_used=bool(event.get("tls_used", False)),
-                smtp_code=event.get("smtp_code"),
-                smtp_text=event.get("smtp_text"),
-            )
-        )
-    db.commit()
+        row = mail_row(event)
+        db.add(MailLog(**row))
+        counts = rollups.collect([row], [])
+        if row["queue_id"]:
+            await db.execute(traces.trace_upsert(traces.collect([row])))
+    await db.commit()
+    # concurrent events would queue on the row locks of the current minute/hour buckets; the writer thread sums them up
+    ingest_buffer.add_rollups(counts)
+    # after the commit, in its own transaction, so a full NOTIFY queue cannot fail the event
+    if notify := livetail.notify_statement(*(([], [row]) if event.get("type") == "reject" else ([row], []))):
+        try:
+            await db.execute(*notify)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logging.getLogger("mailrelay").warning("live-tail notify failed", exc_info=True)
+    metrics.INGEST_EVENTS.labels("smtp_event").inc()
+    metrics.INGEST_ROWS.labels("reject" if event.get("type") == "reject" else "mail").inc()
+    metrics.INGEST_BATCH_ROWS.observe(1)
+    return {"status": "ok"}
+
+
+@app.post("/api/smtp-events", status_code=202)
+async def smtp_events_bulk(request: Request):
+    # Accepts a JSON array (or single object) or NDJSON; rows are written asynchronously in batches.
+    try:
+        events = parse_events(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"invalid payload: {e}")
+    try:
+        await run_in_threadpool(ingest_buffer.submit, events)
+    except BufferFull as e:
+        return JSONResponse(status_code=503, content={"detail": str(e)}, headers={"Retry-After": "1"})
+    metrics.INGEST_EVENTS.labels("smtp_events").inc(len(events))
+    return {"status": "queued", "accepted": len(events)}
+
+
+@app.get("/healthz", include_in_schema=False)
+def healthz():
+    # liveness only: the worker answers; no database, no rendering
     return {"status": "ok"}
+
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness for keepalived: the database answers through the pool and Postfix has consumed the last map render."""
+    checks = {}
+    started = time.perf_counter()
+    try:
+        async with asyncio.timeout(READY_DB_TIMEOUT):
+            async with async_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+        checks["db"] = {"ok": True, "ms": round((time.perf_counter() - started) * 1000, 1)}
+    except Exception as e:
+        checks["db"] = {"ok": False, "error": type(e).__name__}
+    pool = async_engine.pool
+    checks["pool"] = {"ok": True, "checked_out": pool.checkedout(), "size": pool.size(), "overflow": pool.overflow()}
+    age = render.pending_reload_age(GENERATED)
+    checks["postfix_maps"] = {"ok": age is None or age <= READY_RELOAD_MAX_AGE, "pending_reload_s": None if age is None else round(age, 1)}
+    ready = all(c["ok"] for c in checks.values())
+    return JSONResponse({"status": "ready" if ready else "not_ready", "checks": checks}, status_code=200 if ready else 503)
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
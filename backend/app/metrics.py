@@ -0,0 +1,115 @@
+import json
+import os
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# With several uvicorn workers every process writes its samples to PROMETHEUS_MULTIPROC_DIR and a scrape merges them.
+MULTIPROC = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+QUEUE_SYNC_LAST = Path(os.getenv("QUEUE_SYNC_LAST_FILE", "/runtime/queue-sync-last.json"))
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_SECONDS = Histogram("mailrelay_http_request_duration_seconds", "API request latency by route", ["method", "route", "status"], buckets=FAST_BUCKETS)
+INGEST_EVENTS = Counter("mailrelay_ingest_events_total", "smtp events received over HTTP", ["endpoint"])
+INGEST_ROWS = Counter("mailrelay_ingest_rows_total", "Log rows written by the ingest path", ["kind"])
+INGEST_DROPPED = Counter("mailrelay_ingest_dropped_rows_total", "smtp events the ingest path could not write")
+INGEST_BATCH_ROWS = Histogram("mailrelay_ingest_batch_rows", "Rows per ingest write", buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000))
+INGEST_WRITE_SECONDS = Histogram("mailrelay_ingest_write_duration_seconds", "Duration of one ingest batch write", buckets=FAST_BUCKETS)
+DB_CHECKOUT_SECONDS = Histogram("mailrelay_db_pool_checkout_seconds", "Wait for a pooled connection per request", ["engine"], buckets=FAST_BUCKETS)
+RENDER_SECONDS = Histogram("mailrelay_render_postfix_duration_seconds", "Duration of render_postfix", buckets=FAST_BUCKETS)
+CONFIG_VERSION = Gauge("mailrelay_config_version", "Config version seen by the sync loop", ["side"], multiprocess_mode="mostrecent")
+SYNC_LAG = Gauge("mailrelay_config_sync_lag_versions", "Master version minus the local version at the last sync poll", multiprocess_mode="mostrecent")
+SYNC_LAST_SUCCESS = Gauge("mailrelay_config_sync_last_success_timestamp_seconds", "Last successful poll of the master", multiprocess_mode="mostrecent")
+PARTITIONS_UNTIL = Gauge("mailrelay_partitions_until_timestamp_seconds", "End of the newest daily log partition; inserts after it fail", ["table"], multiprocess_mode="mostrecent")
+RETENTION_ROWS = Counter("mailrelay_retention_rows_deleted_total", "Rows removed by retention (dropped partitions: pg_class.reltuples estimate)", ["table"])
+ARCHIVE_ROWS = Counter("mailrelay_archive_rows_total", "mail_logs rows written to archive segments")
+LIVE_SUBSCRIBERS = Gauge("mailrelay_live_tail_subscribers", "Open live-tail streams", multiprocess_mode="livesum")
+LIVE_DROPPED = Counter("mailrelay_live_tail_dropped_events_total", "Live-tail events dropped because a viewer fell behind")
+
+
+def observe_sync(local: int, master: int):
+    CONFIG_VERSION.labels("local").set(local)
+    CONFIG_VERSION.labels("master").set(master)
+    SYNC_LAG.set(max(0, master - local))
+    SYNC_LAST_SUCCESS.set(time.time())
+
+
+# main sets this to the spool index's per-queue counts (app/mailqueue.py imports this module, not the other way round)
+queue_depth_source: Callable[[], dict[str, int]] = dict
+
+
+def queue_depth() -> dict[str, int]:
+    """Messages per Postfix queue, read from the shared spool index instead of walking the spool again."""
+    return queue_depth_source()
+
+
+class SpoolCollector:
+    """Scrape-time values that live outside this process: the Postfix spool and the queue-sync state file."""
+
+    def collect(self):
+        depth = GaugeMetricFamily("mailrelay_postfix_queue_messages", "Messages in the Postfix spool", labels=["queue"])
+        for q, n in queue_depth().items():
+            depth.add_metric([q], n)
+        yield depth
+        try:
+            last = json.loads(QUEUE_SYNC_LAST.read_text())
+        except (OSError, ValueError):
+            return
+        yield GaugeMetricFamily("mailrelay_queue_sync_last_timestamp_seconds", "End of the last queue-sync cycle", value=last.get("ts", 0))
+        yield GaugeMetricFamily("mailrelay_queue_sync_last_duration_seconds", "Duration of the last queue-sync cycle", value=last.get("duration_ms", 0) / 1000)
+        yield GaugeMetricFamily("mailrelay_queue_sync_last_bytes", "Bytes sent by the last queue-sync cycle", value=last.get("bytes", 0))
+        yield GaugeMetricFamily("mailrelay_queue_sync_last_postfix_downtime_seconds", "Postfix stop time of the last cycle", value=last.get("postfix_downtime_ms", 0) / 1000)
+        yield CounterMetricFamily("mailrelay_queue_sync_cycles", "Queue-sync cycles", value=last.get("cycles", 0))
+        yield CounterMetricFamily("mailrelay_queue_sync_bytes", "Bytes sent by queue-sync", value=last.get("bytes_total", 0))
+        yield CounterMetricFamily("mailrelay_queue_sync_duration_seconds", "Time spent in queue-sync cycles", value=last.get("duration_ms_total", 0) / 1000)
+
+
+SPOOL_COLLECTOR = SpoolCollector()
+if not MULTIPROC:
+    REGISTRY.register(SPOOL_COLLECTOR)
+
+
+def render() -> tuple[bytes, str]:
+    registry = REGISTRY
+    if MULTIPROC:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(SPOOL_COLLECTOR)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class RequestMetrics:
+    """ASGI middleware recording latency per route template (not per raw path, to keep label cardinality bounded)."""
+
+    def __init__(self, app):
+        self.app = app
+        # labelled children by (method, route, status); skips the registry lock of .labels() on the hot path
+        self._children: dict[tuple, object] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # FastAPI puts the matched APIRoute into the scope; the plain Starlette routes (/docs, /openapi.json) only set
+            # "endpoint" and have fixed paths. CORS preflights and 404s never reach an endpoint.
+            route = scope.get("route")
+            path = route.path if route else (scope["path"] if scope.get("endpoint") else "unmatched")
+            key = (scope["method"], path, status)
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = REQUEST_SECONDS.labels(scope["method"], path, str(status))
+            child.observe(time.perf_counter() - started)
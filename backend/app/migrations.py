@@ -0,0 +1,46 @@
+import logging
+import time
+from collections.abc import Callable
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+log = logging.getLogger("mailrelay.migrations")
+
+SCHEMA_MIGRATIONS_DDL = """CREATE TABLE IF NOT EXISTS schema_migrations (
+  version INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL,
+  applied_at TIMESTAMP NOT NULL DEFAULT now(), duration_ms INTEGER NOT NULL DEFAULT 0
+)"""
+
+Migration = tuple[int, str, Callable[[Session], None]]
+
+
+def current_version(db: Session) -> int:
+    return db.execute(text("SELECT coalesce(max(version), 0) FROM schema_migrations")).scalar()
+
+
+def migrate(db: Session, steps: list[Migration]) -> list[int]:
+    """Runs the steps newer than the recorded schema version, in order, and records each one."""
+    db.execute(text(SCHEMA_MIGRATIONS_DDL))
+    db.commit()
+    version = current_version(db)
+    db.commit()
+    applied = []
+    for number, name, step in sorted(steps, key=lambda s: s[0]):
+        if number <= version:
+            continue
+        started = time.perf_counter()
+        try:
+            step(db)
+        except Exception:
+            db.rollback()
+            log.exception("schema migration %s (%s) failed", number, name)
+            raise
+        db.execute(
+            text("INSERT INTO schema_migrations (version, name, duration_ms) VALUES (:v, :n, :ms)"),
+            {"v": number, "n": name, "ms": int((time.perf_counter() - started) * 1000)},
+        )
+        db.commit()
+        log.info("schema migration %s (%s) applied", number, name)
+        applied.append(number)
+    return applied
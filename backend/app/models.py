@@ -1,5 +1,6 @@
 from datetime import datetime
-from sqlalchemy import String, Integer, DateTime, Boolean, Text, UniqueConstraint
+from sqlalchemy import BigInteger, Float, String, Integer, DateTime, Boolean, Text, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column
 from .db import Base
 
@@ -16,6 +17,8 @@ class ConfigVersion(Base):
     __tablename__ = "config_versions"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     version: Mapped[int] = mapped_column(Integer, unique=True, nullable=False)
+    # "full": data is the whole config; "delta": data is replication.diff_config against the previous version
+    kind: Mapped[str] = mapped_column(String(8), default="full")
     data: Mapped[str] = mapped_column(Text, nullable=False)
     created_by: Mapped[str] = mapped_column(String(64), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -37,6 +40,13 @@ class RelayRoute(Base):
     tls_verify: Mapped[bool] = mapped_column(Boolean, default=False)
     auth_username: Mapped[str | None] = mapped_column(String(255), nullable=True)
     auth_password: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    # [{host, port, weight, priority, max_connections, rate_delay}], see routing.normalize_targets; NULL = target_host only
+    targets: Mapped[list | None] = mapped_column(JSONB(none_as_null=True), nullable=True)
+    # delivery tuning; any of them gives the route its own smtp transport (routing.render_route_files)
+    concurrency_limit: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    rate_delay: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    recipient_limit: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    connection_cache: Mapped[bool] = mapped_column(Boolean, default=False)
 
 class MailLog(Base):
     __tablename__ = "mail_logs"
@@ -52,6 +62,8 @@ class MailLog(Base):
     smtp_text: Mapped[str | None] = mapped_column(Text)
     tls_used: Mapped[bool] = mapped_column(Boolean, default=False)
     subject: Mapped[str | None] = mapped_column(String(998))
+    queue_id: Mapped[str | None] = mapped_column(String(32))
+    message_id: Mapped[str | None] = mapped_column(String(255))
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 class RejectionLog(Base):
@@ -97,3 +109,77 @@ class ClusterLock(Base):
     node_id: Mapped[str] = mapped_column(String(64), nullable=False)
     heartbeat: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     __table_args__ = (UniqueConstraint("lock_name", name="uq_lock_name"),)
+
+class TrafficRollup(Base):
+    __tablename__ = "traffic_rollups"
+    granularity: Mapped[str] = mapped_column(String(1), primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(8), primary_key=True)
+    status: Mapped[str] = mapped_column(String(32), primary_key=True, default="")
+    target: Mapped[str] = mapped_column(String(255), primary_key=True, default="")
+    tls_used: Mapped[bool] = mapped_column(Boolean, primary_key=True, default=False)
+    reason: Mapped[str] = mapped_column(String(255), primary_key=True, default="")
+    count: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class RateLimit(Base):
+    __tablename__ = "rate_limits"
+    __table_args__ = (UniqueConstraint("scope", "match"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    scope: Mapped[str] = mapped_column(String(32), nullable=False)
+    match: Mapped[str] = mapped_column(String(255), nullable=False, default="*")
+    max_messages: Mapped[int] = mapped_column(Integer, nullable=False)
+    window_seconds: Mapped[int] = mapped_column(Integer, nullable=False, default=60)
+    enabled: Mapped[bool] = mapped_column(Boolean, default=True)
+
+
+class RateCounter(Base):
+    __tablename__ = "rate_counters"
+    scope: Mapped[str] = mapped_column(String(32), primary_key=True)
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    window_seconds: Mapped[int] = mapped_column(Integer, primary_key=True)
+    window_start: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    count: Mapped[int] = mapped_column(BigInteger, default=0)
+
+class MailTrace(Base):
+    __tablename__ = "mail_traces"
+    queue_id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    message_id: Mapped[str | None] = mapped_column(String(255))
+    sender: Mapped[str | None] = mapped_column(String(255))
+    client_ip: Mapped[str | None] = mapped_column(String(64))
+    first_seen: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    last_seen: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    delivered: Mapped[int] = mapped_column(Integer, default=0)
+    deferred: Mapped[int] = mapped_column(Integer, default=0)
+    bounced: Mapped[int] = mapped_column(Integer, default=0)
+    status: Mapped[str] = mapped_column(String(32), nullable=False)
+    last_target: Mapped[str | None] = mapped_column(String(255))
+    last_smtp_code: Mapped[str | None] = mapped_column(String(32))
+    last_smtp_text: Mapped[str | None] = mapped_column(Text)
+    tls_used: Mapped[bool] = mapped_column(Boolean, default=False)
+
+
+class RelayTargetHealth(Base):
+    __tablename__ = "relay_target_health"
+    target: Mapped[str] = mapped_column(String(300), primary_key=True)
+    host: Mapped[str] = mapped_column(String(255), nullable=False)
+    port: Mapped[int] = mapped_column(Integer, nullable=False)
+    up: Mapped[bool] = mapped_column(Boolean, default=False)
+    latency_ms: Mapped[float | None] = mapped_column(Float)
+    failures: Mapped[int] = mapped_column(Integer, default=0)
+    banner: Mapped[str | None] = mapped_column(String(255))
+    tls: Mapped[bool | None] = mapped_column(Boolean)
+    error: Mapped[str | None] = mapped_column(String(255))
+    checked_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    last_up: Mapped[datetime | None] = mapped_column(DateTime)
+
+
+class RelayHealthHistory(Base):
+    __tablename__ = "relay_health_history"
+    target: Mapped[str] = mapped_column(String(300), primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    checks: Mapped[int] = mapped_column(Integer, default=0)
+    ok: Mapped[int] = mapped_column(Integer, default=0)
+    latency_sum: Mapped[float] = mapped_column(Float, default=0)
+    latency_max: Mapped[float] = mapped_column(Float, default=0)
@@ -0,0 +1,227 @@
+import logging
+import re
+from collections.abc import Callable
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .metrics import PARTITIONS_UNTIL, RETENTION_ROWS
+
+log = logging.getLogger("mailrelay.partitions")
+
+PARTITIONED_TABLES = {
+    "mail_logs": """CREATE TABLE mail_logs (
+  id INTEGER NOT NULL DEFAULT nextval('mail_logs_id_seq'),
+  sender VARCHAR(255), recipient VARCHAR(255), client_ip VARCHAR(64), helo VARCHAR(255), rdns VARCHAR(255),
+  target VARCHAR(255), status VARCHAR(32) NOT NULL DEFAULT 'unknown', smtp_code VARCHAR(32), smtp_text TEXT,
+  tls_used BOOLEAN NOT NULL DEFAULT FALSE, subject VARCHAR(998), queue_id VARCHAR(32), message_id VARCHAR(255),
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at)""",
+    "rejection_logs": """CREATE TABLE rejection_logs (
+  id INTEGER NOT NULL DEFAULT nextval('rejection_logs_id_seq'),
+  sender VARCHAR(255), recipient VARCHAR(255), client_ip VARCHAR(64), reason TEXT NOT NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at)""",
+}
+PARTITION_RE = re.compile(r"_p(\d{8})$")
+
+
+def partition_name(table: str, day: date) -> str:
+    return f"{table}_p{day:%Y%m%d}"
+
+
+def is_partitioned(db: Session, table: str) -> bool:
+    return bool(
+        db.execute(
+            text("SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :t AND pg_table_is_visible(c.oid)"),
+            {"t": table},
+        ).scalar()
+    )
+
+
+def list_partitions(db: Session, table: str) -> list[str]:
+    rows = db.execute(
+        text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :t"),
+        {"t": table},
+    )
+    return sorted(r[0] for r in rows)
+
+
+def create_partition(db: Session, table: str, day: date):
+    db.execute(text(f"CREATE TABLE IF NOT EXISTS {partition_name(table, day)} PARTITION OF {table} FOR VALUES FROM ('{day}') TO ('{day + timedelta(days=1)}')"))
+
+
+def ensure_partitions(db: Session, days_back: int, days_ahead: int = 7):
+    today = datetime.utcnow().date()
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(db, table):
+            continue
+        existing = set(list_partitions(db, table))
+        for offset in range(-days_back, days_ahead + 1):
+            day = today + timedelta(days=offset)
+            if partition_name(table, day) not in existing:
+                try:
+                    create_partition(db, table, day)
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    log.exception("creating partition %s failed", partition_name(table, day))
+        if last := last_partition_day(db, table):
+            PARTITIONS_UNTIL.labels(table).set(datetime.combine(last + timedelta(days=1), datetime.min.time()).replace(tzinfo=timezone.utc).timestamp())
+
+
+def last_partition_day(db: Session, table: str) -> date | None:
+    days = [datetime.strptime(m.group(1), "%Y%m%d").date() for p in list_partitions(db, table) if (m := PARTITION_RE.search(p))]
+    return max(days, default=None)
+
+
+def drop_expired_partitions(db: Session, cutoff: datetime, archive: Callable[[str, str, datetime, datetime], bool] | None = None) -> list[str]:
+    """Detaches and drops whole daily partitions that end before `cutoff`."""
+    dropped = []
+    bind = db.get_bind()
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(db, table):
+            until = cutoff
+            if archive:
+                oldest = db.execute(text(f"SELECT min(created_at) FROM {table}")).scalar()
+                day = datetime.combine(oldest.date(), datetime.min.time()) if oldest else cutoff
+                while day + timedelta(days=1) <= cutoff and archive(table, table, day, day + timedelta(days=1)):
+                    day += timedelta(days=1)
+                until = min(day, cutoff)
+            deleted = db.execute(text(f"DELETE FROM {table} WHERE created_at < :cutoff"), {"cutoff": until}).rowcount
+            db.commit()
+            RETENTION_ROWS.labels(table).inc(max(deleted, 0))
+            continue
+        expired = sorted(p for p in list_partitions(db, table) if (m := PARTITION_RE.search(p)) and datetime.strptime(m.group(1), "%Y%m%d") + timedelta(days=1) <= cutoff)
+        db.commit()
+        if archive:
+            for i, p in enumerate(expired):
+                day = datetime.strptime(PARTITION_RE.search(p).group(1), "%Y%m%d")
+                if not archive(table, p, day, day + timedelta(days=1)):
+                    expired = expired[:i]
+                    break
+        # DETACH ... CONCURRENTLY keeps inserts into the parent running and cannot run inside a transaction
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for p in expired:
+                try:
+                    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {p} CONCURRENTLY"))
+                except Exception:
+                    log.warning("concurrent detach of %s failed, retrying with a plain DETACH", p)
+                    try:
+                        conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {p}"))
+                    except Exception:
+                        log.exception("detaching %s failed", p)
+                        continue
+                # planner estimate from the catalog; count(*) would read the whole day just for the metric
+                RETENTION_ROWS.labels(table).inc(max(0, conn.execute(text("SELECT reltuples FROM pg_class WHERE relname = :p"), {"p": p}).scalar() or 0))
+                conn.execute(text(f"DROP TABLE IF EXISTS {p}"))
+                dropped.append(p)
+    return dropped
+
+
+def index_valid(conn, name: str) -> bool | None:
+    """None if there is no index `name`, else pg_index.indisvalid (False after an interrupted CONCURRENTLY build)."""
+    return conn.execute(
+        text("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :n AND pg_table_is_visible(c.oid)"),
+        {"n": name},
+    ).scalar()
+
+
+def create_index_concurrently(conn, stmt: str):
+    """Runs `CREATE INDEX IF NOT EXISTS <name> ...` CONCURRENTLY, rebuilding an INVALID leftover; `conn` must autocommit."""
+    name = stmt.split(" IF NOT EXISTS ", 1)[1].split()[0]
+    if index_valid(conn, name) is False:
+        log.warning("index %s is invalid, rebuilding", name)
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(text(stmt.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)))
+
+
+def create_index_online(conn, stmt: str, table: str):
+    """Indexes a populated partitioned table one partition at a time, resuming a half-built index; `conn` must autocommit."""
+    name, rest = stmt.split(" IF NOT EXISTS ", 1)[1].split(f" ON {table} ", 1)
+    if index_valid(conn, name):
+        return
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {rest}"))
+    attached = set(
+        conn.execute(
+            text("SELECT t.relname FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid JOIN pg_class t ON t.oid = x.indrelid WHERE i.inhparent = CAST(:n AS regclass)"),
+            {"n": name},
+        ).scalars()
+    )
+    for p in list_partitions(conn, table):
+        if p in attached:
+            continue
+        m = PARTITION_RE.search(p)
+        child = f"{name}_{m.group(1) if m else p}"[:63]
+        if index_valid(conn, child) is False:
+            log.warning("index %s is invalid, rebuilding", child)
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {child}"))
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {p} {rest}"))
+        conn.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {child}"))
+    if not index_valid(conn, name):
+        raise RuntimeError(f"index {name} is still invalid after attaching all partitions")
+
+
+def legacy_name(table: str) -> str:
+    return f"{table}_legacy"
+
+
+def legacy_tables(db: Session) -> list[str]:
+    return [t for t in PARTITIONED_TABLES if db.execute(text("SELECT to_regclass(:t)"), {"t": legacy_name(t)}).scalar()]
+
+
+def migrate_to_partitioned(db: Session, retention_days: int):
+    """Swaps unpartitioned log tables for partitioned ones; the rows stay in <table>_legacy for move_legacy_rows."""
+    today = datetime.utcnow().date()
+    lo, hi = today - timedelta(days=retention_days + 1), today + timedelta(days=8)
+    for table, ddl in PARTITIONED_TABLES.items():
+        if is_partitioned(db, table):
+            continue
+        legacy = legacy_name(table)
+        log.warning("migrating %s to a partitioned table, the rows follow in the background", table)
+        db.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+        db.execute(text(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey"))
+        db.execute(text(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE"))
+        for idx in db.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :t AND indexname LIKE 'ix_%'"), {"t": legacy}).scalars().all():
+            db.execute(text(f"DROP INDEX {idx}"))
+        db.execute(text(ddl))
+        db.execute(text(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id"))
+        for offset in range((hi - lo).days):
+            create_partition(db, table, lo + timedelta(days=offset))
+        db.commit()
+
+
+def move_legacy_rows(db: Session, table: str, batch: int = 50000) -> tuple[int, int]:
+    """Moves <table>_legacy into the partitions in batches, newest first; returns (moved, discarded)."""
+    legacy = legacy_name(table)
+    days = [datetime.strptime(m.group(1), "%Y%m%d") for p in list_partitions(db, table) if (m := PARTITION_RE.search(p))]
+    lo, hi = min(days), max(days) + timedelta(days=1)
+    cols = ", ".join(db.execute(text("SELECT column_name FROM information_schema.columns WHERE table_name = :t ORDER BY ordinal_position"), {"t": table}).scalars().all())
+    moved = skipped = 0
+    below = db.execute(text(f"SELECT max(id) + 1 FROM {legacy}")).scalar()
+    while below is not None:
+        taken, kept, below = db.execute(
+            text(
+                f"""WITH gone AS (
+  DELETE FROM {legacy} WHERE id IN (SELECT id FROM {legacy} WHERE id < :below ORDER BY id DESC LIMIT :n) RETURNING *
+), kept AS (
+  INSERT INTO {table} ({cols}) SELECT {cols} FROM gone WHERE created_at >= :lo AND created_at < :hi RETURNING 1
+)
+SELECT (SELECT count(*) FROM gone), (SELECT count(*) FROM kept), (SELECT min(id) FROM gone)"""
+            ),
+            {"below": below, "n": batch, "lo": lo, "hi": hi},
+        ).one()
+        db.commit()
+        moved, skipped = moved + kept, skipped + taken - kept
+    if skipped:
+        log.warning("%d rows of %s lay outside the partitions (%s to %s) and were discarded", skipped, legacy, lo.date(), hi.date())
+    log.info("moved %d rows from %s", moved, legacy)
+    return moved, skipped
+
+
+def drop_legacy(db: Session, table: str):
+    db.execute(text(f"DROP TABLE IF EXISTS {legacy_name(table)}"))
+    db.commit()
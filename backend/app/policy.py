@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .models import ConfigVersion, DomainPolicy
+from .ratelimit import RATE_REASON, RateLimiter, rate_keys
+from .routing import RouteIndex, load_down, load_route_index
+
+log = logging.getLogger("mailrelay.policy")
+REJECT_REASON = "Sender domain not allowed by policy"
+DUNNO = b"action=DUNNO\n\n"
+PERMIT = b"action=OK\n\n"
+REJECT = f"action=REJECT {REJECT_REASON}\n\n".encode()
+RATE_LIMITED = f"action=450 4.7.1 {RATE_REASON}, try again later\n\n".encode()
+# rejects answered here are recorded by the service itself; the log tailer skips them
+RECORDED_REJECTS = re.compile(f"{re.escape(REJECT_REASON)}|{re.escape(RATE_REASON)}")
+
+
+class PolicyIndex:
+    """Sender allow-list built from enabled DomainPolicy rows."""
+
+    def __init__(self, domains: list[str], version: int = 0):
+        self.version = version
+        self.exact: set[str] = set()
+        self.parents: set[str] = set()
+        for d in domains:
+            d = (d or "").strip().lower().rstrip(".")
+            if d.startswith("*."):
+                self.parents.add(d[2:])
+            elif d.startswith("."):
+                self.parents.add(d[1:])
+            elif d:
+                self.exact.add(d)
+                self.parents.add(d)
+
+    def __len__(self):
+        return len(self.exact | self.parents)
+
+    def allows(self, sender: str) -> bool:
+        _, at, domain = sender.rpartition("@")
+        domain = domain.lower().rstrip(".")
+        if not at or not domain:
+            return False
+        if domain in self.exact:
+            return True
+        while "." in domain:
+            domain = domain.split(".", 1)[1]
+            if domain in self.parents:
+                return True
+        return False
+
+
+def load_index(db: Session) -> PolicyIndex:
+    version = db.query(func.max(ConfigVersion.version)).scalar() or 0
+    domains = [d for (d,) in db.query(DomainPolicy.domain).filter(DomainPolicy.enabled.is_(True)).all()]
+    return PolicyIndex(domains, version)
+
+
+class PolicyServer:
+    """Postfix policy delegation server (check_policy_service) on asyncio."""
+
+    def __init__(self, index: PolicyIndex, record, limiter: RateLimiter | None = None, flush_interval: float = 0.5, routes: RouteIndex | None = None):
+        self.index = index
+        self.record = record
+        self.limiter = limiter
+        self.routes = routes
+        self.flush_interval = flush_interval
+        self.requests = 0
+        self.rejects = 0
+        self._rejected: list[dict] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._server: asyncio.base_events.Server | None = None
+
+    def decide(self, attrs: dict) -> bytes:
+        self.requests += 1
+        if attrs.get("request") != "smtpd_access_policy":
+            return DUNNO
+        if attrs.get("protocol_state") == "DATA":
+            choice = self.routes.choose(attrs.get("sender", "")) if self.routes else None
+            return f"action=FILTER {choice[0]}:{choice[1]}\n\n".encode() if choice else DUNNO
+        if not self.index.allows(attrs.get("sender", "")):
+            return self._reject(attrs, REJECT_REASON, REJECT)
+        if self.limiter and (over := self.limiter.hit(rate_keys(attrs.get("sender", ""), attrs.get("client_address", "")))):
+            return self._reject(attrs, f"{RATE_REASON}: {over}", RATE_LIMITED)
+        return PERMIT
+
+    def _reject(self, attrs: dict, reason: str, response: bytes) -> bytes:
+        self.rejects += 1
+        self._rejected.append(
+            {
+                "type": "reject",
+                "sender": attrs.get("sender") or None,
+                "recipient": attrs.get("recipient") or None,
+                "client_ip": attrs.get("client_address") or None,
+                "helo": attrs.get("helo_name") or None,
+                "reason": reason,
+            }
+        )
+        # the configured reject_response_message is appended by Postfix as smtpd_reject_footer
+        return response
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # smtpd keeps the connection open and sends one attribute block per request, terminated by an empty line.
+        # Every recipient of a message is asked separately; the first answer is reused so a message counts once.
+        # The DATA stage (smtpd_data_restrictions) is a separate question about the same message.
+        last_instance, last_response = None, DUNNO
+        try:
+            attrs: dict = {}
+            while line := await reader.readline():
+                line = line.rstrip(b"\r\n")
+                if line:
+                    k, _, v = line.decode("utf-8", "replace").partition("=")
+                    attrs[k] = v
+                    continue
+                instance = (attrs.get("instance"), attrs.get("protocol_state") == "DATA")
+                if not instance[0] or instance != last_instance:
+                    last_instance, last_response = instance, self.decide(attrs)
+                writer.write(last_response)
+                await writer.drain()
+                attrs = {}
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._rejected:
+                batch, self._rejected = self._rejected, []
+                try:
+                    await self._loop.run_in_executor(None, self.record, batch)
+                except Exception:
+                    log.exception("recording %d policy rejects failed", len(batch))
+
+    async def serve(self, host: str, port: int):
+        self._loop = asyncio.get_running_loop()
+        # reuse_port: every API worker binds the same port and the kernel spreads smtpd connections across them
+        self._server = await asyncio.start_server(self._handle, host, port, backlog=4096, reuse_address=True, reuse_port=True)
+        log.info("policy service listening on %s:%s", host, port)
+        async with self._server:
+            await asyncio.gather(self._server.serve_forever(), self._flush_loop())
+
+    def start(self, host: str, port: int) -> threading.Thread:
+        t = threading.Thread(target=lambda: asyncio.run(self.serve(host, port)), name="policy-server", daemon=True)
+        t.start()
+        return t
+
+    def watch(self, session_factory, notifier, interval: float = 10.0) -> threading.Thread:
+        """Reloads the indexes on new config versions (notifier wake-up or `interval` poll)."""
+
+        def run():
+            while True:
+                notifier.wait(self.index.version, timeout=interval)
+                db = session_factory()
+                try:
+                    latest = db.query(func.max(ConfigVersion.version)).scalar() or 0
+                    if latest != self.index.version:
+                        started = time.perf_counter()
+                        if self.limiter:
+                            self.limiter.load(db)
+                        self.index = load_index(db)
+                        self.routes = load_route_index(db)
+                        log.info("policy index v%s reloaded: %d domains in %.1f ms", self.index.version, len(self.index), (time.perf_counter() - started) * 1000)
+                    elif self.routes is not None and len(self.routes):
+                        self.routes.down = load_down(db)
+                except Exception:
+                    log.exception("policy index reload failed")
+                    time.sleep(5)
+                finally:
+                    db.close()
+
+        t = threading.Thread(target=run, name="policy-watch", daemon=True)
+        t.start()
+        return t
+
+
+def listen_address() -> tuple[str, int] | None:
+    value = os.getenv("POLICY_LISTEN", "127.0.0.1:10040")
+    if not value:
+        return None
+    host, _, port = value.rpartition(":")
+    return host or "127.0.0.1", int(port)
@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from .models import RateCounter, RateLimit
+
+log = logging.getLogger("mailrelay.ratelimit")
+SCOPES = ("sender_domain", "sender", "client_ip")
+# rejects carry "<RATE_REASON>: <scope> <key> over n/ws"; rollups keep only the prefix
+RATE_REASON = "Rate limit exceeded"
+
+
+def rate_keys(sender: str, client_ip: str) -> dict:
+    sender = (sender or "").strip().lower()
+    return {"sender_domain": sender.rpartition("@")[2], "sender": sender, "client_ip": (client_ip or "").strip()}
+
+
+def limit_out(r: RateLimit) -> dict:
+    return {"scope": r.scope, "match": r.match, "max_messages": r.max_messages, "window_seconds": r.window_seconds, "enabled": r.enabled}
+
+
+class RateLimiter:
+    """Sliding-window limits per sender domain, sender and client IP, shared through rate_counters."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self.rules: dict[str, dict[str, tuple[int, int]]] = {}
+        self.limited = 0
+        # (scope, key, window_seconds, window_start) -> [cluster total at last sync, local hits not yet flushed]
+        self._counters: OrderedDict[tuple, list[int]] = OrderedDict()
+        self._evicted: dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def set_rules(self, rules: list[dict]):
+        table: dict[str, dict[str, tuple[int, int]]] = {}
+        for r in rules:
+            if r.get("enabled", True) and r["scope"] in SCOPES:
+                table.setdefault(r["scope"], {})[(r.get("match") or "*").strip().lower()] = (int(r["max_messages"]), max(1, int(r["window_seconds"])))
+        self.rules = table
+
+    def load(self, db: Session):
+        self.set_rules([limit_out(r) for r in db.query(RateLimit).all()])
+
+    def _counter(self, k: tuple) -> list[int]:
+        c = self._counters.get(k)
+        if c is not None:
+            self._counters.move_to_end(k)
+            return c
+        c = self._counters[k] = [0, 0]
+        if len(self._counters) > self.max_keys:
+            old, (_, pending) = self._counters.popitem(last=False)
+            if pending:
+                self._evicted[old] = self._evicted.get(old, 0) + pending
+        return c
+
+    def hit(self, keys: dict, now: float | None = None) -> str | None:
+        """Counts one message against every matching limit, or returns the first limit it would exceed (that attempt is not counted)."""
+        if not self.rules:
+            return None
+        now = now or time.time()
+        with self._lock:
+            counted = []
+            for scope, key in keys.items():
+                rules = self.rules.get(scope)
+                rule = rules and (rules.get(key) or rules.get("*"))
+                if not key or not rule:
+                    continue
+                limit, window = rule
+                start = int(now // window) * window
+                cur = self._counter((scope, key, window, start))
+                prev = self._counters.get((scope, key, window, start - window))
+                estimate = sum(cur) + (sum(prev) * (1 - (now - start) / window) if prev else 0)
+                if estimate + 1 > limit:
+                    self.limited += 1
+                    return f"{scope} {key} over {limit}/{window}s"
+                counted.append(cur)
+            for c in counted:
+                c[1] += 1
+        return None
+
+    def sync(self, db: Session, now: float | None = None):
+        now = now or time.time()
+        with self._lock:
+            deltas = dict(self._evicted)
+            self._evicted.clear()
+            for k, c in self._counters.items():
+                # current-window counters are refreshed even without local hits, to see the other node's traffic
+                if c[1] or k[3] + k[2] > now:
+                    deltas[k] = deltas.get(k, 0) + c[1]
+                    c[1] = 0
+        if deltas:
+            rows = [{"scope": k[0], "key": k[1], "window_seconds": k[2], "window_start": k[3], "count": n} for k, n in sorted(deltas.items())]
+            stmt = pg_insert(RateCounter).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[RateCounter.scope, RateCounter.key, RateCounter.window_seconds, RateCounter.window_start],
+                set_={"count": RateCounter.count + stmt.excluded.count},
+            ).returning(RateCounter.scope, RateCounter.key, RateCounter.window_seconds, RateCounter.window_start, RateCounter.count)
+            try:
+                totals = db.execute(stmt).all()
+                db.commit()
+            except Exception:
+                db.rollback()
+                with self._lock:
+                    for k, n in deltas.items():
+                        if k in self._counters:
+                            self._counters[k][1] += n
+                        elif n:
+                            self._evicted[k] = self._evicted.get(k, 0) + n
+                raise
+            with self._lock:
+                for scope, key, window, start, count in totals:
+                    c = self._counters.get((scope, key, window, start))
+                    if c is not None:
+                        c[0] = count
+        with self._lock:
+            for k in [k for k, c in self._counters.items() if k[3] + 2 * k[2] <= now and not c[1]]:
+                del self._counters[k]
+
+    def start_sync(self, session_factory, interval: float = 1.0) -> threading.Thread:
+        def run():
+            last_prune = 0.0
+            while True:
+                time.sleep(interval)
+                db = session_factory()
+                try:
+                    self.sync(db)
+                    if time.monotonic() - last_prune > 60:
+                        db.execute(text("DELETE FROM rate_counters WHERE window_start + 2 * window_seconds < :now"), {"now": int(time.time())})
+                        db.commit()
+                        last_prune = time.monotonic()
+                except Exception:
+                    db.rollback()
+                    log.exception("rate counter sync failed")
+                finally:
+                    db.close()
+
+        t = threading.Thread(target=run, name="ratelimit-sync", daemon=True)
+        t.start()
+        return t
@@ -0,0 +1,94 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+MANIFEST = ".manifest.json"
+CHANGED = ".changed"
+LOCK = ".render.lock"
+_lock = threading.Lock()
+
+
+def write_atomic(path: Path, data: str | bytes, mode: int | None = None):
+    # temp file in the same directory + rename, so Postfix never sees a half-written map
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def digest(data: str) -> str:
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def load_manifest(directory: Path) -> dict:
+    try:
+        return json.loads((directory / MANIFEST).read_text())
+    except Exception:
+        return {"files": {}}
+
+
+@contextmanager
+def _locked(directory: Path):
+    # every uvicorn worker renders into the same directory; the manifest and .changed are read-modify-write
+    with _lock, open(directory / LOCK, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _mark_changed(directory: Path, names: list[str]):
+    path = directory / CHANGED
+    pending = set(path.read_text().split()) if path.exists() else set()
+    if names or not path.exists():
+        write_atomic(path, "".join(f"{n}\n" for n in sorted(pending | set(names))))
+
+
+def publish(directory: Path, files: dict[str, str], modes: dict[str, int] | None = None) -> list[str]:
+    """Writes only the files whose content hash changed and records them for the Postfix side."""
+    modes = modes or {}
+    with _locked(directory):
+        manifest = load_manifest(directory)
+        hashes = manifest.setdefault("files", {})
+        changed = []
+        for name, data in files.items():
+            h = digest(data)
+            if hashes.get(name) == h and (directory / name).exists():
+                continue
+            write_atomic(directory / name, data, modes.get(name))
+            hashes[name] = h
+            changed.append(name)
+        if changed:
+            manifest["generation"] = manifest.get("generation", 0) + 1
+            _mark_changed(directory, changed)
+            write_atomic(directory / MANIFEST, json.dumps(manifest, indent=2, sort_keys=True))
+        return changed
+
+
+def request_reload(directory: Path, extra: list[str] | None = None):
+    # An existing (possibly empty) .changed tells the entrypoint to skip postmap/reload when nothing changed.
+    # `extra` flags non-map changes that still need a reload, e.g. "tls" after new certificates.
+    with _locked(directory):
+        _mark_changed(directory, extra or [])
+        (directory / ".reload").touch()
+
+
+def pending_reload_age(directory: Path) -> float | None:
+    """Seconds since a `.reload` was requested that Postfix has not consumed yet, None if none is pending."""
+    try:
+        return max(0.0, time.time() - (directory / ".reload").stat().st_mtime)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+import psycopg
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .models import ConfigVersion, DomainPolicy, RateLimit, RelayRoute
+
+log = logging.getLogger("mailrelay.replication")
+CHANNEL = "config_version"
+# a full snapshot at least every SNAPSHOT_EVERY versions bounds the deltas replayed by materialize
+SNAPSHOT_EVERY = int(os.getenv("CONFIG_SNAPSHOT_EVERY", "50"))
+_materialized: dict[int, dict] = {}
+_materialized_lock = threading.Lock()
+
+
+def diff_config(old: dict, new: dict) -> dict:
+    old_domains, new_domains = set(old.get("domains", [])), set(new.get("domains", []))
+    old_routes = {r["sender_domain"]: r for r in old.get("routes", [])}
+    new_routes = {r["sender_domain"]: r for r in new.get("routes", [])}
+    delta = {
+        "domains": {"added": sorted(new_domains - old_domains), "removed": sorted(old_domains - new_domains)},
+        "routes": {
+            "upserted": [r for d, r in sorted(new_routes.items()) if old_routes.get(d) != r],
+            "removed": sorted(set(old_routes) - set(new_routes)),
+        },
+    }
+    # the rate limit list is small, it is shipped whole when it changed
+    if old.get("rate_limits", []) != new.get("rate_limits", []):
+        delta["rate_limits"] = new.get("rate_limits", [])
+    return delta
+
+
+def apply_delta(data: dict, delta: dict) -> dict:
+    domains = (set(data.get("domains", [])) | set(delta["domains"]["added"])) - set(delta["domains"]["removed"])
+    routes = {r["sender_domain"]: r for r in data.get("routes", [])}
+    for d in delta["routes"]["removed"]:
+        routes.pop(d, None)
+    for r in delta["routes"]["upserted"]:
+        routes[r["sender_domain"]] = r
+    return {"domains": sorted(domains), "routes": [routes[d] for d in sorted(routes)], "rate_limits": delta.get("rate_limits", data.get("rate_limits", []))}
+
+
+def materialize(db: Session, version: int) -> dict | None:
+    """The whole config at `version`: the newest full row at or below it plus the deltas after that."""
+    with _materialized_lock:
+        if version in _materialized:
+            return _materialized[version]
+    full = db.query(func.max(ConfigVersion.version)).filter(ConfigVersion.kind == "full", ConfigVersion.version <= version).scalar()
+    if full is None:
+        return None
+    with _materialized_lock:
+        start = max((v for v in _materialized if full <= v < version), default=None)
+        data = _materialized.get(start)
+    rows = db.query(ConfigVersion.version, ConfigVersion.kind, ConfigVersion.data).filter(ConfigVersion.version > (start if start is not None else full - 1), ConfigVersion.version <= version).order_by(ConfigVersion.version)
+    last = start
+    for v, kind, body in rows:
+        data = json.loads(body) if kind == "full" else apply_delta(data, json.loads(body))
+        last = v
+    if last != version:
+        return None
+    with _materialized_lock:
+        _materialized[version] = data
+        # the chain of the newest versions is all that later calls start from
+        for v in sorted(_materialized)[:-8]:
+            del _materialized[v]
+    return data
+
+
+def record_version(db: Session, data: dict, actor: str, version: int | None = None, applied: bool = False) -> int:
+    """Adds `data` as a new config version, stored as a delta against the previous one where that is smaller."""
+    latest = db.query(func.max(ConfigVersion.version)).scalar() or 0
+    v = version or latest + 1
+    last_full = db.query(func.max(ConfigVersion.version)).filter(ConfigVersion.kind == "full").scalar() or 0
+    previous = materialize(db, latest) if latest else None
+    full = json.dumps(data)
+    kind, body = "full", full
+    if previous is not None and v - last_full < SNAPSHOT_EVERY:
+        delta = json.dumps(diff_config(previous, data))
+        if len(delta) * 2 < len(full):
+            kind, body = "delta", delta
+    db.add(ConfigVersion(version=v, kind=kind, data=body, created_by=actor, applied=applied))
+    return v
+
+
+_compacted_until = 0
+
+
+def compact_history(db: Session, batch: int = 200) -> int:
+    """Rewrites up to `batch` full rows from before delta storage as deltas, oldest first."""
+    global _compacted_until
+    versions = [v for (v,) in db.query(ConfigVersion.version).filter(ConfigVersion.kind == "full").order_by(ConfigVersion.version)]
+    done, kept = 0, None
+    for v in versions:
+        if kept is None or v - kept >= SNAPSHOT_EVERY or v <= _compacted_until:
+            kept = v
+            continue
+        if done >= batch:
+            break
+        previous = db.query(func.max(ConfigVersion.version)).filter(ConfigVersion.version < v).scalar()
+        base, row = materialize(db, previous), db.query(ConfigVersion).filter(ConfigVersion.version == v).one()
+        delta = json.dumps(diff_config(base, json.loads(row.data)))
+        if len(delta) * 2 < len(row.data):
+            row.kind, row.data = "delta", delta
+            db.flush()
+        else:
+            kept = v
+        done += 1
+        _compacted_until = v
+    db.commit()
+    return done
+
+
+def changes_since(db: Session, since: int) -> dict | None:
+    latest = db.query(func.max(ConfigVersion.version)).scalar()
+    if not latest or latest <= since:
+        return None
+    data = materialize(db, latest)
+    base = materialize(db, since) if since else None
+    if base is None:
+        return {"version": latest, "from": since, "full": True, "data": data}
+    return {"version": latest, "from": since, "full": False, "delta": diff_config(base, data)}
+
+
+def replace_config(db: Session, data: dict):
+    """Makes domains, routes and (if present) rate limits exactly `data`; used for full snapshots and rollbacks."""
+    db.query(DomainPolicy).delete()
+    db.query(RelayRoute).delete()
+    db.add_all([DomainPolicy(domain=d, enabled=True) for d in data.get("domains", [])])
+    db.add_all([RelayRoute(**r) for r in data.get("routes", [])])
+    if "rate_limits" in data:
+        replace_rate_limits(db, data["rate_limits"])
+
+
+def apply_changes(db: Session, payload: dict) -> dict:
+    """Applies a full snapshot or a version delta from the master in one transaction."""
+    if payload.get("full"):
+        data = payload["data"]
+        replace_config(db, data)
+    else:
+        delta = payload["delta"]
+        data = apply_delta(materialize(db, payload["from"]) or {}, delta)
+        if delta["domains"]["removed"]:
+            db.query(DomainPolicy).filter(DomainPolicy.domain.in_(delta["domains"]["removed"])).delete(synchronize_session=False)
+        known = {d for (d,) in db.query(DomainPolicy.domain).filter(DomainPolicy.domain.in_(delta["domains"]["added"])).all()} if delta["domains"]["added"] else set()
+        db.add_all([DomainPolicy(domain=d, enabled=True) for d in delta["domains"]["added"] if d not in known])
+        if delta["routes"]["removed"]:
+            db.query(RelayRoute).filter(RelayRoute.sender_domain.in_(delta["routes"]["removed"])).delete(synchronize_session=False)
+        existing = {r.sender_domain: r for r in db.query(RelayRoute).filter(RelayRoute.sender_domain.in_([r["sender_domain"] for r in delta["routes"]["upserted"]])).all()}
+        for r in delta["routes"]["upserted"]:
+            row = existing.get(r["sender_domain"])
+            if row:
+                for k, v in r.items():
+                    setattr(row, k, v)
+            else:
+                db.add(RelayRoute(**r))
+        if "rate_limits" in delta:
+            replace_rate_limits(db, delta["rate_limits"])
+    record_version(db, data, "master-sync", version=payload["version"])
+    db.commit()
+    return data
+
+
+def replace_rate_limits(db: Session, limits: list[dict]):
+    db.query(RateLimit).delete()
+    db.flush()
+    db.add_all([RateLimit(**r) for r in limits])
+
+
+class ConfigNotifier:
+    """Wakes long-poll waiters when a new config version exists."""
+
+    def __init__(self):
+        self.version = 0
+        self._cond = threading.Condition()
+        self._waiters: set[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._listener: threading.Thread | None = None
+
+    def notify(self, version: int):
+        with self._cond:
+            if version <= self.version:
+                return
+            self.version = version
+            self._cond.notify_all()
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+    def wait(self, since: int, timeout: float) -> int:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.version <= since:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self.version
+
+    async def wait_async(self, since: int, timeout: float) -> int:
+        """`wait` for request handlers: a waiting long-poll holds no threadpool thread."""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._cond:
+            if self.version > since:
+                return self.version
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._cond:
+                self._waiters.discard(waiter)
+        return self.version
+
+    def start_listener(self, dsn: str):
+        if self._listener is None:
+            self._listener = threading.Thread(target=self._listen, args=(dsn,), name="config-listener", daemon=True)
+            self._listener.start()
+
+    def _listen(self, dsn: str):
+        while True:
+            try:
+                with psycopg.connect(dsn, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {CHANNEL}")
+                    for n in conn.notifies():
+                        self.notify(int(n.payload))
+            except Exception:
+                log.exception("config LISTEN connection lost")
+                time.sleep(5)
+
+
+def seed_notifier(db: Session, notifier: ConfigNotifier):
+    notifier.notify(db.query(func.max(ConfigVersion.version)).scalar() or 0)
+
+
+def long_poll_timeout() -> float:
+    return float(os.getenv("CONFIG_LONGPOLL_SECONDS", "25"))
@@ -0,0 +1,114 @@
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from .metrics import RETENTION_ROWS
+from .models import TrafficRollup
+from .ratelimit import RATE_REASON
+
+KEY = ["granularity", "bucket", "kind", "status", "target", "tls_used", "reason"]
+MINUTE_RETENTION = timedelta(hours=48)
+GROUP_COLUMNS = {"status": TrafficRollup.status, "target": TrafficRollup.target, "tls": TrafficRollup.tls_used, "reason": TrafficRollup.reason}
+
+
+def normalize_reason(reason: str | None) -> str:
+    # addresses make every reject text unique; keep the rollup key low-cardinality
+    if (reason or "").startswith(RATE_REASON):
+        # the sender/IP key after the prefix stays in rejection_logs only
+        return RATE_REASON
+    return re.sub(r"<[^>]*>", "<>", reason or "")[:255]
+
+
+def rollup_keys(row: dict, kind: str):
+    ts = row.get("created_at") or datetime.utcnow()
+    if kind == "mail":
+        dims = ((row.get("status") or "")[:32], (row.get("target") or "")[:255], bool(row.get("tls_used")), "")
+    else:
+        dims = ("", "", False, normalize_reason(row.get("reason")))
+    yield ("m", ts.replace(second=0, microsecond=0), kind, *dims)
+    yield ("h", ts.replace(minute=0, second=0, microsecond=0), kind, *dims)
+
+
+def collect(mails: list[dict], rejects: list[dict]) -> Counter:
+    c = Counter()
+    for kind, rows in (("mail", mails), ("reject", rejects)):
+        for row in rows:
+            for key in rollup_keys(row, kind):
+                c[key] += 1
+    return c
+
+
+def rollup_upsert(counts: Counter):
+    # sorted keys give concurrent writers the same row lock order
+    values = [dict(zip(KEY, k), count=n) for k, n in sorted(counts.items())]
+    stmt = pg_insert(TrafficRollup).values(values)
+    return stmt.on_conflict_do_update(index_elements=KEY, set_={"count": TrafficRollup.count + stmt.excluded.count})
+
+
+def apply_rollups(db: Session, counts: Counter):
+    if counts:
+        db.execute(rollup_upsert(counts))
+
+
+def count_since_select(kind: str, since: datetime):
+    # minute buckets for the partial first hour, hour buckets for the rest
+    first_full_hour = since.replace(minute=0, second=0, microsecond=0) + (timedelta(hours=1) if since.minute or since.second or since.microsecond else timedelta())
+    return select(func.coalesce(func.sum(TrafficRollup.count), 0)).where(
+        TrafficRollup.kind == kind,
+        or_(
+            and_(TrafficRollup.granularity == "m", TrafficRollup.bucket >= since.replace(second=0, microsecond=0), TrafficRollup.bucket < first_full_hour),
+            and_(TrafficRollup.granularity == "h", TrafficRollup.bucket >= first_full_hour),
+        ),
+    )
+
+
+def count_since(db: Session, kind: str, since: datetime) -> int:
+    return int(db.execute(count_since_select(kind, since)).scalar())
+
+
+def timeseries(db: Session, kind: str, since: datetime, granularity: str, group_by: str | None):
+    col = GROUP_COLUMNS.get(group_by) if group_by else None
+    cols = [TrafficRollup.bucket] + ([col] if col is not None else [])
+    q = (
+        db.query(*cols, func.sum(TrafficRollup.count))
+        .filter(TrafficRollup.granularity == granularity, TrafficRollup.kind == kind, TrafficRollup.bucket >= since)
+        .group_by(*cols)
+        .order_by(TrafficRollup.bucket)
+    )
+    return [{"bucket": r[0].isoformat(), "key": r[1] if col is not None else None, "count": int(r[-1])} for r in q.all()]
+
+
+def backfill(db: Session, since: datetime):
+    # Rebuilds buckets from the raw tables, e.g. for rows written by COPY or before rollups existed.
+    for granularity, unit, start in (("h", "hour", since), ("m", "minute", max(since, datetime.utcnow() - MINUTE_RETENTION))):
+        params = {"g": granularity, "since": start, "rate": RATE_REASON}
+        db.execute(
+            text(
+                f"""INSERT INTO traffic_rollups (granularity, bucket, kind, status, target, tls_used, reason, count)
+                SELECT :g, date_trunc('{unit}', created_at), 'mail', left(coalesce(status, ''), 32), left(coalesce(target, ''), 255), tls_used, '', count(*)
+                FROM mail_logs WHERE created_at >= :since GROUP BY 2, 4, 5, 6
+                ON CONFLICT (granularity, bucket, kind, status, target, tls_used, reason) DO UPDATE SET count = EXCLUDED.count"""
+            ),
+            params,
+        )
+        db.execute(
+            text(
+                f"""INSERT INTO traffic_rollups (granularity, bucket, kind, status, target, tls_used, reason, count)
+                SELECT :g, date_trunc('{unit}', created_at), 'reject', '', '', FALSE,
+                  CASE WHEN starts_with(coalesce(reason, ''), :rate) THEN :rate ELSE left(regexp_replace(coalesce(reason, ''), '<[^>]*>', '<>', 'g'), 255) END, count(*)
+                FROM rejection_logs WHERE created_at >= :since GROUP BY 2, 7
+                ON CONFLICT (granularity, bucket, kind, status, target, tls_used, reason) DO UPDATE SET count = EXCLUDED.count"""
+            ),
+            params,
+        )
+    db.commit()
+
+
+def prune(db: Session, cutoff: datetime):
+    deleted = db.query(TrafficRollup).filter(TrafficRollup.granularity == "m", TrafficRollup.bucket < datetime.utcnow() - MINUTE_RETENTION).delete()
+    deleted += db.query(TrafficRollup).filter(TrafficRollup.bucket < cutoff).delete()
+    RETENTION_ROWS.labels("traffic_rollups").inc(deleted)
@@ -0,0 +1,156 @@
+import hashlib
+import random
+
+from sqlalchemy.orm import Session
+
+from .models import RelayRoute, RelayTargetHealth
+
+MASTER_FRAGMENT = "master.cf.routes"
+MAIN_FRAGMENT = "main.cf.routes"
+TUNING_FIELDS = ("concurrency_limit", "rate_delay", "recipient_limit", "connection_cache")
+
+
+def normalize_targets(targets: list[dict]) -> list[dict]:
+    """Validated copy of a route's target list, ordered like MX records: priority, then weight (highest first)."""
+    out, seen = [], set()
+    for t in targets:
+        host = (t.get("host") or "").strip().strip("[]").lower()
+        port = int(t.get("port") or 25)
+        if not host or not 0 < port < 65536 or (host, port) in seen:
+            raise ValueError(f"invalid or duplicate target {host}:{port}")
+        weight, priority = int(t.get("weight", 1)), int(t.get("priority", 0))
+        if weight < 1 or priority < 0:
+            raise ValueError(f"weight must be >= 1 and priority >= 0 ({host}:{port})")
+        max_conn, rate_delay = t.get("max_connections"), t.get("rate_delay")
+        if (max_conn is not None and int(max_conn) < 1) or (rate_delay is not None and int(rate_delay) < 0):
+            raise ValueError(f"invalid max_connections/rate_delay ({host}:{port})")
+        seen.add((host, port))
+        out.append({
+            "host": host,
+            "port": port,
+            "weight": weight,
+            "priority": priority,
+            "max_connections": int(max_conn) if max_conn is not None else None,
+            "rate_delay": int(rate_delay) if rate_delay is not None else None,
+        })
+    return sorted(out, key=lambda t: (t["priority"], -t["weight"], t["host"], t["port"]))
+
+
+def route_targets(r) -> list[dict]:
+    # routes without a target list keep their single target_host/target_port
+    if r.targets:
+        return r.targets
+    return [{"host": r.target_host, "port": r.target_port or 25, "weight": 1, "priority": 0, "max_connections": None, "rate_delay": None}]
+
+
+def target_key(host: str, port: int) -> str:
+    return f"{host}:{port}"
+
+
+def nexthop(t: dict) -> str:
+    return f"[{t['host']}]:{t['port']}"
+
+
+def transport_name(sender_domain: str, t: dict | None = None) -> str:
+    # derived from the content, so master and slave render the same names and an unchanged target keeps its service;
+    # without a target it names the route's own transport
+    key = f"{sender_domain}|{t['host']}:{t['port']}" if t else sender_domain
+    return "rt_" + hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+def route_tuning(r) -> dict:
+    return {k: getattr(r, k) for k in TUNING_FIELDS if getattr(r, k, None)}
+
+
+def validate_tuning(values: dict):
+    for k in ("concurrency_limit", "recipient_limit"):
+        if values.get(k) is not None and not 1 <= values[k] <= 1000:
+            raise ValueError(f"{k} must be between 1 and 1000")
+    if values.get("rate_delay") is not None and not 0 <= values["rate_delay"] <= 3600:
+        raise ValueError("rate_delay must be between 0 and 3600 seconds")
+
+
+def service(name: str, maxproc, options: list[str], params: dict) -> tuple[str, list[str]]:
+    """One smtp service line for master.cf and its qmgr parameters (<service>_destination_*) for main.cf."""
+    lines = [f"{name} unix - - y - {maxproc or '-'} smtp", *(f"  -o {o}" for o in options)]
+    main = [f"{name}_destination_{k} = {v}" for k, v in params.items() if v]
+    return "\n".join(lines), main
+
+
+def render_route_files(routes: list) -> dict[str, str]:
+    """Map lines and the master.cf/main.cf fragments for all routes."""
+    sender_relay, sender_transport, transport, sasl, master, main = [], [], [], [], [], []
+    for r in sorted(routes, key=lambda r: r.sender_domain):
+        targets = route_targets(r)
+        tuning = route_tuning(r)
+        hops = ", ".join(nexthop(t) for t in targets)
+        sender_relay.append(f"@{r.sender_domain} {hops}")
+        if r.auth_username:
+            sasl.extend(f"{nexthop(t)} {r.auth_username}:{r.auth_password}" for t in targets)
+        if len(targets) < 2 and not tuning:
+            transport.append(f"{r.sender_domain} smtp:{hops}")
+            continue
+        name = transport_name(r.sender_domain)
+        transport.append(f"{r.sender_domain} {name}:{hops}")
+        sender_transport.append(f"@{r.sender_domain} {name}")
+        options = [f"smtp_connection_cache_destinations={','.join(nexthop(t) for t in targets)}"] if tuning.get("connection_cache") else []
+        params = {
+            "concurrency_limit": tuning.get("concurrency_limit"),
+            "rate_delay": f"{tuning['rate_delay']}s" if tuning.get("rate_delay") else None,
+            "recipient_limit": tuning.get("recipient_limit"),
+        }
+        services = [service(name, None, options, params)]
+        if len(targets) > 1:
+            for t in targets:
+                fallback = ",".join(nexthop(o) for o in targets if o is not t)
+                rate = f"{t['rate_delay']}s" if t["rate_delay"] else params["rate_delay"]
+                services.append(service(transport_name(r.sender_domain, t), t["max_connections"], [f"smtp_fallback_relay={fallback}", *options], {**params, "rate_delay": rate}))
+        for line, params_lines in services:
+            master.append(line)
+            main.extend(params_lines)
+    header = "# generated by the backend from relay_routes - do not edit\n"
+    return {
+        "sender_relay": "".join(f"{line}\n" for line in sender_relay),
+        "sender_transport": "".join(f"{line}\n" for line in sender_transport),
+        "transport": "".join(f"{line}\n" for line in transport),
+        "sasl_passwd": "".join(f"{line}\n" for line in sasl),
+        MASTER_FRAGMENT: header + "".join(f"{line}\n" for line in master),
+        MAIN_FRAGMENT: header + "".join(f"{line}\n" for line in main),
+    }
+
+
+class RouteIndex:
+    """Weighted choice of a target per message for routes with several targets."""
+
+    def __init__(self, routes: list, down: set[str] | None = None, rng: random.Random | None = None):
+        self.down = down or set()
+        self.rng = rng or random.Random()
+        # sender domain -> [(priority, [(transport, nexthop, weight, health key)])], best tier first
+        self.routes: dict[str, list[tuple[int, list[tuple]]]] = {}
+        for r in routes:
+            targets = route_targets(r)
+            if len(targets) < 2:
+                continue
+            tiers: dict[int, list] = {}
+            for t in targets:
+                tiers.setdefault(t["priority"], []).append((transport_name(r.sender_domain, t), nexthop(t), t["weight"], target_key(t["host"], t["port"])))
+            self.routes[r.sender_domain.lower()] = sorted(tiers.items())
+
+    def __len__(self):
+        return len(self.routes)
+
+    def choose(self, sender: str) -> tuple[str, str] | None:
+        tiers = self.routes.get(sender.rpartition("@")[2].lower().rstrip("."))
+        if not tiers:
+            return None
+        candidates = next((up for _, tier in tiers if (up := [t for t in tier if t[3] not in self.down])), tiers[0][1])
+        name, hop, _, _ = candidates[0] if len(candidates) == 1 else self.rng.choices(candidates, weights=[t[2] for t in candidates])[0]
+        return name, hop
+
+
+def load_down(db: Session) -> set[str]:
+    return {t for (t,) in db.query(RelayTargetHealth.target).filter(RelayTargetHealth.up.is_(False)).all()}
+
+
+def load_route_index(db: Session) -> RouteIndex:
+    return RouteIndex(db.query(RelayRoute).filter(RelayRoute.targets.is_not(None)).all(), load_down(db))
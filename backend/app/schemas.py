@@ -8,18 +8,55 @@ class PasswordChangeRequest(BaseModel):
     old_password: str
     new_password: str
 
+class RouteTargetRequest(BaseModel):
+    host: str
+    port: int = 25
+    weight: int = 1
+    priority: int = 0
+    max_connections: int | None = None
+    rate_delay: int | None = None
+
 class RouteRequest(BaseModel):
     sender_domain: str
-    target_host: str
+    target_host: str | None = None
     target_port: int = 25
     tls_mode: str = "opportunistic"
     tls_verify: bool = False
     auth_username: str | None = None
     auth_password: str | None = None
+    targets: list[RouteTargetRequest] | None = None
+    concurrency_limit: int | None = None
+    rate_delay: int | None = None
+    recipient_limit: int | None = None
+    connection_cache: bool = False
+
+class RouteTransportRequest(BaseModel):
+    concurrency_limit: int | None = None
+    rate_delay: int | None = None
+    recipient_limit: int | None = None
+    connection_cache: bool = False
+
+class RouteTargetsRequest(BaseModel):
+    targets: list[RouteTargetRequest]
 
 class DomainRequest(BaseModel):
     domain: str
 
+class QueueActionRequest(BaseModel):
+    action: str
+    queue_ids: list[str] | None = None
+    queue: str | None = None
+    sender: str | None = None
+    recipient_domain: str | None = None
+    reason: str | None = None
+
+class RateLimitRequest(BaseModel):
+    scope: str
+    match: str = "*"
+    max_messages: int
+    window_seconds: int = 60
+    enabled: bool = True
+
 class ClusterSettingsRequest(BaseModel):
     node_id: str
     node_ip: str
@@ -0,0 +1,122 @@
+import base64
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException, Query
+from sqlalchemy import func, literal_column, select, tuple_
+from sqlalchemy.orm import Session
+
+from .models import MailLog
+
+@dataclass
+class MailFilter:
+    sender: str | None = None
+    recipient: str | None = None
+    ip: str | None = None
+    status: str | None = None
+    target: str | None = None
+    tls: bool | None = None
+    sender_domain: str | None = None
+    recipient_domain: str | None = None
+    match: str = "contains"
+    hours: int = 24
+
+
+def mail_filter(
+    sender: str | None = None,
+    recipient: str | None = None,
+    ip: str | None = None,
+    status: str | None = None,
+    target: str | None = None,
+    tls: bool | None = None,
+    sender_domain: str | None = None,
+    recipient_domain: str | None = None,
+    match: str = Query(default="contains", pattern="^(contains|prefix|exact)$"),
+    # beyond RETENTION_DAYS the search continues in the archive (archive.py)
+    hours: int = Query(default=24, ge=1, le=24 * 366),
+) -> MailFilter:
+    return MailFilter(sender, recipient, ip, status, target, tls, sender_domain, recipient_domain, match, hours)
+
+
+def like_escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def domain_of(col):
+    # must stay identical to the expression of ix_mail_logs_*_domain in db/init.sql
+    return func.lower(func.split_part(col, literal_column("'@'"), literal_column("2")))
+
+
+def text_match(col, value: str, match: str):
+    # contains -> pg_trgm GIN, prefix/exact -> lower(col) text_pattern_ops B-tree
+    if match == "exact":
+        return func.lower(col) == value.lower()
+    if match == "prefix":
+        return func.lower(col).like(like_escape(value.lower()) + "%", escape="\\")
+    return col.ilike(f"%{like_escape(value)}%", escape="\\")
+
+
+def domain_match(col, value: str, match: str):
+    value = value.lower().lstrip("@")
+    if match == "prefix":
+        return domain_of(col).like(like_escape(value) + "%", escape="\\")
+    return domain_of(col) == value
+
+
+def mail_conditions(f: MailFilter, since: datetime | None = None) -> list:
+    conds = [MailLog.created_at >= (since or datetime.utcnow() - timedelta(hours=f.hours))]
+    for col, value in ((MailLog.sender, f.sender), (MailLog.recipient, f.recipient), (MailLog.client_ip, f.ip), (MailLog.target, f.target)):
+        if value:
+            conds.append(text_match(col, value, f.match))
+    if f.status:
+        conds.append(MailLog.status.ilike(f"%{like_escape(f.status)}%", escape="\\") if f.match == "contains" else func.lower(MailLog.status) == f.status.lower())
+    if f.sender_domain:
+        conds.append(domain_match(MailLog.sender, f.sender_domain, f.match))
+    if f.recipient_domain:
+        conds.append(domain_match(MailLog.recipient, f.recipient_domain, f.match))
+    if f.tls is not None:
+        conds.append(MailLog.tls_used.is_(f.tls))
+    return conds
+
+
+def filtered_mail_query(db: Session, f: MailFilter, since: datetime | None = None):
+    return db.query(MailLog).filter(*mail_conditions(f, since))
+
+
+def filtered_mail_select(f: MailFilter, since: datetime | None = None):
+    return select(MailLog).where(*mail_conditions(f, since))
+
+
+def encode_cursor(row: MailLog) -> str:
+    return base64.urlsafe_b64encode(f"{row.created_at.isoformat()}|{row.id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        ts, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
+def keyset_page(q, cursor: str | None, limit: int):
+    if cursor:
+        ts, row_id = decode_cursor(cursor)
+        q = q.filter(tuple_(MailLog.created_at, MailLog.id) < tuple_(ts, row_id))
+    rows = q.order_by(MailLog.created_at.desc(), MailLog.id.desc()).limit(limit + 1).all()
+    return rows[:limit], (encode_cursor(rows[limit - 1]) if len(rows) > limit else None)
+
+
+def mail_out(r: MailLog) -> dict:
+    return {
+        "sender": r.sender,
+        "recipient": r.recipient,
+        "ip": r.client_ip,
+        "status": r.status,
+        "target": r.target,
+        "tls": r.tls_used,
+        "timestamp": r.created_at.isoformat(),
+        "smtp_code": r.smtp_code,
+        "smtp_text": r.smtp_text,
+        "queue_id": r.queue_id,
+    }
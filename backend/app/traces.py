@@ -0,0 +1,116 @@
+from datetime import datetime
+
+from sqlalchemy import case, func, or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from .metrics import RETENTION_ROWS
+from .models import MailLog, MailTrace
+
+COUNTED = {"ok": "delivered", "deferred": "deferred", "bounced": "bounced"}
+
+
+def collect(mails: list[dict]) -> list[dict]:
+    """Folds a batch of delivery rows into one summary row per queue-ID (rows without one are skipped)."""
+    traces: dict[str, dict] = {}
+    for row in sorted((r for r in mails if r.get("queue_id")), key=lambda r: r["created_at"]):
+        t = traces.get(row["queue_id"])
+        if t is None:
+            t = traces[row["queue_id"]] = {
+                "queue_id": row["queue_id"],
+                "message_id": None,
+                "sender": None,
+                "client_ip": None,
+                "first_seen": row["created_at"],
+                "attempts": 0,
+                "delivered": 0,
+                "deferred": 0,
+                "bounced": 0,
+                "tls_used": False,
+            }
+        for k in ("message_id", "sender", "client_ip"):
+            t[k] = t[k] or row.get(k)
+        t["attempts"] += 1
+        if row.get("status") in COUNTED:
+            t[COUNTED[row["status"]]] += 1
+        t["tls_used"] = t["tls_used"] or bool(row.get("tls_used"))
+        t.update(last_seen=row["created_at"], status=(row.get("status") or "unknown")[:32], last_target=row.get("target"), last_smtp_code=row.get("smtp_code"), last_smtp_text=row.get("smtp_text"))
+    return [traces[k] for k in sorted(traces)]
+
+
+def trace_upsert(rows: list[dict]):
+    # rows are sorted by queue_id, so concurrent writers lock summary rows in the same order
+    stmt = pg_insert(MailTrace).values(rows)
+    ex = stmt.excluded
+    newer = ex.last_seen >= MailTrace.last_seen
+    latest = {c: case((newer, getattr(ex, c)), else_=getattr(MailTrace, c)) for c in ("status", "last_target", "last_smtp_code", "last_smtp_text")}
+    return stmt.on_conflict_do_update(
+        index_elements=[MailTrace.queue_id],
+        set_={
+            "message_id": func.coalesce(MailTrace.message_id, ex.message_id),
+            "sender": func.coalesce(MailTrace.sender, ex.sender),
+            "client_ip": func.coalesce(MailTrace.client_ip, ex.client_ip),
+            "first_seen": func.least(MailTrace.first_seen, ex.first_seen),
+            "last_seen": func.greatest(MailTrace.last_seen, ex.last_seen),
+            "attempts": MailTrace.attempts + ex.attempts,
+            "delivered": MailTrace.delivered + ex.delivered,
+            "deferred": MailTrace.deferred + ex.deferred,
+            "bounced": MailTrace.bounced + ex.bounced,
+            "tls_used": MailTrace.tls_used | ex.tls_used,
+            **latest,
+        },
+    )
+
+
+def apply_traces(db: Session, mails: list[dict]):
+    rows = collect(mails)
+    if rows:
+        db.execute(trace_upsert(rows))
+
+
+def trace_select(trace_id: str):
+    # queue-ID or Message-ID; one Message-ID can span several queue-IDs (e.g. re-injected mail)
+    return select(MailTrace).where(or_(MailTrace.queue_id == trace_id, MailTrace.message_id == trace_id.strip("<>"))).order_by(MailTrace.first_seen).limit(20)
+
+
+def events_select(traces: list[MailTrace]):
+    # the time bounds let PostgreSQL skip every daily partition outside the message's lifetime
+    return (
+        select(MailLog)
+        .where(
+            MailLog.queue_id.in_([t.queue_id for t in traces]),
+            MailLog.created_at >= min(t.first_seen for t in traces),
+            MailLog.created_at <= max(t.last_seen for t in traces),
+        )
+        .order_by(MailLog.created_at, MailLog.id)
+    )
+
+
+def per_message_select(conds: list, limit: int):
+    """One summary row per message whose events match `conds` (mail_conditions), newest first."""
+    ids = select(MailLog.queue_id).where(*conds, MailLog.queue_id.is_not(None))
+    return select(MailTrace).where(MailTrace.queue_id.in_(ids)).order_by(MailTrace.last_seen.desc()).limit(limit)
+
+
+def trace_out(t: MailTrace) -> dict:
+    return {
+        "queue_id": t.queue_id,
+        "message_id": t.message_id,
+        "sender": t.sender,
+        "ip": t.client_ip,
+        "status": t.status,
+        "attempts": t.attempts,
+        "delivered": t.delivered,
+        "deferred": t.deferred,
+        "bounced": t.bounced,
+        "target": t.last_target,
+        "smtp_code": t.last_smtp_code,
+        "smtp_text": t.last_smtp_text,
+        "tls": t.tls_used,
+        "first_seen": t.first_seen.isoformat(),
+        "last_seen": t.last_seen.isoformat(),
+    }
+
+
+def prune(db: Session, cutoff: datetime):
+    RETENTION_ROWS.labels("mail_traces").inc(db.query(MailTrace).filter(MailTrace.last_seen < cutoff).delete())
@@ -0,0 +1,123 @@
+"""Archive segment size and historical search latency, without a database.
+
+    python bench/bench_archive.py --rows 1000000 --days 30 --codec zlib
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ["ARCHIVE_DIR"] = tempfile.mkdtemp(prefix="mailrelay-archive-")
+
+from app import archive  # noqa: E402
+from app.search import MailFilter  # noqa: E402
+
+STATUSES = ["sent"] * 90 + ["deferred"] * 7 + ["bounced"] * 3
+
+
+def day_rows(day: datetime, n: int, first_id: int, rnd: random.Random, domains: int) -> list[tuple]:
+    step = 86400 / n
+    rows = []
+    for i in range(n):
+        status = rnd.choice(STATUSES)
+        d = min(int(rnd.paretovariate(1.1)), domains) - 1
+        rows.append((
+            first_id + i,
+            day + timedelta(seconds=i * step),
+            f"user{rnd.randrange(50)}@sender{d}.tld",
+            f"rcpt{rnd.randrange(200_000)}@dest{rnd.randrange(domains)}.tld",
+            f"10.0.{rnd.randrange(250)}.{rnd.randrange(200)}",
+            "mx.client.tld",
+            None,
+            f"relay{rnd.randrange(8)}:25",
+            status,
+            "250" if status == "sent" else "451",
+            "2.0.0 Ok: queued" if status == "sent" else "4.7.1 Try again later",
+            rnd.random() < 0.7,
+            None,
+            f"{first_id + i:011X}",
+            f"<{first_id + i}@sender{d}.tld>",
+        ))
+    return rows
+
+
+def csv_bytes(rows: list[tuple]) -> int:
+    return sum(len(",".join("" if v is None else str(v) for v in r)) + 1 for r in rows)
+
+
+def timed(fn, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        n = len(fn())
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"rows": n, "p50_ms": round(statistics.median(samples), 2), "max_ms": round(max(samples), 2)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000, help="rows in total, spread over --days")
+    ap.add_argument("--days", type=int, default=30)
+    ap.add_argument("--domains", type=int, default=2000)
+    ap.add_argument("--codec", choices=sorted(archive.COMPRESS), default=archive.CODEC)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    rnd = random.Random(42)
+    per_day = args.rows // args.days
+    end = datetime.combine(datetime.utcnow().date(), datetime.min.time()) - timedelta(days=1)
+    start = end - timedelta(days=args.days)
+
+    raw = size = 0
+    segments = []
+    write_started = time.perf_counter()
+    for d in range(args.days):
+        day = start + timedelta(days=d)
+        rows = day_rows(day, per_day, d * per_day + 1, rnd, args.domains)
+        raw += csv_bytes(rows)
+        path = archive.table_dir() / f"{day:%Y}" / f"{day:%Y%m%d}.seg"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        writer = archive.SegmentWriter(path, args.codec)
+        for i in range(0, len(rows), archive.GROUP_ROWS):
+            writer.add_group(rows[i : i + archive.GROUP_ROWS])
+        seg_bytes = writer.close()
+        size += seg_bytes
+        g = writer.groups
+        segments.append({"day": day.date().isoformat(), "file": str(path.relative_to(archive.table_dir())), "rows": writer.rows, "bytes": seg_bytes, "min": g[0]["min"], "max": g[-1]["max"]})
+    archive.write_catalog({"segments": segments, "archived_until": end.isoformat()})
+    write_seconds = time.perf_counter() - write_started
+
+    total = per_day * args.days
+    hours = int((datetime.utcnow() - start).total_seconds() // 3600) + 1
+    mid = start + timedelta(days=args.days // 2)
+    first_page = archive.search(MailFilter(hours=hours), end, 100)
+    searches = {
+        "all_latest_100": lambda: archive.search(MailFilter(hours=hours), end, 100),
+        "sender_domain_rare": lambda: archive.search(MailFilter(sender_domain=f"sender{args.domains // 2}.tld", match="exact", hours=hours), end, 100),
+        "sender_domain_hot": lambda: archive.search(MailFilter(sender_domain="sender0.tld", match="exact", hours=hours), end, 100),
+        "page_at_mid_window": lambda: archive.search(MailFilter(hours=hours), end, 1000, (mid + timedelta(hours=1), 0)),
+        "recipient_contains_miss": lambda: archive.search(MailFilter(recipient="nobody", hours=hours), end, 100),
+        "keyset_next_page": lambda: archive.search(MailFilter(hours=hours), end, 100, (first_page[-1].created_at, first_page[-1].id)),
+    }
+    print(json.dumps({
+        "rows": total,
+        "days": args.days,
+        "codec": args.codec,
+        "group_rows": archive.GROUP_ROWS,
+        "write_rows_per_s": round(total / write_seconds),
+        "csv_mb": round(raw / 2**20, 1),
+        "archive_mb": round(size / 2**20, 1),
+        "archive_mb_per_million_rows": round(size / 2**20 / total * 1e6, 1),
+        "ratio": round(raw / size, 1),
+        "searches": {name: timed(fn, args.repeat) for name, fn in searches.items()},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
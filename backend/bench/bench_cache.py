@@ -0,0 +1,91 @@
+"""DB round-trips per request with the settings/user cache disabled vs. enabled.
+
+    python bench/bench_cache.py --requests 200
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.security import HTTPAuthorizationCredentials  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app import cache, main  # noqa: E402
+from app.auth import create_token  # noqa: E402
+from app.db import AsyncSessionLocal, SessionLocal, async_engine, engine  # noqa: E402
+
+statements = 0
+
+
+def _count(*_):
+    global statements
+    statements += 1
+
+
+event.listen(engine, "before_cursor_execute", _count)
+event.listen(async_engine.sync_engine, "before_cursor_execute", _count)
+
+
+async def request(fn):
+    db = SessionLocal()
+    try:
+        async with AsyncSessionLocal() as adb:
+            await fn(db, adb)
+            await adb.rollback()
+    finally:
+        db.rollback()
+        db.close()
+
+
+def scenarios(creds):
+    async def dashboard(db, adb):
+        await main.dashboard(user=await main.current_user(creds, adb), db=adb)
+
+    async def cluster_settings(db, adb):
+        main.get_cluster_settings(user=await main.current_user(creds, adb), db=db)
+
+    async def settings_lookup(db, adb):
+        main.get_effective_cluster_settings(db)
+
+    return {
+        "GET /api/dashboard": dashboard,
+        "GET /api/cluster/settings": cluster_settings,
+        "settings lookup (reject smtp_event, render_postfix, sync tick)": settings_lookup,
+    }
+
+
+async def repeat(fn, n: int):
+    for _ in range(n):
+        await request(fn)
+
+
+def run(creds, n: int, ttl: float) -> dict:
+    global statements
+    for c in cache.CACHES.values():
+        c.ttl = ttl
+        c.invalidate()
+    out = {}
+    for name, fn in scenarios(creds).items():
+        statements = 0
+        started = time.perf_counter()
+        asyncio.run(repeat(fn, n))
+        out[name] = {"statements_per_request": round(statements / n, 2), "ms_per_request": round((time.perf_counter() - started) * 1000 / n, 3)}
+    return out
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--user", default="admin")
+    ap.add_argument("--role", default="Admin")
+    args = ap.parse_args()
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=create_token(args.user, args.role))
+    print(json.dumps({"requests": args.requests, "uncached": run(creds, args.requests, 0), "cached": run(creds, args.requests, 30)}, indent=2))
+
+
+if __name__ == "__main__":
+    main_()
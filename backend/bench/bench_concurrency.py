@@ -0,0 +1,87 @@
+"""Requests/sec of the hot endpoints at high client concurrency against a running backend.
+
+    python bench/bench_concurrency.py --base-url http://127.0.0.1:8080 --concurrency 500 --seconds 20 --label async
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime
+
+import httpx
+
+ENDPOINTS = {
+    "smtp_event": ("POST", "/api/smtp-event", lambda i: {"sender": f"bench{i}@allowed.tld", "recipient": f"rcpt{i}@target.tld", "client_ip": "10.9.0.1", "status": "ok", "target": "relayA"}),
+    "search_mail": ("GET", "/api/mail/search?sender=bench&limit=50", None),
+    "dashboard": ("GET", "/api/dashboard", None),
+    "export_config": ("GET", "/api/config/export", None),
+    "acquire_lock": ("POST", "/api/sync-lock/acquire", lambda i: {"node_id": "bench-node", "is_vip_owner": True}),
+}
+
+
+async def worker(client: httpx.AsyncClient, method: str, path: str, body, deadline: float, latencies: list, errors: list):
+    i = 0
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            r = await client.request(method, path, json=body(i) if body else None)
+            if r.status_code >= 400:
+                errors.append(r.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - started)
+        i += 1
+
+
+async def run_endpoint(args, headers: dict, name: str) -> dict:
+    method, path, body = ENDPOINTS[name]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, headers=headers, limits=limits, timeout=30, verify=False) as client:
+        latencies, errors = [], []
+        deadline = time.monotonic() + args.seconds
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client, method, path, body, deadline, latencies, errors) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    q = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0.0] * 99
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "errors": len(errors),
+        "error_kinds": sorted({str(e) for e in errors})[:5],
+        "latency_ms": {"p50": round(q[49] * 1000, 1), "p99": round(q[98] * 1000, 1)},
+    }
+
+
+async def main_async(args):
+    async with httpx.AsyncClient(base_url=args.base_url, verify=False) as c:
+        r = await c.post("/api/login", json={"username": args.user, "password": args.password})
+        r.raise_for_status()
+        token = r.json()["token"]
+    headers = {"authorization": f"Bearer {token}", "x-api-token": args.api_token}
+    results = {}
+    for name in args.endpoints.split(","):
+        results[name] = await run_endpoint(args, headers, name)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--base-url", default="http://127.0.0.1:8080")
+    ap.add_argument("--concurrency", type=int, default=500)
+    ap.add_argument("--seconds", type=float, default=20)
+    ap.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    ap.add_argument("--user", default="admin")
+    ap.add_argument("--password", default="Admin123")
+    ap.add_argument("--api-token", default="bootstrap-token")
+    ap.add_argument("--label", default="")
+    ap.add_argument("--out", default="bench-concurrency.jsonl")
+    args = ap.parse_args()
+    result = {"label": args.label, "at": datetime.utcnow().isoformat(), "concurrency": args.concurrency, "results": asyncio.run(main_async(args))}
+    with open(args.out, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
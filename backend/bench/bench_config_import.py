@@ -0,0 +1,107 @@
+"""Bulk config import against a running backend: import time, history size and export latency.
+
+    python bench/bench_config_import.py --base-url http://127.0.0.1:8080 --domains 100000 --routes 5000 --single 500
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import httpx  # noqa: E402
+import psycopg  # noqa: E402
+
+from bench.seed import dsn  # noqa: E402
+
+
+def domains_csv(names: list[str]) -> bytes:
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(["domain", "enabled"])
+    w.writerows([n, "true"] for n in names)
+    return out.getvalue().encode()
+
+
+def timed_post(client: httpx.Client, body: bytes, content_type: str) -> dict:
+    started = time.perf_counter()
+    r = client.post("/api/config/import", content=body, headers={"content-type": content_type}, timeout=600)
+    took = time.perf_counter() - started
+    report = r.json()
+    return {"status": r.status_code, "seconds": round(took, 2), **{k: report.get(k) for k in ("domains", "routes", "error_count", "version")}}
+
+
+def history(versions: list[int]) -> list[dict]:
+    versions = [v for v in versions if v]
+    if not versions:
+        return []
+    with psycopg.connect(dsn()) as conn:
+        rows = conn.execute("SELECT version, kind, length(data) FROM config_versions WHERE version = ANY(%s) ORDER BY version", (versions,)).fetchall()
+    return [{"version": v, "kind": k, "bytes": n} for v, k, n in rows]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--base-url", default="http://127.0.0.1:8080")
+    ap.add_argument("--domains", type=int, default=100_000)
+    ap.add_argument("--routes", type=int, default=5000)
+    ap.add_argument("--single", type=int, default=500, help="domains added one request each, for comparison")
+    ap.add_argument("--exports", type=int, default=20)
+    ap.add_argument("--user", default="admin")
+    ap.add_argument("--password", default="Admin123")
+    args = ap.parse_args()
+    run = int(time.time())
+    prefix = f"bench-import-{run}"
+
+    client = httpx.Client(base_url=args.base_url, verify=False, timeout=60)
+    token = client.post("/api/login", json={"username": args.user, "password": args.password}).json()["token"]
+    client.headers["authorization"] = f"Bearer {token}"
+
+    names = [f"d{i}.{prefix}.tld" for i in range(args.domains)]
+    routes = [{"sender_domain": f"r{i}.{prefix}.tld", "target_host": f"mx{i % 50}.{prefix}.tld", "target_port": 25} for i in range(args.routes)]
+    steps = {
+        "domains_csv": timed_post(client, domains_csv(names), "text/csv"),
+        "routes_json": timed_post(client, json.dumps({"routes": routes}).encode(), "application/json"),
+        "reimport_unchanged": timed_post(client, domains_csv(names), "text/csv"),
+    }
+    changed = [{**r, "target_port": 2525} if i % 100 == 0 else r for i, r in enumerate(routes)]
+    steps["routes_1pct_changed"] = timed_post(client, json.dumps({"routes": changed}).encode(), "application/json")
+    steps["invalid_rejected"] = timed_post(client, json.dumps({"domains": ["ok.tld", "not a domain"]}).encode(), "application/json")
+
+    single = []
+    for i in range(args.single):
+        started = time.perf_counter()
+        client.post("/api/domains", json={"domain": f"s{i}.{prefix}.tld"})
+        single.append(time.perf_counter() - started)
+
+    api_token = {"x-api-token": os.getenv("API_TOKEN", "bootstrap-token")}
+    export = []
+    for _ in range(args.exports):
+        started = time.perf_counter()
+        client.get("/api/config/export", headers=api_token, timeout=120).raise_for_status()
+        export.append(time.perf_counter() - started)
+
+    versions = [s["version"] for s in steps.values()]
+    latest = client.get("/api/config/history", params={"limit": 1}).json()
+    print(json.dumps({
+        "domains": args.domains,
+        "routes": args.routes,
+        "steps": steps,
+        "single_requests": {
+            "count": args.single,
+            "mean_ms": round(statistics.mean(single) * 1000, 1) if single else None,
+            "extrapolated_s_for_domains": round(statistics.mean(single) * args.domains, 1) if single else None,
+        },
+        "versions": history(versions),
+        "latest_version": latest[0] if latest else None,
+        "export_ms": {"p50": round(statistics.median(export) * 1000, 1), "max": round(max(export) * 1000, 1)} if export else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Compare the count()-based dashboard counters with the rollup-backed ones.
+
+    python bench/bench_dashboard.py --rows 10000000 --rejects 1000000
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import psycopg  # noqa: E402
+
+from app import rollups  # noqa: E402
+from app.db import SessionLocal  # noqa: E402
+from app.models import MailLog, RejectionLog  # noqa: E402
+from bench.seed import dsn, seed_mail_logs, seed_rejection_logs  # noqa: E402
+
+
+def legacy_counters(db):
+    n = datetime.utcnow()
+    return (
+        db.query(MailLog).filter(MailLog.created_at >= n - timedelta(hours=24)).count(),
+        db.query(MailLog).filter(MailLog.created_at >= n - timedelta(hours=1)).count(),
+        db.query(RejectionLog).filter(RejectionLog.created_at >= n - timedelta(hours=16)).count(),
+    )
+
+
+def rollup_counters(db):
+    n = datetime.utcnow()
+    return (
+        rollups.count_since(db, "mail", n - timedelta(hours=24)),
+        rollups.count_since(db, "mail", n - timedelta(hours=1)),
+        rollups.count_since(db, "reject", n - timedelta(hours=16)),
+    )
+
+
+def timed(fn, db, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn(db)
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"result": result, "median_ms": round(statistics.median(samples), 2), "max_ms": round(max(samples), 2)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=10_000_000)
+    ap.add_argument("--rejects", type=int, default=1_000_000)
+    ap.add_argument("--runs", type=int, default=20)
+    args = ap.parse_args()
+
+    with psycopg.connect(dsn()) as conn:
+        have = conn.execute("SELECT count(*) FROM mail_logs").fetchone()[0]
+        if have < args.rows:
+            seed_mail_logs(conn, args.rows - have)
+        have = conn.execute("SELECT count(*) FROM rejection_logs").fetchone()[0]
+        if have < args.rejects:
+            seed_rejection_logs(conn, args.rejects - have)
+        conn.execute("ANALYZE")
+        conn.commit()
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        rollups.backfill(db, datetime.utcnow() - timedelta(days=14))
+        backfill_s = time.perf_counter() - started
+        report = {
+            "mail_rows": args.rows,
+            "reject_rows": args.rejects,
+            "backfill_s": round(backfill_s, 1),
+            "legacy": timed(legacy_counters, db, args.runs),
+            "rollup": timed(rollup_counters, db, args.runs),
+        }
+    finally:
+        db.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Stream a large mail export in-process and check that peak memory stays flat.
+
+    python bench/bench_export.py --rows 5000000 --format csv --gzip --max-rss-growth-mb 64
+"""
+import argparse
+import json
+import resource
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import psycopg  # noqa: E402
+
+from app.export import export_stream  # noqa: E402
+from app.search import MailFilter  # noqa: E402
+from bench.seed import dsn, seed_mail_logs  # noqa: E402
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=5_000_000)
+    ap.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    ap.add_argument("--gzip", action="store_true")
+    ap.add_argument("--max-rss-growth-mb", type=float, default=64)
+    args = ap.parse_args()
+
+    with psycopg.connect(dsn()) as conn:
+        have = conn.execute("SELECT count(*) FROM mail_logs").fetchone()[0]
+        if have < args.rows:
+            seed_mail_logs(conn, args.rows - have, days=14)
+
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    chunks = size = 0
+    for chunk in export_stream(MailFilter(hours=24 * 30), args.format, args.gzip):
+        chunks += 1
+        size += len(chunk)
+    elapsed = time.perf_counter() - started
+    growth = peak_rss_mb() - baseline
+    print(
+        json.dumps(
+            {
+                "table_rows": max(have, args.rows),
+                "format": args.format + (".gz" if args.gzip else ""),
+                "seconds": round(elapsed, 2),
+                "mb_per_sec": round(size / elapsed / 2**20, 1),
+                "bytes": size,
+                "chunks": chunks,
+                "peak_rss_mb_baseline": round(baseline, 1),
+                "peak_rss_growth_mb": round(growth, 1),
+            },
+            indent=2,
+        )
+    )
+    if growth > args.max_rss_growth_mb:
+        print(f"FAIL: peak RSS grew by {growth:.1f} MB (limit {args.max_rss_growth_mb} MB)", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
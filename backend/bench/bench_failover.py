@@ -0,0 +1,89 @@
+"""Kills the background-job leader among N API workers and measures how fast another worker takes over.
+
+    python bench/bench_failover.py --workers 4 --interval 2 --rounds 3
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+
+def wait_for(fn, timeout: float, step: float = 0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            value = fn()
+            if value:
+                return value
+        except httpx.HTTPError:
+            pass
+        time.sleep(step)
+    return None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--port", type=int, default=18080)
+    ap.add_argument("--interval", type=float, default=2.0)
+    ap.add_argument("--rounds", type=int, default=3)
+    ap.add_argument("--max-seconds", type=float)
+    ap.add_argument("--user", default="admin")
+    ap.add_argument("--password", default="Admin123")
+    args = ap.parse_args()
+    bound = args.max_seconds or 2 * args.interval + 3
+
+    env = {**os.environ, "API_WORKERS": str(args.workers), "LEADER_INTERVAL_SECONDS": str(args.interval), "POLICY_LISTEN": "", "POSTFIX_LOG_PATH": ""}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(args.workers)],
+        cwd=Path(__file__).resolve().parents[1],
+        env=env,
+    )
+    client = httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=5)
+    rounds = []
+    try:
+        token = wait_for(lambda: client.post("/api/login", json={"username": args.user, "password": args.password}).json()["token"], 60, 0.5)
+        if not token:
+            sys.exit("backend did not come up")
+        client.headers["authorization"] = f"Bearer {token}"
+
+        def leader():
+            r = client.get("/api/cluster/leader").json()
+            return r if r["leader"] else None
+
+        for _ in range(args.rounds):
+            current = wait_for(leader, 30)
+            if not current:
+                sys.exit("no leader elected")
+            pid = int(current["leader"].rsplit(":", 1)[1])
+            killed_at = datetime.utcnow()
+            started = time.monotonic()
+            os.kill(pid, signal.SIGKILL)
+
+            def taken_over():
+                r = leader()
+                return r if r and r["leader"] != current["leader"] and datetime.fromisoformat(r["heartbeat"]) > killed_at else None
+
+            new = wait_for(taken_over, bound * 3)
+            took = time.monotonic() - started
+            rounds.append({"killed": current["leader"], "new_leader": new and new["leader"], "takeover_s": round(took, 2) if new else None})
+            # let uvicorn's supervisor replace the killed worker before the next round
+            time.sleep(args.interval)
+    finally:
+        server.send_signal(signal.SIGINT)
+        server.wait(timeout=30)
+
+    worst = max((r["takeover_s"] or float("inf")) for r in rounds)
+    print(json.dumps({"workers": args.workers, "interval_s": args.interval, "bound_s": bound, "worst_takeover_s": worst, "rounds": rounds}, indent=2))
+    sys.exit(0 if worst <= bound else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Relay health checker against local fake SMTP listeners (no database needed).
+
+    python bench/bench_health.py --targets 2000 --duration 20 --concurrency 200
+"""
+import argparse
+import asyncio
+import json
+import logging
+import shutil
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.health import HealthChecker  # noqa: E402
+
+KINDS = ("ok", "tls", "slow", "reject", "drop", "closed")
+EXPECT_UP = {"ok": True, "tls": True, "slow": False, "reject": False, "drop": False, "closed": False}
+
+
+def self_signed(tmp: Path) -> ssl.SSLContext | None:
+    if not shutil.which("openssl"):
+        return None
+    cert, key = tmp / "cert.pem", tmp / "key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=bench", "-keyout", str(key), "-out", str(cert)],
+        check=True,
+        capture_output=True,
+    )
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ctx.load_cert_chain(cert, key)
+    return ctx
+
+
+def smtp_handler(kind: str, tls: ssl.SSLContext | None, slow: float):
+    async def handle(reader, writer):
+        try:
+            if kind == "drop":
+                return
+            if kind == "slow":
+                await asyncio.sleep(slow)
+            if kind == "reject":
+                writer.write(b"554 5.3.2 bench not accepting mail\r\n")
+                return
+            writer.write(b"220 bench.local ESMTP fake\r\n")
+            while line := await reader.readline():
+                cmd = line.strip().upper()
+                if cmd.startswith(b"EHLO"):
+                    ext = b"250-STARTTLS\r\n" if kind == "tls" else b""
+                    writer.write(b"250-bench.local\r\n250-PIPELINING\r\n" + ext + b"250 8BITMIME\r\n")
+                elif cmd == b"STARTTLS":
+                    if tls is None:
+                        writer.write(b"454 4.7.0 TLS not available\r\n")
+                        continue
+                    writer.write(b"220 2.0.0 Ready to start TLS\r\n")
+                    await writer.drain()
+                    await writer.start_tls(tls)
+                elif cmd == b"QUIT":
+                    writer.write(b"221 2.0.0 Bye\r\n")
+                    return
+                else:
+                    writer.write(b"502 5.5.2 Error\r\n")
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(ports: dict, tls, slow: float, ready: threading.Event):
+    async def main():
+        servers = [await asyncio.start_server(smtp_handler(k, tls, slow), "0.0.0.0", ports[k], backlog=4096, reuse_address=True) for k in KINDS if k != "closed"]
+        ready.set()
+        await asyncio.gather(*(s.serve_forever() for s in servers))
+
+    asyncio.run(main())
+
+
+async def loop_lag(duration: float) -> list[float]:
+    lags, end = [], time.monotonic() + duration
+    while time.monotonic() < end:
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append((time.perf_counter() - started - 0.01) * 1000)
+    return lags
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--targets", type=int, default=2000)
+    ap.add_argument("--duration", type=float, default=20)
+    ap.add_argument("--interval", type=float, default=5)
+    ap.add_argument("--timeout", type=float, default=1)
+    ap.add_argument("--concurrency", type=int, default=200)
+    args = ap.parse_args()
+
+    # the fake server sees the checker hang up right after QUIT on TLS connections, which asyncio warns about
+    logging.getLogger("asyncio").setLevel(logging.ERROR)
+    tmp = Path(tempfile.mkdtemp(prefix="health-bench-"))
+    try:
+        tls = self_signed(tmp)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    ports = {k: free_port() for k in KINDS}
+    ready = threading.Event()
+    threading.Thread(target=serve, args=(ports, tls, args.timeout * 3, ready), daemon=True).start()
+    ready.wait()
+
+    # mostly healthy targets, like a real route table
+    weights = {"ok": 60, "tls": 20, "slow": 5, "reject": 5, "drop": 5, "closed": 5}
+    kinds = [k for k, w in weights.items() for _ in range(w)]
+    expected, targets = {}, []
+    for i in range(args.targets):
+        kind = kinds[i % len(kinds)]
+        host = f"127.{1 + i // 65025}.{(i // 255) % 255}.{1 + i % 255}"
+        targets.append((host, ports[kind]))
+        expected[f"{host}:{ports[kind]}"] = kind
+
+    recorded: list[dict] = []
+    first_round = {}
+    checker = HealthChecker(
+        lambda: targets,
+        lambda results, _: recorded.extend(results),
+        interval=args.interval,
+        timeout=args.timeout,
+        concurrency=args.concurrency,
+        max_backoff=args.interval * 8,
+        flush_interval=0.5,
+    )
+    started = time.monotonic()
+    checker.start()
+
+    def watch_first_round():
+        while len({r["target"] for r in recorded}) < len(targets) and time.monotonic() - started < args.duration:
+            time.sleep(0.05)
+        first_round["seconds"] = round(time.monotonic() - started, 2)
+
+    threading.Thread(target=watch_first_round, daemon=True).start()
+    lags = asyncio.run(loop_lag(args.duration))
+    time.sleep(1)
+
+    last, probes = {}, Counter()
+    for r in recorded:
+        last[r["target"]] = r
+        probes[r["target"]] += 1
+    wrong = [t for t, r in last.items() if r["up"] != EXPECT_UP[expected[t]]]
+    tls_ok = sum(1 for t, r in last.items() if expected[t] == "tls" and r["tls"])
+    per_kind = {k: statistics.mean([probes[t] for t, kind in expected.items() if kind == k] or [0]) for k in KINDS}
+    up_latency = sorted(r["latency_ms"] for r in last.values() if r["up"])
+    print(json.dumps({
+        "targets": args.targets,
+        "concurrency": args.concurrency,
+        "interval_s": args.interval,
+        "timeout_s": args.timeout,
+        "tls_listener": tls is not None,
+        "first_round_s": first_round.get("seconds"),
+        "probes": len(recorded),
+        "probes_per_s": round(len(recorded) / args.duration, 1),
+        "targets_seen": len(last),
+        "wrong_state": len(wrong),
+        "wrong_examples": [(t, expected[t], last[t]["error"]) for t in wrong[:5]],
+        "starttls_completed": tls_ok,
+        "probes_per_target": {k: round(v, 2) for k, v in per_kind.items()},
+        "latency_up_ms": {"p50": up_latency[len(up_latency) // 2], "p99": up_latency[int(len(up_latency) * 0.99)]} if up_latency else None,
+        "main_loop_lag_ms": {"p50": round(statistics.median(lags), 2), "p99": round(sorted(lags)[int(len(lags) * 0.99)], 2), "max": round(max(lags), 2)},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Live-tail fan-out: delivery latency, drops and memory with hundreds of concurrent viewers.
+
+    python bench/bench_livetail.py --subscribers 500 --rate 300 --seconds 20 --slow 0.05
+    python bench/bench_livetail.py --base-url http://127.0.0.1:8080 --subscribers 300 --rate 500 --server-pid 1234
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import httpx  # noqa: E402
+
+from app import livetail  # noqa: E402
+
+
+def rss_mb(pid: int | None = None) -> float:
+    for line in Path(f"/proc/{pid or os.getpid()}/status").read_text().splitlines():
+        if line.startswith("VmRSS:"):
+            return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+
+def event(i: int) -> dict:
+    return {
+        "sender": f"user{i % 500}@sender{i % 40}.tld",
+        "recipient": f"rcpt{i}@dest{i % 300}.tld",
+        "client_ip": f"10.0.{i % 250}.{i % 200}",
+        "status": "sent",
+        "target": f"relay{i % 8}:25",
+        "tls_used": True,
+        "smtp_code": "250",
+        "smtp_text": "2.0.0 Ok: queued",
+        "queue_id": f"{time.time():.6f}",
+        "created_at": datetime.utcnow(),
+    }
+
+
+class Viewer:
+    def __init__(self, slow: bool):
+        self.slow = slow
+        self.latencies: list[float] = []
+        self.received = 0
+        self.dropped = 0
+        self.buf = ""
+
+    def frame(self, kind: str, data: str):
+        now = time.time()
+        if kind == "mail":
+            # slicing instead of json.loads keeps the viewers' own parsing out of the measurement
+            start = data.index('"queue_id":"') + 12
+            self.received += 1
+            self.latencies.append(now - float(data[start : data.index('"', start)]))
+        elif kind == "dropped":
+            self.dropped += json.loads(data)["count"]
+
+    def chunk(self, text: str):
+        # HTTP chunks may end mid-frame
+        frames = (self.buf + text).split("\n\n")
+        self.buf = frames.pop()
+        for frame in frames:
+            kind = data = ""
+            for line in frame.split("\n"):
+                if line.startswith("event: "):
+                    kind = line[7:]
+                elif line.startswith("data: "):
+                    data = line[6:]
+            if data:
+                self.frame(kind, data)
+
+
+def publisher(emit, rate: int, seconds: float, batch: int) -> int:
+    sent, started = 0, time.monotonic()
+    while time.monotonic() - started < seconds:
+        emit([event(sent + i) for i in range(batch)])
+        sent += batch
+        time.sleep(max(0.0, started + sent / rate - time.monotonic()))
+    return sent
+
+
+async def in_process(args, viewers: list[Viewer]) -> int:
+    hub = livetail.LiveHub(max_subscribers=args.subscribers, buffer_events=args.buffer)
+
+    async def consume(v: Viewer, i: int):
+        sub = hub.subscribe(livetail.TailFilter(sender="sender1" if i % 4 == 0 else None))
+        async for chunk in livetail.stream(hub, sub, keepalive=1):
+            v.chunk(chunk)
+            if v.slow:
+                await asyncio.sleep(0.5)
+
+    tasks = [asyncio.create_task(consume(v, i)) for i, v in enumerate(viewers)]
+    await asyncio.sleep(0.5)
+
+    def emit(rows: list[dict]):
+        for payload in livetail.payloads(rows, []):
+            hub.dispatch(payload)
+
+    sent = await asyncio.to_thread(publisher, emit, args.rate, args.seconds, args.batch)
+    await asyncio.sleep(1.5)
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return sent
+
+
+async def over_http(args, viewers: list[Viewer]) -> int:
+    token = httpx.post(f"{args.base_url}/api/login", json={"username": args.user, "password": args.password}, verify=False).json()["token"]
+    headers = {"authorization": f"Bearer {token}"}
+    limits = httpx.Limits(max_connections=args.subscribers + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, headers=headers, limits=limits, timeout=None, verify=False) as client:
+
+        async def consume(v: Viewer, i: int):
+            params = {"sender": "sender1"} if i % 4 == 0 else {}
+            async with client.stream("GET", "/api/mail/live", params=params) as r:
+                async for chunk in r.aiter_text():
+                    v.chunk(chunk)
+                    if v.slow:
+                        await asyncio.sleep(0.5)
+
+        tasks = [asyncio.create_task(consume(v, i)) for i, v in enumerate(viewers)]
+        await asyncio.sleep(2)
+        poster = httpx.Client(base_url=args.base_url, verify=False, timeout=30)
+
+        def emit(rows: list[dict]):
+            poster.post("/api/smtp-events", content="\n".join(json.dumps({**r, "created_at": r["created_at"].isoformat()}) for r in rows), headers={"content-type": "application/x-ndjson"})
+
+        sent = await asyncio.to_thread(publisher, emit, args.rate, args.seconds, args.batch)
+        await asyncio.sleep(3)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return sent
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--subscribers", type=int, default=500)
+    ap.add_argument("--rate", type=int, default=300, help="events/s")
+    ap.add_argument("--batch", type=int, default=50, help="events per publish (one ingest write)")
+    ap.add_argument("--seconds", type=float, default=20)
+    ap.add_argument("--slow", type=float, default=0.05, help="fraction of viewers that read slowly")
+    ap.add_argument("--buffer", type=int, default=1000, help="per-viewer buffer (in-process mode)")
+    ap.add_argument("--base-url")
+    ap.add_argument("--server-pid", type=int, help="backend worker pid for RSS (with --base-url)")
+    ap.add_argument("--user", default="admin")
+    ap.add_argument("--password", default="Admin123")
+    args = ap.parse_args()
+
+    pid = args.server_pid if args.base_url else None
+    rss_before = rss_mb(pid) if pid or not args.base_url else None
+    slow_every = int(1 / args.slow) if args.slow else 0
+    viewers = [Viewer(bool(slow_every) and i % slow_every == 0) for i in range(args.subscribers)]
+    sent = asyncio.run((over_http if args.base_url else in_process)(args, viewers))
+    rss_after = rss_mb(pid) if pid or not args.base_url else None
+
+    def summary(group: list[Viewer]) -> dict:
+        lat = sorted(x for v in group for x in v.latencies)
+        if not lat:
+            return {"viewers": len(group), "received": 0}
+        return {
+            "viewers": len(group),
+            "received": sum(v.received for v in group),
+            "dropped": sum(v.dropped for v in group),
+            "latency_ms": {"p50": round(statistics.median(lat) * 1000, 2), "p99": round(lat[int(len(lat) * 0.99) - 1] * 1000, 2), "max": round(lat[-1] * 1000, 2)},
+        }
+
+    print(json.dumps({
+        "mode": "http" if args.base_url else "in_process",
+        "subscribers": args.subscribers,
+        "events_sent": sent,
+        "rate": args.rate,
+        "rss_mb": {"before": rss_before, "after": rss_after},
+        "normal": summary([v for v in viewers if not v.slow]),
+        "slow": summary([v for v in viewers if v.slow]),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
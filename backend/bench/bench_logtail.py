@@ -0,0 +1,97 @@
+"""Replay a synthetic Postfix log through the tailer and report lines/sec and peak RSS.
+
+    python bench/bench_logtail.py --lines 3000000
+"""
+import argparse
+import json
+import random
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.logtail import LogTailer, PostfixLogParser  # noqa: E402
+
+
+def synth_log(path: Path, lines: int, seed: int = 7) -> int:
+    rnd = random.Random(seed)
+    written, n = 0, 0
+    with open(path, "w") as f:
+        while written < lines:
+            n += 1
+            qid = f"{n:010X}"
+            ts = f"Oct 18 {n // 3600 % 24:02d}:{n // 60 % 60:02d}:{n % 60:02d}"
+            ip = f"10.{n % 250}.{n // 250 % 250}.{n % 200}"
+            spid, cpid = 1000 + n % 64, 2000 + n % 32
+            if n % 25 == 0:
+                f.write(
+                    f"{ts} relay postfix/smtpd[{spid}]: NOQUEUE: reject: RCPT from unknown[{ip}]: 554 5.7.1 <spam{n}@bad.tld>: "
+                    f"Sender address rejected: Access denied; from=<spam{n}@bad.tld> to=<ops@target.tld> proto=ESMTP helo=<bad{n}>\n"
+                )
+                written += 1
+                continue
+            tls = rnd.random() < 0.7
+            status = rnd.choice(["sent"] * 8 + ["deferred", "bounced"])
+            text = {"sent": "250 2.0.0 Ok: queued as ABC", "deferred": "connect to relay: Connection timed out", "bounced": "host relay said: 550 5.1.1 unknown user"}[status]
+            out = [
+                f"{ts} relay postfix/smtpd[{spid}]: connect from unknown[{ip}]",
+                *([f"{ts} relay postfix/smtpd[{spid}]: Anonymous TLS connection established from unknown[{ip}]: TLSv1.3"] if tls else []),
+                f"{ts} relay postfix/smtpd[{spid}]: {qid}: client=unknown[{ip}]",
+                f"{ts} relay postfix/cleanup[{3000 + n % 8}]: {qid}: message-id=<{n}@example.tld>",
+                f"{ts} relay postfix/qmgr[99]: {qid}: from=<user{n % 997}@allowed.tld>, size={rnd.randint(800, 90000)}, nrcpt=1 (queue active)",
+                f"{ts} relay postfix/smtpd[{spid}]: disconnect from unknown[{ip}] ehlo=1 mail=1 rcpt=1 data=1 quit=1 commands=5",
+                f"{ts} relay postfix/smtp[{cpid}]: {qid}: to=<rcpt{n % 5003}@target.tld>, relay=relay{n % 3}.tld[10.1.0.{n % 3}]:25, "
+                f"delay=0.4, delays=0.1/0/0.1/0.2, dsn=2.0.0, status={status} ({text})",
+            ]
+            if status != "deferred":
+                out.append(f"{ts} relay postfix/qmgr[99]: {qid}: removed")
+            f.write("\n".join(out) + "\n")
+            written += len(out)
+    return written
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=3_000_000)
+    ap.add_argument("--max-inflight", type=int, default=100_000)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log = Path(tmp) / "postfix.log"
+        written = synth_log(log, args.lines)
+        counts = {"events": 0, "batches": 0}
+
+        def sink(events):
+            counts["events"] += len(events)
+            counts["batches"] += 1
+
+        parser = PostfixLogParser(max_inflight=args.max_inflight)
+        tailer = LogTailer(log, Path(tmp) / "offset", sink, parser=parser)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        while tailer.poll():
+            pass
+        elapsed = time.perf_counter() - started
+        print(
+            json.dumps(
+                {
+                    "lines": written,
+                    "seconds": round(elapsed, 2),
+                    "lines_per_sec": round(written / elapsed),
+                    "events": counts["events"],
+                    "batches": counts["batches"],
+                    "inflight_after": len(parser.inflight),
+                    "evicted": parser.evicted,
+                    "peak_rss_mb_before": round(rss_before / 1024, 1),
+                    "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                },
+                indent=2,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Overhead of the Prometheus instrumentation on the ingest path (no database needed).
+
+    python bench/bench_metrics.py --requests 20000 --rounds 5 [--multiproc]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def build_app(instrumented: bool):
+    from fastapi import FastAPI
+
+    from app import metrics, rollups
+    from app.ingest import mail_row
+
+    app = FastAPI()
+    if instrumented:
+        app.add_middleware(metrics.RequestMetrics)
+
+    @app.post("/api/smtp-event")
+    async def smtp_event(event: dict):
+        row = mail_row(event)
+        rollups.collect([row], [])
+        if instrumented:
+            metrics.INGEST_EVENTS.labels("smtp_event").inc()
+            metrics.INGEST_ROWS.labels("mail").inc()
+            metrics.INGEST_BATCH_ROWS.observe(1)
+        return {"status": "ok"}
+
+    return app
+
+
+async def drive(app, n: int) -> float:
+    import httpx
+
+    event = {"sender": "bench@allowed.tld", "recipient": "rcpt@target.tld", "client_ip": "10.9.0.1", "status": "sent", "target": "relayA"}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as c:
+        started = time.perf_counter()
+        for _ in range(n):
+            await c.post("/api/smtp-event", json=event)
+        return (time.perf_counter() - started) / n
+
+
+def batch_overhead(batch: int, loops: int) -> dict:
+    from app import metrics, rollups
+    from app.ingest import mail_row
+
+    events = [{"sender": f"s{i}@d.tld", "recipient": "r@t.tld", "status": "sent", "target": "relayA"} for i in range(batch)]
+    started = time.perf_counter()
+    for _ in range(loops):
+        rollups.collect([mail_row(e) for e in events], [])
+    work = (time.perf_counter() - started) / loops
+    started = time.perf_counter()
+    for _ in range(loops):
+        metrics.INGEST_WRITE_SECONDS.observe(0.01)
+        metrics.INGEST_BATCH_ROWS.observe(batch)
+        metrics.INGEST_ROWS.labels("mail").inc(batch)
+        metrics.INGEST_ROWS.labels("reject").inc(0)
+    cost = (time.perf_counter() - started) / loops
+    return {"batch_rows": batch, "batch_cpu_us": round(work * 1e6, 1), "instrumentation_us": round(cost * 1e6, 2), "overhead_pct": round(cost / work * 100, 3)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=20_000)
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--batch", type=int, default=500)
+    ap.add_argument("--multiproc", action="store_true")
+    args = ap.parse_args()
+    if args.multiproc:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prom-bench-")
+
+    plain, instrumented = build_app(False), build_app(True)
+    asyncio.run(drive(plain, 500))
+    asyncio.run(drive(instrumented, 500))
+    base, inst = [], []
+    for _ in range(args.rounds):
+        base.append(asyncio.run(drive(plain, args.requests)))
+        inst.append(asyncio.run(drive(instrumented, args.requests)))
+    b, i = statistics.median(base), statistics.median(inst)
+    print(json.dumps({
+        "multiproc": args.multiproc,
+        "smtp_event": {"plain_us": round(b * 1e6, 1), "instrumented_us": round(i * 1e6, 1), "overhead_us": round((i - b) * 1e6, 1), "overhead_pct": round((i - b) / b * 100, 2)},
+        "ingest_batch": batch_overhead(args.batch, 200),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Queue index scan and query cost against a synthetic Postfix spool.
+
+    python bench/bench_queue.py --messages 100000 --churn 0.01
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.mailqueue import QueueFilter, QueueIndex  # noqa: E402
+
+REASONS = [
+    "connect to mx.{d}[192.0.2.10]:25: Connection timed out",
+    "host mx.{d}[192.0.2.11] said: 451 4.7.1 Greylisted, please try again later (in reply to RCPT TO command)",
+    "host mx.{d}[192.0.2.12] said: 452 4.2.2 Mailbox full (in reply to RCPT TO command)",
+    "lost connection with mx.{d}[192.0.2.13] while receiving the initial server greeting",
+]
+
+
+def record(t: bytes, data: bytes) -> bytes:
+    out, n = bytearray(t), len(data)
+    while True:
+        c, n = n & 0x7F, n >> 7
+        out.append(c | 0x80 if n else c)
+        if not n:
+            return bytes(out) + data
+
+
+def queue_file(sender: str, rcpts: list[str], arrival: int) -> bytes:
+    content = b"".join(record(b"N", line) for line in (b"Subject: bench", b"From: " + sender.encode(), b"", b"x" * 200))
+    head = record(b"T", f"{arrival} 0".encode()) + record(b"A", b"rewrite_context=remote") + record(b"S", sender.encode())
+    head += b"".join(record(b"R", r.encode()) for r in rcpts) + record(b"M", b"")
+    size = f"{len(content):15d} {0:15d} {len(rcpts):15d} {0:15d} {0:15d}".encode()
+    offset = len(record(b"C", size)) + len(head)
+    size = f"{len(content):15d} {offset:15d} {len(rcpts):15d} {0:15d} {0:15d}".encode()
+    return record(b"C", size) + head + content + record(b"X", b"") + record(b"E", b"")
+
+
+def add_message(spool: Path, i: int, rnd: random.Random, now: int) -> str:
+    qid = f"{i:011X}"
+    queue = "deferred" if rnd.random() < 0.9 else rnd.choice(["active", "hold"])
+    domain = f"dest{rnd.randrange(500)}.tld"
+    rcpts = [f"user{rnd.randrange(10_000)}@{domain}" for _ in range(rnd.choice([1, 1, 1, 2, 5]))]
+    sub = spool / queue / (qid[-1] if queue != "active" else "")
+    sub.mkdir(parents=True, exist_ok=True)
+    (sub / qid).write_bytes(queue_file(f"sender{rnd.randrange(2000)}@src{rnd.randrange(100)}.tld", rcpts, now - rnd.randrange(86400 * 5)))
+    if queue == "deferred":
+        d = spool / "defer" / qid[-1]
+        d.mkdir(parents=True, exist_ok=True)
+        reason = rnd.choice(REASONS).format(d=domain)
+        (d / qid).write_text("".join(f"recipient={r}\noffset=0\nstatus=4.4.1\naction=delayed\nreason={reason}\n\n" for r in rcpts))
+    return qid
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, round((time.perf_counter() - started) * 1000, 1)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=100_000)
+    ap.add_argument("--churn", type=float, default=0.01)
+    ap.add_argument("--spool", help="reuse/keep this directory instead of a temporary one")
+    args = ap.parse_args()
+    spool = Path(args.spool or tempfile.mkdtemp(prefix="spool-bench-"))
+    rnd, now = random.Random(7), int(time.time())
+    result = {"messages": args.messages}
+    try:
+        ids, result["build_ms"] = timed(lambda: [add_message(spool, i, rnd, now) for i in range(args.messages)])
+        index = QueueIndex(spool)
+        _, result["cold_scan_ms"] = timed(index.refresh, True)
+        assert len(index.entries) == args.messages, len(index.entries)
+        _, result["unchanged_rescan_ms"] = timed(index.refresh, True)
+        parsed = index.stats["parsed"]
+
+        n = max(1, int(args.messages * args.churn / 3))
+        for qid in rnd.sample(ids, n):
+            e = index.get(qid)
+            os.unlink(e["path"])
+        for path in [index.get(q)["path"] for q in rnd.sample(list(index.entries), n) if index.get(q)["queue"] == "deferred"]:
+            if os.path.exists(path):
+                # a retry: qmgr moves the file to active, and back to deferred with the next retry time as mtime
+                active = spool / "active" / Path(path).name
+                os.rename(path, active)
+                os.utime(active, (now + 600, now + 600))
+                os.rename(active, path)
+        for i in range(args.messages, args.messages + n):
+            add_message(spool, i, rnd, now)
+        _, result["churn_rescan_ms"] = timed(index.refresh, True)
+        result["churn_files_reparsed"] = index.stats["parsed"] - parsed
+
+        domain = index.get(next(iter(index.entries)))["domains"][0]
+        queries = {
+            "list_oldest_page": QueueFilter(),
+            "by_recipient_domain": QueueFilter(recipient_domain=domain),
+            "deferred_greylisted": QueueFilter(queue="deferred", reason="greylisted"),
+            "older_than_1d": QueueFilter(min_age=86400),
+        }
+        result["queries_ms"] = {}
+        for name, f in queries.items():
+            selected, ms = timed(index.select, f)
+            result["queries_ms"][name] = {"ms": ms, "matches": len(selected)}
+        all_ids = index.select(QueueFilter())
+        _, result["queries_ms"]["summary_by_domain"] = timed(index.aggregate, all_ids, "recipient_domain", 50)
+        _, result["queries_ms"]["summary_by_reason"] = timed(index.aggregate, all_ids, "reason", 50)
+    finally:
+        if not args.spool:
+            shutil.rmtree(spool, ignore_errors=True)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
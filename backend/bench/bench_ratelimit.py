@@ -0,0 +1,124 @@
+"""Rate limiter decision throughput under concurrent load, optionally with two nodes sharing PostgreSQL.
+
+    python bench/bench_ratelimit.py --threads 16 --decisions 200000 --senders 50000
+    python bench/bench_ratelimit.py --shared --seconds 10      # two limiters syncing through rate_counters
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.db import SessionLocal, engine  # noqa: E402
+from app.models import RateCounter  # noqa: E402
+from app.ratelimit import RateLimiter, rate_keys  # noqa: E402
+
+RULES = [
+    {"scope": "sender_domain", "match": "*", "max_messages": 1000, "window_seconds": 60},
+    {"scope": "sender", "match": "*", "max_messages": 200, "window_seconds": 60},
+    {"scope": "client_ip", "match": "*", "max_messages": 5000, "window_seconds": 60},
+]
+
+
+def workload(seed: int, senders: int):
+    rnd = random.Random(seed)
+    while True:
+        # 10% of the traffic comes from ten flooding hosts, the rest is spread evenly
+        i = rnd.randrange(10) if rnd.random() < 0.1 else rnd.randrange(senders)
+        yield f"user{i}@domain{i % max(1, senders // 20)}.tld", f"10.{i % 4}.{i % 250}.{i % 200}"
+
+
+def throughput(threads: int, decisions: int, senders: int) -> dict:
+    limiter = RateLimiter()
+    limiter.set_rules(RULES)
+    per_thread = decisions // threads
+    limited = Counter()
+
+    def run(seed):
+        gen = workload(seed, senders)
+        n = 0
+        for _ in range(per_thread):
+            sender, ip = next(gen)
+            n += limiter.hit(rate_keys(sender, ip)) is not None
+        limited[seed] = n
+
+    workers = [threading.Thread(target=run, args=(s,)) for s in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "threads": threads,
+        "decisions": per_thread * threads,
+        "decisions_per_second": round(per_thread * threads / elapsed),
+        "limited": sum(limited.values()),
+        "counters": len(limiter._counters),
+    }
+
+
+def shared(seconds: float, limit: int, sync_interval: float) -> dict:
+    RateCounter.__table__.create(engine, checkfirst=True)
+    with SessionLocal() as db:
+        db.query(RateCounter).filter(RateCounter.key.like("bench-%")).delete(synchronize_session=False)
+        db.commit()
+    rules = [{"scope": "sender_domain", "match": "*", "max_messages": limit, "window_seconds": 3600}]
+    nodes = [RateLimiter(), RateLimiter()]
+    allowed = Counter()
+    stop = time.monotonic() + seconds
+    for n in nodes:
+        n.set_rules(rules)
+
+    def sync_loop(node):
+        while time.monotonic() < stop:
+            time.sleep(sync_interval)
+            with SessionLocal() as db:
+                node.sync(db)
+
+    def traffic(node, seed):
+        rnd = random.Random(seed)
+        while time.monotonic() < stop:
+            d = f"bench-{rnd.randrange(50)}.tld"
+            if node.hit(rate_keys(f"u@{d}", "10.0.0.1")) is None:
+                allowed[d] += 1
+
+    threads = [threading.Thread(target=sync_loop, args=(n,)) for n in nodes]
+    threads += [threading.Thread(target=traffic, args=(n, i)) for i, n in enumerate(nodes * 2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {
+        "nodes": len(nodes),
+        "limit_per_domain": limit,
+        "sync_interval_s": sync_interval,
+        "allowed_per_domain_max": max(allowed.values()),
+        "allowed_per_domain_min": min(allowed.values()),
+        "overshoot_max": max(allowed.values()) - limit,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--decisions", type=int, default=200_000)
+    ap.add_argument("--senders", type=int, default=50_000)
+    ap.add_argument("--shared", action="store_true")
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--limit", type=int, default=500)
+    ap.add_argument("--sync-interval", type=float, default=1.0)
+    args = ap.parse_args()
+    result = {"in_memory": throughput(args.threads, args.decisions, args.senders)}
+    if args.shared:
+        result["shared"] = shared(args.seconds, args.limit, args.sync_interval)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Retention runtime and WAL volume: row DELETE on a plain table vs. dropping daily partitions.
+
+    python bench/bench_retention.py --rows 10000000 --days 15 --expire-days 1
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import psycopg  # noqa: E402
+
+from bench.seed import dsn  # noqa: E402
+
+COLUMNS = """id SERIAL, sender VARCHAR(255), recipient VARCHAR(255), client_ip VARCHAR(64), target VARCHAR(255),
+  status VARCHAR(32) NOT NULL DEFAULT 'unknown', smtp_text TEXT, tls_used BOOLEAN NOT NULL DEFAULT FALSE,
+  created_at TIMESTAMP NOT NULL"""
+FILL = """INSERT INTO {table} (sender, recipient, client_ip, target, status, smtp_text, tls_used, created_at)
+SELECT 'user' || (g % 20000) || '@sender' || (g % 2000) || '.tld', 'rcpt' || (g % 200000) || '@dest.tld', '10.0.' || (g % 250) || '.' || (g % 200),
+       'relay' || (g % 8), 'ok', 'queued for delivery', g % 3 <> 0,
+       date_trunc('day', now()::timestamp) - interval '{days} days' + (g::float8 / {rows} * {days} * interval '1 day')
+FROM generate_series(1, {rows}) g"""
+
+
+def wal_lsn(conn) -> str:
+    return conn.execute("SELECT pg_current_wal_lsn()").fetchone()[0]
+
+
+def measure(conn, statements: list[str]) -> dict:
+    conn.execute("CHECKPOINT")
+    before = wal_lsn(conn)
+    started = time.perf_counter()
+    for stmt in statements:
+        conn.execute(stmt)
+    elapsed = time.perf_counter() - started
+    wal = conn.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s)", (before,)).fetchone()[0]
+    return {"seconds": round(elapsed, 3), "wal_mb": round(float(wal) / 2**20, 2)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=10_000_000)
+    ap.add_argument("--days", type=int, default=15)
+    ap.add_argument("--expire-days", type=int, default=1)
+    args = ap.parse_args()
+    cutoff = f"date_trunc('day', now()::timestamp) - interval '{args.days - args.expire_days} days'"
+
+    with psycopg.connect(dsn(), autocommit=True) as conn:
+        conn.execute("DROP SCHEMA IF EXISTS bench_retention CASCADE")
+        conn.execute("CREATE SCHEMA bench_retention")
+        conn.execute(f"CREATE TABLE bench_retention.plain ({COLUMNS}, PRIMARY KEY (id))")
+        conn.execute("CREATE INDEX ON bench_retention.plain (created_at)")
+        conn.execute(f"CREATE TABLE bench_retention.part ({COLUMNS}, PRIMARY KEY (id, created_at)) PARTITION BY RANGE (created_at)")
+        for d in range(args.days + 1):
+            conn.execute(
+                f"CREATE TABLE bench_retention.part_p{d:03d} PARTITION OF bench_retention.part FOR VALUES "
+                f"FROM (date_trunc('day', now()::timestamp) - interval '{args.days - d} days') TO (date_trunc('day', now()::timestamp) - interval '{args.days - d - 1} days')"
+            )
+        conn.execute("CREATE INDEX ON bench_retention.part (created_at)")
+        for table in ("bench_retention.plain", "bench_retention.part"):
+            conn.execute(FILL.format(table=table, rows=args.rows, days=args.days))
+        conn.execute("VACUUM ANALYZE bench_retention.plain")
+        conn.execute("VACUUM ANALYZE bench_retention.part")
+
+        delete = measure(conn, [f"DELETE FROM bench_retention.plain WHERE created_at < {cutoff}"])
+        drops = []
+        for d in range(args.expire_days):
+            drops += [f"ALTER TABLE bench_retention.part DETACH PARTITION bench_retention.part_p{d:03d} CONCURRENTLY", f"DROP TABLE bench_retention.part_p{d:03d}"]
+        drop = measure(conn, drops)
+        conn.execute("DROP SCHEMA bench_retention CASCADE")
+
+    print(json.dumps({"rows": args.rows, "days": args.days, "expired_days": args.expire_days, "delete": delete, "partition_drop": drop}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Multi-target routes: checks the rendered Postfix files and simulates how messages spread over the targets.
+
+    python bench/bench_routing.py --messages 100000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.policy import PolicyIndex, PolicyServer  # noqa: E402
+from app.routing import MAIN_FRAGMENT, MASTER_FRAGMENT, TUNING_FIELDS, RouteIndex, normalize_targets, render_route_files, transport_name  # noqa: E402
+
+TARGETS = [
+    {"host": "mx-a.bulk.tld", "weight": 5},
+    {"host": "mx-b.bulk.tld", "weight": 3, "max_connections": 20},
+    {"host": "mx-c.bulk.tld", "weight": 2, "rate_delay": 1},
+    {"host": "backup.bulk.tld", "port": 2525, "weight": 1, "priority": 10},
+]
+
+
+def route(sender_domain: str, host: str, port: int = 25, targets=None, auth=None, **tuning):
+    return SimpleNamespace(
+        sender_domain=sender_domain,
+        target_host=host,
+        target_port=port,
+        targets=targets,
+        auth_username=auth,
+        auth_password="secret" if auth else None,
+        **{k: tuning.get(k) for k in TUNING_FIELDS},
+    )
+
+
+def check_render(routes: list) -> dict:
+    files = render_route_files(routes)
+    multi = routes[1].targets
+    names = [transport_name("bulk.tld", t) for t in multi]
+    bulk, tuned = transport_name("bulk.tld"), transport_name("tuned.tld")
+    assert files["sender_relay"].splitlines() == [
+        "@bulk.tld [mx-a.bulk.tld]:25, [mx-b.bulk.tld]:25, [mx-c.bulk.tld]:25, [backup.bulk.tld]:2525",
+        "@single.tld [relay.single.tld]:25",
+        "@tuned.tld [relay.tuned.tld]:25",
+    ], files["sender_relay"]
+    assert files["transport"].splitlines()[1:] == ["single.tld smtp:[relay.single.tld]:25", f"tuned.tld {tuned}:[relay.tuned.tld]:25"]
+    # the plain route keeps the shared smtp transport
+    assert files["sender_transport"].splitlines() == [f"@bulk.tld {bulk}", f"@tuned.tld {tuned}"]
+    assert len(files["sasl_passwd"].splitlines()) == 4 and all(line.endswith(" user:secret") for line in files["sasl_passwd"].splitlines())
+    master = [line for line in files[MASTER_FRAGMENT].splitlines() if not line.startswith("#")]
+    assert len(master) == 11 and len(set(names) | {bulk, tuned}) == 6, master
+    assert master[0] == f"{bulk} unix - - y - - smtp"
+    assert master[1] == f"{names[0]} unix - - y - - smtp"
+    assert master[2] == "  -o smtp_fallback_relay=[mx-b.bulk.tld]:25,[mx-c.bulk.tld]:25,[backup.bulk.tld]:2525"
+    assert master[3] == f"{names[1]} unix - - y - 20 smtp"
+    assert master[8] == "  -o smtp_fallback_relay=[mx-a.bulk.tld]:25,[mx-b.bulk.tld]:25,[mx-c.bulk.tld]:25"
+    assert master[9:] == [f"{tuned} unix - - y - - smtp", "  -o smtp_connection_cache_destinations=[relay.tuned.tld]:25"]
+    main = [line for line in files[MAIN_FRAGMENT].splitlines() if not line.startswith("#")]
+    assert main == [
+        f"{names[2]}_destination_rate_delay = 1s",
+        f"{tuned}_destination_concurrency_limit = 10",
+        f"{tuned}_destination_recipient_limit = 50",
+    ], main
+    # content-derived names: rendering again (e.g. on the slave) gives byte-identical files
+    assert render_route_files(list(reversed(routes))) == files
+    return {"files": {k: len(v.splitlines()) for k, v in files.items()}, "ok": True}
+
+
+def spread(server: PolicyServer, down: set[str], messages: int) -> dict:
+    server.routes.down = down
+    attrs = {"request": "smtpd_access_policy", "protocol_state": "DATA", "sender": "newsletter@bulk.tld"}
+    counts = Counter()
+    started = time.perf_counter()
+    for _ in range(messages):
+        counts[server.decide(attrs)] += 1
+    per_decision = (time.perf_counter() - started) / messages
+    hosts = {}
+    for response, n in counts.items():
+        hop = response.decode().split(":", 1)[1].strip()
+        hosts[hop] = round(n / messages, 4)
+    return {"down": sorted(down), "share": dict(sorted(hosts.items())), "decision_us": round(per_decision * 1e6, 2)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=100_000)
+    args = ap.parse_args()
+
+    targets = normalize_targets(TARGETS)
+    routes = [
+        route("single.tld", "relay.single.tld"),
+        route("bulk.tld", targets[0]["host"], targets=targets, auth="user"),
+        route("tuned.tld", "relay.tuned.tld", concurrency_limit=10, recipient_limit=50, connection_cache=True, rate_delay=0),
+    ]
+    result = {"render": check_render(routes)}
+
+    server = PolicyServer(PolicyIndex(["bulk.tld"]), lambda _: None, routes=RouteIndex(routes, rng=random.Random(1)))
+    total = sum(t["weight"] for t in targets if t["priority"] == 0)
+    result["expected_share_tier0"] = {f"[{t['host']}]:{t['port']}": round(t["weight"] / total, 4) for t in targets if t["priority"] == 0}
+    result["scenarios"] = [
+        spread(server, set(), args.messages),
+        spread(server, {"mx-a.bulk.tld:25"}, args.messages),
+        spread(server, {"mx-a.bulk.tld:25", "mx-b.bulk.tld:25", "mx-c.bulk.tld:25"}, args.messages),
+        spread(server, {f"{t['host']}:{t['port']}" for t in targets}, args.messages),
+    ]
+    share = result["scenarios"][0]["share"]
+    result["max_weight_error"] = round(max(abs(share.get(k, 0) - v) for k, v in result["expected_share_tier0"].items()), 4)
+    # sampling error shrinks with 1/sqrt(n)
+    assert result["max_weight_error"] < max(0.01, 3 / args.messages ** 0.5), result
+    assert set(result["scenarios"][2]["share"]) == {"[backup.bulk.tld]:2525"}
+    # single-target senders and other stages are left to Postfix
+    assert server.decide({"request": "smtpd_access_policy", "protocol_state": "DATA", "sender": "x@single.tld"}) == b"action=DUNNO\n\n"
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""EXPLAIN-checked mail search benchmark against a seeded mail_logs table.
+
+    python bench/bench_search.py --rows 20000000
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import psycopg  # noqa: E402
+from sqlalchemy import desc  # noqa: E402
+from sqlalchemy.dialects import postgresql  # noqa: E402
+
+from app.db import SessionLocal  # noqa: E402
+from app.models import MailLog  # noqa: E402
+from app.search import MailFilter, filtered_mail_query, keyset_page  # noqa: E402
+from bench.seed import dsn, seed_mail_logs  # noqa: E402
+
+CASES = [
+    ("recent", MailFilter(hours=24)),
+    ("sender_contains", MailFilter(sender="user1234@", hours=24 * 14)),
+    ("recipient_contains", MailFilter(recipient="rcpt4711", hours=24 * 14)),
+    ("ip_contains", MailFilter(ip="10.17.42.", hours=24 * 14)),
+    ("sender_exact", MailFilter(sender="user1234@sender1234.tld", match="exact", hours=24 * 14)),
+    ("sender_prefix", MailFilter(sender="user1234@", match="prefix", hours=24 * 14)),
+    ("sender_domain_exact", MailFilter(sender_domain="sender77.tld", match="exact", hours=24 * 14)),
+    ("recipient_domain_prefix", MailFilter(recipient_domain="dest4711", match="prefix", hours=24 * 14)),
+]
+
+
+def seq_scans(plan: dict) -> list[str]:
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") == "mail_logs":
+        found.append(plan.get("Filter", ""))
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def node_types(plan: dict) -> list[str]:
+    out = [plan["Node Type"] + (f"({plan['Index Name']})" if "Index Name" in plan else "")]
+    for child in plan.get("Plans", []):
+        out.extend(node_types(child))
+    return out
+
+
+def explain(db, query) -> dict:
+    compiled = query.statement.compile(dialect=postgresql.dialect())
+    conn = db.connection()
+    res = conn.exec_driver_sql("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + str(compiled), compiled.params).scalar()
+    return (res if isinstance(res, list) else json.loads(res))[0]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=20_000_000)
+    ap.add_argument("--page-size", type=int, default=100)
+    args = ap.parse_args()
+
+    with psycopg.connect(dsn()) as conn:
+        have = conn.execute("SELECT count(*) FROM mail_logs").fetchone()[0]
+        if have < args.rows:
+            elapsed = seed_mail_logs(conn, args.rows - have)
+            print(f"seeded {args.rows - have} rows in {elapsed:.0f}s", file=sys.stderr)
+        conn.execute("ANALYZE mail_logs")
+        conn.commit()
+
+    results, failed = [], False
+    db = SessionLocal()
+    try:
+        for name, f in CASES:
+            q = filtered_mail_query(db, f).order_by(desc(MailLog.created_at), desc(MailLog.id)).limit(args.page_size)
+            plan = explain(db, q)
+            scans = seq_scans(plan["Plan"])
+            failed |= bool(scans)
+            started = time.perf_counter()
+            rows, cursor = keyset_page(filtered_mail_query(db, f), None, args.page_size)
+            first = time.perf_counter() - started
+            started = time.perf_counter()
+            if cursor:
+                keyset_page(filtered_mail_query(db, f), cursor, args.page_size)
+            second = time.perf_counter() - started
+            results.append(
+                {
+                    "case": name,
+                    "plan": node_types(plan["Plan"]),
+                    "seq_scan": bool(scans),
+                    "execution_ms": round(plan["Execution Time"], 2),
+                    "page1_ms": round(first * 1000, 2),
+                    "page2_ms": round(second * 1000, 2),
+                    "rows": len(rows),
+                }
+            )
+        started = time.perf_counter()
+        filtered_mail_query(db, MailFilter(sender="user1234@", hours=24 * 14)).order_by(desc(MailLog.created_at)).limit(5000).all()
+        results.append({"case": "legacy_limit_5000", "ms": round((time.perf_counter() - started) * 1000, 2)})
+    finally:
+        db.close()
+    print(json.dumps({"rows": args.rows, "results": results}, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Cold-start time to ready and the cost of the keepalived probes.
+
+    python bench/bench_startup.py --rounds 3 --workers 2 --probes 2000
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+
+def until_ok(client: httpx.Client, path: str, started: float, timeout: float) -> float | None:
+    while time.perf_counter() - started < timeout:
+        try:
+            if client.get(path).status_code == 200:
+                return round(time.perf_counter() - started, 3)
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    return None
+
+
+def probe(client: httpx.Client, path: str, n: int) -> dict:
+    samples, failed = [], 0
+    for _ in range(n):
+        started = time.perf_counter()
+        if client.get(path).status_code != 200:
+            failed += 1
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {"p50_ms": round(statistics.median(samples), 2), "p99_ms": round(samples[int(len(samples) * 0.99) - 1], 2), "max_ms": round(samples[-1], 2), "failed": failed}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--port", type=int, default=18080)
+    ap.add_argument("--rounds", type=int, default=3)
+    ap.add_argument("--probes", type=int, default=2000)
+    ap.add_argument("--timeout", type=float, default=120)
+    args = ap.parse_args()
+
+    env = {**os.environ, "API_WORKERS": str(args.workers), "POLICY_LISTEN": "", "POSTFIX_LOG_PATH": "", "HEALTH_INTERVAL_SECONDS": "0"}
+    client = httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=5)
+    rounds, probes = [], {}
+    for i in range(args.rounds):
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(args.workers)],
+            cwd=Path(__file__).resolve().parents[1],
+            env=env,
+        )
+        try:
+            live = until_ok(client, "/healthz", started, args.timeout)
+            ready = until_ok(client, "/readyz", started, args.timeout)
+            rounds.append({"round": i + 1, "healthz_s": live, "readyz_s": ready})
+            if ready is None:
+                sys.exit("backend did not become ready")
+            if i == args.rounds - 1:
+                probes = {path: probe(client, path, args.probes) for path in ("/healthz", "/readyz", "/docs")}
+        finally:
+            server.send_signal(signal.SIGINT)
+            server.wait(timeout=30)
+
+    print(json.dumps({"workers": args.workers, "startup": rounds, "probes": probes}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""Load driver for ingest, search, dashboard and CSV export against a backend on seeded data (bench/seed.py).
+
+    python bench/loadgen.py run --label baseline --seconds 30 --concurrency 64 --out runs/baseline.json
+    python bench/loadgen.py run --label pr-123 --rate 400 --scenarios smtp_event,search_sender --spawn 4 --out runs/pr-123.json
+    python bench/loadgen.py compare runs/baseline.json runs/pr-123.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+SENDERS, DOMAINS = 20000, 2000
+
+
+def event(i: int, rnd: random.Random) -> dict:
+    s = rnd.randrange(SENDERS)
+    return {
+        "sender": f"user{s}@sender{s % DOMAINS}.tld",
+        "recipient": f"rcpt{rnd.randrange(200000)}@dest{rnd.randrange(50000)}.tld",
+        "client_ip": f"10.{s % 250}.{(s // 250) % 250}.{s % 7 + 1}",
+        "status": "ok",
+        "target": f"relay{s % 8}.tld[10.1.0.{s % 8}]:25",
+        "queue_id": f"LG{os.getpid():X}{i:08X}",
+        "message_id": f"<lg{i}.{s}@sender{s % DOMAINS}.tld>",
+    }
+
+
+# name -> (method, path(rnd), body(i, rnd) or None, streamed)
+SCENARIOS = {
+    "smtp_event": ("POST", lambda rnd: "/api/smtp-event", event, False),
+    "search_sender": ("GET", lambda rnd: f"/api/mail/search?sender=user{rnd.randrange(SENDERS)}@&limit=50", None, False),
+    "search_domain": ("GET", lambda rnd: f"/api/mail/search?sender_domain=sender{rnd.randrange(DOMAINS)}.tld&match=exact&limit=50", None, False),
+    "search_recipient": ("GET", lambda rnd: f"/api/mail/search?recipient=rcpt{rnd.randrange(200000)}@&match=prefix&limit=50&hours=168", None, False),
+    "search_status": ("GET", lambda rnd: "/api/mail/search?status=bounced&limit=100", None, False),
+    "search_per_message": ("GET", lambda rnd: f"/api/mail/search?sender_domain=sender{rnd.randrange(DOMAINS)}.tld&match=exact&per_message=true&limit=50", None, False),
+    "dashboard": ("GET", lambda rnd: "/api/dashboard", None, False),
+    "export_csv": ("GET", lambda rnd: f"/api/mail/export.csv?sender_domain=sender{rnd.randrange(DOMAINS)}.tld&match=exact&hours=168", None, True),
+}
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    v = sorted(values)
+
+    def at(q: float) -> float:
+        return round(v[min(len(v) - 1, int(len(v) * q))] * 1000, 2)
+
+    return {"p50": at(0.5), "p90": at(0.9), "p99": at(0.99), "p99.9": at(0.999), "max": round(v[-1] * 1000, 2)}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies, self.ttfb, self.errors, self.bytes = [], [], [], 0
+
+    async def request(self, client: httpx.AsyncClient, scenario: tuple, i: int, rnd: random.Random, scheduled: float | None = None):
+        method, path, body, streamed = scenario
+        # open loop: measured from the scheduled start, including any wait for a free connection
+        started = scheduled if scheduled is not None else time.perf_counter()
+        try:
+            if streamed:
+                async with client.stream(method, path(rnd)) as r:
+                    first = None
+                    async for chunk in r.aiter_bytes():
+                        if first is None:
+                            first = time.perf_counter()
+                            self.ttfb.append(first - started)
+                        self.bytes += len(chunk)
+            else:
+                r = await client.request(method, path(rnd), json=body(i, rnd) if body else None)
+            if r.status_code >= 400:
+                self.errors.append(r.status_code)
+        except httpx.HTTPError as e:
+            self.errors.append(type(e).__name__)
+        self.latencies.append(time.perf_counter() - started)
+
+
+async def closed_loop(client, scenario, rec: Recorder, concurrency: int, seconds: float):
+    deadline = time.monotonic() + seconds
+    counter = iter(range(1 << 62))
+
+    async def worker(n: int):
+        rnd = random.Random(n)
+        while time.monotonic() < deadline:
+            await rec.request(client, scenario, next(counter), rnd)
+
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+
+
+async def open_loop(client, scenario, rec: Recorder, rate: float, seconds: float):
+    rnd = random.Random(0)
+    tasks = set()
+    start = time.perf_counter()
+    for i in range(int(rate * seconds)):
+        scheduled = start + i / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(rec.request(client, scenario, i, rnd, scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+
+
+async def run_scenario(args, headers: dict, name: str) -> dict:
+    scenario = SCENARIOS[name]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    rec = Recorder()
+    async with httpx.AsyncClient(base_url=args.base_url, headers=headers, limits=limits, timeout=args.timeout, verify=False) as client:
+        started = time.perf_counter()
+        if args.rate:
+            await open_loop(client, scenario, rec, args.rate, args.seconds)
+        else:
+            await closed_loop(client, scenario, rec, args.concurrency, args.seconds)
+        elapsed = time.perf_counter() - started
+    out = {
+        "requests": len(rec.latencies),
+        "requests_per_second": round(len(rec.latencies) / elapsed, 1),
+        "errors": len(rec.errors),
+        "error_kinds": sorted({str(e) for e in rec.errors})[:5],
+        "latency_ms": percentiles(rec.latencies),
+    }
+    if scenario[3]:
+        out["ttfb_ms"] = percentiles(rec.ttfb)
+        out["bytes_per_second"] = round(rec.bytes / elapsed)
+    return out
+
+
+async def run_all(args) -> dict:
+    async with httpx.AsyncClient(base_url=args.base_url, verify=False) as c:
+        r = await c.post("/api/login", json={"username": args.user, "password": args.password})
+        r.raise_for_status()
+        token = r.json()["token"]
+    headers = {"authorization": f"Bearer {token}", "x-api-token": args.api_token}
+    results = {}
+    for name in args.scenarios.split(","):
+        results[name] = await run_scenario(args, headers, name)
+        print(name, json.dumps(results[name]), file=sys.stderr)
+    return results
+
+
+def git_rev() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def table_sizes() -> dict | None:
+    # planner estimates, good enough to tell a 1M from a 100M run apart
+    try:
+        import psycopg
+
+        sys.path.insert(0, str(ROOT))
+        from bench.seed import dsn
+
+        with psycopg.connect(dsn(), connect_timeout=3) as conn:
+            rows = conn.execute(
+                """SELECT t, (SELECT coalesce(sum(greatest(c.reltuples, 0)), 0)::bigint FROM pg_class c
+                WHERE c.oid = t::regclass OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = t::regclass))
+                FROM unnest(ARRAY['mail_logs', 'rejection_logs', 'mail_traces', 'domain_policies', 'relay_routes']) AS t"""
+            ).fetchall()
+        return dict(rows)
+    except Exception:
+        return None
+
+
+def wait_for_backend(args, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.post(f"{args.base_url}/api/login", json={"username": args.user, "password": args.password}, timeout=2).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def run(args):
+    server = None
+    if args.spawn:
+        args.base_url = f"http://127.0.0.1:{args.port}"
+        env = {**os.environ, "POLICY_LISTEN": "", "POSTFIX_LOG_PATH": "", "HEALTH_INTERVAL_SECONDS": "0"}
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(args.spawn), "--log-level", "warning"],
+            cwd=ROOT,
+            env=env,
+        )
+        if not wait_for_backend(args, 60):
+            server.terminate()
+            sys.exit("backend did not come up")
+    try:
+        results = asyncio.run(run_all(args))
+    finally:
+        if server:
+            server.terminate()
+            server.wait(10)
+    report = {
+        "label": args.label,
+        "at": datetime.utcnow().isoformat(),
+        "git_rev": git_rev(),
+        "mode": f"open {args.rate}/s" if args.rate else f"closed x{args.concurrency}",
+        "seconds": args.seconds,
+        "workers": args.spawn or None,
+        "tables": table_sizes(),
+        "results": results,
+    }
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(json.dumps(report, indent=2) + "\n")
+    print(json.dumps(report, indent=2))
+
+
+def change(old, new) -> str | None:
+    if old in (None, 0) or new is None:
+        return None
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def compare(args):
+    base, new = (json.loads(Path(p).read_text()) for p in (args.base, args.new))
+    out = {"base": {k: base.get(k) for k in ("label", "git_rev", "mode", "tables")}, "new": {k: new.get(k) for k in ("label", "git_rev", "mode", "tables")}, "scenarios": {}}
+    for name in sorted(set(base["results"]) & set(new["results"])):
+        a, b = base["results"][name], new["results"][name]
+        row = {"requests_per_second": [a["requests_per_second"], b["requests_per_second"], change(a["requests_per_second"], b["requests_per_second"])]}
+        for p in ("p50", "p99", "p99.9"):
+            x, y = a["latency_ms"].get(p), b["latency_ms"].get(p)
+            row[f"{p}_ms"] = [x, y, change(x, y)]
+        row["errors"] = [a["errors"], b["errors"]]
+        if "bytes_per_second" in a and "bytes_per_second" in b:
+            row["bytes_per_second"] = [a["bytes_per_second"], b["bytes_per_second"], change(a["bytes_per_second"], b["bytes_per_second"])]
+        out["scenarios"][name] = row
+    print(json.dumps(out, indent=2))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="command", required=True)
+    r = sub.add_parser("run")
+    r.add_argument("--base-url", default="http://127.0.0.1:8080")
+    r.add_argument("--scenarios", default=",".join(SCENARIOS))
+    r.add_argument("--concurrency", type=int, default=64, help="clients (closed loop) or connection limit (open loop)")
+    r.add_argument("--rate", type=float, default=0, help="requests per second per scenario, enables the open loop")
+    r.add_argument("--seconds", type=float, default=30)
+    r.add_argument("--timeout", type=float, default=60)
+    r.add_argument("--spawn", type=int, default=0, help="start uvicorn with this many workers")
+    r.add_argument("--port", type=int, default=18080)
+    r.add_argument("--user", default="admin")
+    r.add_argument("--password", default="Admin123")
+    r.add_argument("--api-token", default="bootstrap-token")
+    r.add_argument("--label", default="")
+    r.add_argument("--out")
+    c = sub.add_parser("compare")
+    c.add_argument("base")
+    c.add_argument("new")
+    args = ap.parse_args()
+    if args.command == "run":
+        unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+        if unknown:
+            ap.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ CREATE TABLE IF NOT EXISTS users (
 CREATE TABLE IF NOT EXISTS config_versions (
   id SERIAL PRIMARY KEY,
   version INTEGER UNIQUE NOT NULL,
+  kind VARCHAR(8) NOT NULL DEFAULT 'full',
   data TEXT NOT NULL,
   created_by VARCHAR(64) NOT NULL,
   created_at TIMESTAMP NOT NULL DEFAULT NOW(),
@@ -27,19 +28,28 @@ CREATE TABLE IF NOT EXISTS relay_routes (
   tls_mode VARCHAR(32) NOT NULL DEFAULT 'opportunistic',
   tls_verify BOOLEAN NOT NULL DEFAULT FALSE,
   auth_username VARCHAR(255),
-  auth_password VARCHAR(255)
+  auth_password VARCHAR(255),
+  targets JSONB,
+  concurrency_limit INTEGER,
+  rate_delay INTEGER,
+  recipient_limit INTEGER,
+  connection_cache BOOLEAN NOT NULL DEFAULT FALSE
 );
+-- mail_logs/rejection_logs are range-partitioned by day; the backend creates the daily partitions ahead of time.
 CREATE TABLE IF NOT EXISTS mail_logs (
-  id SERIAL PRIMARY KEY,
+  id SERIAL,
   sender VARCHAR(255), recipient VARCHAR(255), client_ip VARCHAR(64), helo VARCHAR(255), rdns VARCHAR(255),
   target VARCHAR(255), status VARCHAR(32) NOT NULL DEFAULT 'unknown', smtp_code VARCHAR(32), smtp_text TEXT,
-  tls_used BOOLEAN NOT NULL DEFAULT FALSE, subject VARCHAR(998), created_at TIMESTAMP NOT NULL DEFAULT NOW()
-);
+  tls_used BOOLEAN NOT NULL DEFAULT FALSE, subject VARCHAR(998), queue_id VARCHAR(32), message_id VARCHAR(255),
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 CREATE TABLE IF NOT EXISTS rejection_logs (
-  id SERIAL PRIMARY KEY,
+  id SERIAL,
   sender VARCHAR(255), recipient VARCHAR(255), client_ip VARCHAR(64), reason TEXT NOT NULL,
-  created_at TIMESTAMP NOT NULL DEFAULT NOW()
-);
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 CREATE TABLE IF NOT EXISTS audit_logs (
   id SERIAL PRIMARY KEY,
   actor VARCHAR(64) NOT NULL, action VARCHAR(255) NOT NULL, payload TEXT,
@@ -65,3 +75,53 @@ CREATE TABLE IF NOT EXISTS cluster_locks (
   node_id VARCHAR(64) NOT NULL,
   heartbeat TIMESTAMP NOT NULL DEFAULT NOW()
 );
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS ix_mail_logs_created_at ON mail_logs (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ix_mail_logs_sender_lower ON mail_logs (lower(sender) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ix_mail_logs_recipient_lower ON mail_logs (lower(recipient) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ix_mail_logs_sender_domain ON mail_logs (lower(split_part(sender, '@', 2)) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ix_mail_logs_recipient_domain ON mail_logs (lower(split_part(recipient, '@', 2)) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ix_mail_logs_sender_trgm ON mail_logs USING gin (sender gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_mail_logs_recipient_trgm ON mail_logs USING gin (recipient gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_mail_logs_client_ip_trgm ON mail_logs USING gin (client_ip gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_mail_logs_target_trgm ON mail_logs USING gin (target gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_mail_logs_queue_id ON mail_logs (queue_id);
+CREATE INDEX IF NOT EXISTS ix_mail_logs_message_id ON mail_logs (message_id);
+CREATE INDEX IF NOT EXISTS ix_rejection_logs_created_at ON rejection_logs (created_at DESC);
+CREATE TABLE IF NOT EXISTS traffic_rollups (
+  granularity VARCHAR(1) NOT NULL, bucket TIMESTAMP NOT NULL, kind VARCHAR(8) NOT NULL,
+  status VARCHAR(32) NOT NULL DEFAULT '', target VARCHAR(255) NOT NULL DEFAULT '', tls_used BOOLEAN NOT NULL DEFAULT FALSE,
+  reason VARCHAR(255) NOT NULL DEFAULT '', count BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (granularity, bucket, kind, status, target, tls_used, reason)
+);
+CREATE TABLE IF NOT EXISTS rate_limits (
+  id SERIAL PRIMARY KEY, scope VARCHAR(32) NOT NULL, match VARCHAR(255) NOT NULL DEFAULT '*',
+  max_messages INTEGER NOT NULL, window_seconds INTEGER NOT NULL DEFAULT 60, enabled BOOLEAN NOT NULL DEFAULT TRUE,
+  UNIQUE (scope, match)
+);
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_counters (
+  scope VARCHAR(32) NOT NULL, key VARCHAR(255) NOT NULL, window_seconds INTEGER NOT NULL, window_start BIGINT NOT NULL,
+  count BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (scope, key, window_seconds, window_start)
+);
+-- one summary row per message, updated in place by the ingest path; fillfactor leaves room for HOT updates
+CREATE TABLE IF NOT EXISTS mail_traces (
+  queue_id VARCHAR(32) PRIMARY KEY, message_id VARCHAR(255), sender VARCHAR(255), client_ip VARCHAR(64),
+  first_seen TIMESTAMP NOT NULL, last_seen TIMESTAMP NOT NULL,
+  attempts INTEGER NOT NULL DEFAULT 0, delivered INTEGER NOT NULL DEFAULT 0, deferred INTEGER NOT NULL DEFAULT 0, bounced INTEGER NOT NULL DEFAULT 0,
+  status VARCHAR(32) NOT NULL, last_target VARCHAR(255), last_smtp_code VARCHAR(32), last_smtp_text TEXT, tls_used BOOLEAN NOT NULL DEFAULT FALSE
+) WITH (fillfactor = 80);
+CREATE INDEX IF NOT EXISTS ix_mail_traces_message_id ON mail_traces (message_id);
+-- current probe state per relay target; rewritten every check interval, so HOT updates matter
+CREATE TABLE IF NOT EXISTS relay_target_health (
+  target VARCHAR(300) PRIMARY KEY, host VARCHAR(255) NOT NULL, port INTEGER NOT NULL,
+  up BOOLEAN NOT NULL DEFAULT FALSE, latency_ms DOUBLE PRECISION, failures INTEGER NOT NULL DEFAULT 0,
+  banner VARCHAR(255), tls BOOLEAN, error VARCHAR(255), checked_at TIMESTAMP NOT NULL, last_up TIMESTAMP
+) WITH (fillfactor = 70);
+CREATE TABLE IF NOT EXISTS relay_health_history (
+  target VARCHAR(300) NOT NULL, bucket TIMESTAMP NOT NULL,
+  checks INTEGER NOT NULL DEFAULT 0, ok INTEGER NOT NULL DEFAULT 0,
+  latency_sum DOUBLE PRECISION NOT NULL DEFAULT 0, latency_max DOUBLE PRECISION NOT NULL DEFAULT 0,
+  PRIMARY KEY (target, bucket)
+);
+CREATE INDEX IF NOT EXISTS ix_relay_health_history_bucket ON relay_health_history (bucket);
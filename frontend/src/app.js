@@ -1,6 +1,6 @@
 const app = document.getElementById('app');
 let token = localStorage.getItem('token') || '';
-let state = { tab: 'dashboard', mailRows: [], settingsOpen: false, users: [] };
+let state = { tab: 'dashboard', mailRows: [], settingsOpen: false, users: [], live: null };
 
 const esc = (s='') => String(s).replaceAll('&','&amp;').replaceAll('<','&lt;').replaceAll('>','&gt;');
 async function api(path,opt={}){ opt.headers=Object.assign({},opt.headers||{}, {'Authorization':'Bearer '+token,'content-type':'application/json'}); const r=await fetch(path,opt); let d={}; try{d=await r.json()}catch(_){d={}} return [r,d]; }
@@ -85,19 +85,53 @@ function settingsModal(cluster){
   </div>`;
 }
 
+const mailRowHtml = r => `<tr><td>${esc(r.timestamp||'')}</td><td>${esc(r.sender||'')}</td><td>${esc(r.recipient||'')}</td><td>${esc(r.ip||'')}</td><td>${esc(r.status||'')}</td><td>${esc(r.target||'')}</td><td>${r.tls?'yes':'no'}</td></tr>`;
+const mailParams = () => ({sender:f_sender.value,recipient:f_recipient.value,ip:f_ip.value,target:f_target.value,status:f_status.value});
+
+function stopLive(){ if(state.live){ state.live.abort(); state.live=null; } }
+
+async function startLive(){
+  // fetch instead of EventSource so the Authorization header can be sent; the server pushes SSE frames
+  const ctl = new AbortController(); state.live = ctl;
+  const p = new URLSearchParams(Object.entries(mailParams()).filter(([,v])=>v));
+  try{
+    const r = await fetch('/api/mail/live?'+p.toString(), {headers:{'Authorization':'Bearer '+token}, signal:ctl.signal});
+    if(!r.ok){ state.live=null; liveInfo.textContent='Live nicht verfügbar ('+r.status+')'; liveMail.textContent='Live'; return; }
+    const reader = r.body.getReader(), dec = new TextDecoder(); let buf='';
+    for(;;){
+      const {value, done} = await reader.read(); if(done) break;
+      buf += dec.decode(value, {stream:true});
+      const frames = buf.split('\n\n'); buf = frames.pop();
+      const rows = [];
+      for(const f of frames){
+        let ev='', data='';
+        for(const line of f.split('\n')){ if(line.startsWith('event: ')) ev=line.slice(7); else if(line.startsWith('data: ')) data+=line.slice(6); }
+        if(ev==='mail'||ev==='reject') rows.push(JSON.parse(data));
+        else if(ev==='dropped' && document.getElementById('liveInfo')) liveInfo.textContent=JSON.parse(data).count+' Events übersprungen (Client zu langsam)';
+      }
+      if(!rows.length) continue;
+      rows.reverse(); state.mailRows = rows.concat(state.mailRows).slice(0,500);
+      const body = document.getElementById('mailBody'); if(!body){ stopLive(); break; }
+      body.insertAdjacentHTML('afterbegin', rows.map(mailRowHtml).join(''));
+      while(body.rows.length>500) body.deleteRow(-1);
+    }
+  }catch(_){ /* aborted */ }
+}
+
 function renderMailTab(){
   return `<div class="card"><h2>Mail Tracking & Suche</h2>
   <div class=row><input id=f_sender placeholder="Sender"><input id=f_recipient placeholder="Recipient"></div>
   <div class=row><input id=f_ip placeholder="Client IP"><input id=f_target placeholder="Target"></div>
-  <div class=row><input id=f_status placeholder="Status"><input id=f_hours type=number value="24" placeholder="Zeitraum (Stunden)"></div>
-  <button id=searchMail>Suchen</button><button id=exportCsv style="background:#16a34a">CSV Export</button>
+  <div class=row><input id=f_status placeholder="Status"><input id=f_hours type=number value="24" max="8784" placeholder="Zeitraum (Stunden)"></div>
+  <button id=searchMail>Suchen</button><button id=exportCsv style="background:#16a34a">CSV Export</button><button id=liveMail style="background:#7c3aed">${state.live?'Live stoppen':'Live'}</button> <span id=liveInfo></span>
   <div style="max-height:420px;overflow:auto"><table style="width:100%;font-size:12px"><thead><tr><th>Zeit</th><th>Sender</th><th>Empfänger</th><th>IP</th><th>Status</th><th>Target</th><th>TLS</th></tr></thead>
-  <tbody>${state.mailRows.map(r=>`<tr><td>${esc(r.timestamp||'')}</td><td>${esc(r.sender||'')}</td><td>${esc(r.recipient||'')}</td><td>${esc(r.ip||'')}</td><td>${esc(r.status||'')}</td><td>${esc(r.target||'')}</td><td>${r.tls?'yes':'no'}</td></tr>`).join('')}</tbody></table></div>
+  <tbody id=mailBody>${state.mailRows.map(mailRowHtml).join('')}</tbody></table></div>
   </div>`;
 }
 
 function renderDashboard(d){
-  return `<div class="grid"><div class="card"><h3>Processed 24h</h3>${d.processed_24h||0}</div><div class="card"><h3>Processed 1h</h3>${d.processed_1h||0}</div><div class="card"><h3>Rejected 16h</h3>${d.rejected_16h||0}</div><div class="card"><h3>Active Node</h3>${esc(d.active_node||'')}</div></div>
+  const rt=d.relay_targets||{};
+  return `<div class="grid"><div class="card"><h3>Processed 24h</h3>${d.processed_24h||0}</div><div class="card"><h3>Processed 1h</h3>${d.processed_1h||0}</div><div class="card"><h3>Rejected 16h</h3>${d.rejected_16h||0}</div><div class="card"><h3>Active Node</h3>${esc(d.active_node||'')}</div><div class="card"><h3>Relay-Ziele</h3>${rt.up||0} up / ${rt.down||0} down${(rt.down_targets||[]).length?`<ul>${rt.down_targets.map(t=>`<li>${esc(t)}</li>`).join('')}</ul>`:''}</div></div>
   <div class="card"><h3>Letzte Rejections</h3><ul>${(d.rejected_last_100||[]).slice(0,20).map(r=>`<li>${esc(r.created_at)} - ${esc(r.sender||'')} -> ${esc(r.recipient||'')} (${esc(r.reason||'')})</li>`).join('')}</ul></div>`;
 }
 
@@ -109,9 +143,14 @@ function renderUsersTab(){
   <pre id=userOut></pre></div>`;
 }
 
+function routeTuning(r){
+  const parts=[r.concurrency_limit&&`${r.concurrency_limit} parallel`, r.rate_delay&&`Delay ${r.rate_delay}s`, r.recipient_limit&&`${r.recipient_limit} Empf.`, r.connection_cache&&'Cache'].filter(Boolean);
+  return parts.length?` [${parts.join(', ')}]`:'';
+}
+
 function renderConfigTab(conf){
-  return `<div class="grid"><div class="card"><h2>Allowed Domains</h2><input id=domain placeholder='example.com'><button id=addDomain>Domain hinzufügen</button><ul>${(conf.domains||[]).map(d=>`<li>${esc(d.domain)}</li>`).join('')}</ul></div>
-  <div class="card"><h2>Sender Routing</h2><input id=sd placeholder='sender-domain'><input id=th placeholder='target host'><input id=tp value='25'><button id=addRoute>Route hinzufügen</button><ul>${(conf.routes||[]).map(r=>`<li>@${esc(r.sender_domain)} → ${esc(r.target_host)}:${r.target_port}</li>`).join('')}</ul>
+  return `<div class="grid"><div class="card"><h2>Allowed Domains</h2><input id=domain placeholder='example.com'><button id=addDomain>Domain hinzufügen</button><div class=row><input id=importFile type=file accept='.csv,.json'><button id=importCfg>Import (CSV/JSON)</button></div><ul>${(conf.domains||[]).map(d=>`<li>${esc(d.domain)}</li>`).join('')}</ul></div>
+  <div class="card"><h2>Sender Routing</h2><input id=sd placeholder='sender-domain'><input id=th placeholder='target host'><input id=tp value='25'><div class=row><input id=rcl type=number min=1 placeholder='Parallele Verbindungen'><input id=rrd type=number min=0 placeholder='Rate-Delay (s)'><input id=rrl type=number min=1 placeholder='Empfänger/Nachricht'><label><input id=rcc type=checkbox> Connection-Cache</label></div><button id=addRoute>Route hinzufügen</button><ul>${(conf.routes||[]).map(r=>`<li>@${esc(r.sender_domain)} → ${(r.targets||[{host:r.target_host,port:r.target_port}]).map(t=>`${esc(t.host)}:${t.port}${r.targets?` (w${t.weight}, p${t.priority})`:''}`).join(', ')}${routeTuning(r)}</li>`).join('')}</ul>
   <button id=testCfg>Konfiguration testen</button><button id=applyCfg style="background:#16a34a">Änderungen übernehmen</button><pre id=configOut></pre></div></div>`;
 }
 
@@ -126,21 +165,35 @@ async function renderApp(){
   content += settingsModal(cluster);
   app.innerHTML = shell(content);
 
-  document.querySelectorAll('[data-tab]').forEach(b=>b.onclick=()=>{state.tab=b.dataset.tab;renderApp();});
-  document.getElementById('logout').onclick=()=>{localStorage.removeItem('token'); token=''; loginView();};
+  document.querySelectorAll('[data-tab]').forEach(b=>b.onclick=()=>{stopLive();state.tab=b.dataset.tab;renderApp();});
+  document.getElementById('logout').onclick=()=>{stopLive(); localStorage.removeItem('token'); token=''; loginView();};
   document.getElementById('openSettings').onclick=()=>{state.settingsOpen=true; renderApp();};
 
   if(state.tab==='mail'){
     document.getElementById('searchMail').onclick=async()=>{
-      const p=new URLSearchParams({sender:f_sender.value,recipient:f_recipient.value,ip:f_ip.value,target:f_target.value,status:f_status.value,hours:f_hours.value||'24'});
+      stopLive();
+      const p=new URLSearchParams({...mailParams(),hours:f_hours.value||'24'});
       const [,rows]=await api('/api/mail/search?'+p.toString()); state.mailRows=Array.isArray(rows)?rows:[]; renderApp();
     };
-    document.getElementById('exportCsv').onclick=()=>window.open('/api/mail/export.csv?hours='+(document.getElementById('f_hours').value||'24'),'_blank');
+    document.getElementById('exportCsv').onclick=()=>{
+      const p=new URLSearchParams({...mailParams(),hours:f_hours.value||'24'});
+      window.open('/api/mail/export.csv?'+p.toString(),'_blank');
+    };
+    document.getElementById('liveMail').onclick=()=>{
+      if(state.live){ stopLive(); liveMail.textContent='Live'; liveInfo.textContent=''; return; }
+      state.mailRows=[]; mailBody.innerHTML=''; liveMail.textContent='Live stoppen'; liveInfo.textContent=''; startLive();
+    };
   }
 
   if(state.tab==='config'){
     document.getElementById('addDomain').onclick=async()=>{await api('/api/domains',{method:'POST',body:JSON.stringify({domain:domain.value})}); renderApp();};
-    document.getElementById('addRoute').onclick=async()=>{await api('/api/routes',{method:'POST',body:JSON.stringify({sender_domain:sd.value,target_host:th.value,target_port:parseInt(tp.value,10),tls_mode:'opportunistic',tls_verify:false})}); renderApp();};
+    document.getElementById('addRoute').onclick=async()=>{const num=el=>el.value===''?null:parseInt(el.value,10); await api('/api/routes',{method:'POST',body:JSON.stringify({sender_domain:sd.value,target_host:th.value,target_port:parseInt(tp.value,10),tls_mode:'opportunistic',tls_verify:false,concurrency_limit:num(rcl),rate_delay:num(rrd),recipient_limit:num(rrl),connection_cache:rcc.checked})}); renderApp();};
+    document.getElementById('importCfg').onclick=async()=>{
+      const f=importFile.files[0]; if(!f) return;
+      // bulk upsert of domains/routes, one config version; api() would force JSON, so fetch directly
+      const r=await fetch('/api/config/import',{method:'POST',headers:{'Authorization':'Bearer '+token,'content-type':f.name.endsWith('.csv')?'text/csv':'application/json'},body:await f.text()});
+      const d=await r.json().catch(()=>({})); if(r.ok){ await renderApp(); } configOut.textContent=JSON.stringify(d,null,2);
+    };
     document.getElementById('testCfg').onclick=async()=>{const [,d]=await api('/api/config/test',{method:'POST',body:'{}'}); configOut.textContent=JSON.stringify(d,null,2)};
     document.getElementById('applyCfg').onclick=async()=>{const [,d]=await api('/api/config/apply',{method:'POST',body:'{}'}); configOut.textContent=JSON.stringify(d,null,2)};
   }
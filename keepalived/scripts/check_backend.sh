@@ -1,2 +1,3 @@
 #!/bin/sh
-curl -fsS http://127.0.0.1:8080/docs >/dev/null
+# /readyz: database reachable through the pool and Postfix consuming map renders (see backend/app/main.py)
+curl -fsS -m 1 http://127.0.0.1:8080/readyz >/dev/null
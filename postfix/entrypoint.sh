@@ -1,8 +1,8 @@
 #!/bin/sh
 set -eu
 
-mkdir -p /etc/postfix/generated /var/log /certs
-for f in allowed_sender_domains sender_relay transport sasl_passwd; do
+mkdir -p /etc/postfix/generated /var/log/postfix /certs
+for f in allowed_sender_domains sender_relay sender_transport transport sasl_passwd; do
   [ -f "/etc/postfix/generated/$f" ] || touch "/etc/postfix/generated/$f"
 done
 
@@ -35,26 +35,105 @@ apply_reject_footer() {
   fi
 }
 
-normalize_allowed_sender_map
+MAPS="allowed_sender_domains sender_relay sender_transport transport sasl_passwd"
+
+postmap_one() {
+  [ "$1" = allowed_sender_domains ] && normalize_allowed_sender_map
+  postmap "hash:/etc/postfix/generated/$1" || true
+  [ "$1" = sasl_passwd ] && chmod 600 /etc/postfix/generated/sasl_passwd* || true
+}
+
+# Own smtp services of tuned and multi-target routes (see backend/app/routing.py). The generated master.cf block is
+# replaced as a whole; main.cf parameters set by the previous block are removed before the current ones are set.
+ROUTES_MAIN_SET=/etc/postfix/.routes-main-params
+
+apply_route_transports() {
+  gen=/etc/postfix/generated
+  sed -i '/^# BEGIN generated routes$/,/^# END generated routes$/d' /etc/postfix/master.cf
+  {
+    echo "# BEGIN generated routes"
+    grep -v '^#' "$gen/master.cf.routes" 2>/dev/null || true
+    echo "# END generated routes"
+  } >> /etc/postfix/master.cf
+  if [ -f "$ROUTES_MAIN_SET" ]; then
+    while read -r p; do postconf -X "$p" || true; done < "$ROUTES_MAIN_SET"
+  fi
+  : > "$ROUTES_MAIN_SET"
+  [ -f "$gen/main.cf.routes" ] || return 0
+  grep '=' "$gen/main.cf.routes" | grep -v '^#' | while IFS= read -r line; do
+    postconf -e "$line" || true
+    echo "${line%%=*}" | tr -d ' ' >> "$ROUTES_MAIN_SET"
+  done
+}
+
+# The backend lists changed files in .changed (see backend/app/render.py). Without that file
+# (manual `touch .reload`) everything is rebuilt; an empty one means nothing to do.
+apply_changes() {
+  gen=/etc/postfix/generated
+  if [ ! -f "$gen/.changed" ]; then
+    for m in $MAPS; do postmap_one "$m"; done
+    apply_reject_footer
+    apply_route_transports
+    postfix reload
+    return
+  fi
+  mv "$gen/.changed" "$gen/.changed.processing"
+  changed=$(sort -u "$gen/.changed.processing")
+  rm -f "$gen/.changed.processing"
+  [ -n "$changed" ] || return 0
+  routes=""
+  for f in $changed; do
+    case " $MAPS " in *" $f "*) postmap_one "$f" ;; esac
+    [ "$f" = reject_response_message ] && apply_reject_footer
+    case "$f" in master.cf.routes|main.cf.routes) routes=1 ;; esac
+  done
+  [ -z "$routes" ] || apply_route_transports
+  postfix reload
+}
+
+# Bulk queue actions from the backend (see backend/app/mailqueue.py): one file per request named <seq>.<action>,
+# one queue ID per line. Files are written atomically, so a half-written request is never picked up.
+apply_queue_actions() {
+  dir=/etc/postfix/generated/queue-actions
+  [ -d "$dir" ] || return 0
+  for f in "$dir"/*; do
+    [ -f "$f" ] || continue
+    case "$f" in
+      *.hold) postsuper -h - < "$f" || true ;;
+      *.release) postsuper -H - < "$f" || true ;;
+      *.delete) postsuper -d - < "$f" || true ;;
+      *.flush) while read -r id; do postqueue -i "$id" || true; done < "$f" ;;
+    esac
+    rm -f "$f"
+  done
+}
+
+# POLICY_SERVICE="" falls back to the static allowed_sender_domains access map (and to the static target order of
+# multi-target routes, since the weighted choice per message is made by the policy service at DATA)
+apply_sender_restrictions() {
+  policy="${POLICY_SERVICE-inet:127.0.0.1:10040}"
+  if [ -n "$policy" ]; then
+    postconf -e "smtpd_sender_restrictions = check_policy_service $policy, reject"
+    postconf -e "smtpd_data_restrictions = check_policy_service $policy"
+  else
+    postconf -e "smtpd_sender_restrictions = check_sender_access hash:/etc/postfix/generated/allowed_sender_domains, reject"
+    postconf -e "smtpd_data_restrictions ="
+  fi
+}
+
 ensure_tls_material
-postmap hash:/etc/postfix/generated/allowed_sender_domains || true
-postmap hash:/etc/postfix/generated/sender_relay || true
-postmap hash:/etc/postfix/generated/transport || true
-postmap hash:/etc/postfix/generated/sasl_passwd || true
-chmod 600 /etc/postfix/generated/sasl_passwd* || true
+apply_sender_restrictions
+rm -f /etc/postfix/generated/.changed
+for m in $MAPS; do postmap_one "$m"; done
 apply_reject_footer
+apply_route_transports
 
 postfix start
 while true; do
   if [ -f /etc/postfix/generated/.reload ]; then
     rm -f /etc/postfix/generated/.reload
-    normalize_allowed_sender_map
-    postmap hash:/etc/postfix/generated/allowed_sender_domains || true
-    postmap hash:/etc/postfix/generated/sender_relay || true
-    postmap hash:/etc/postfix/generated/transport || true
-    postmap hash:/etc/postfix/generated/sasl_passwd || true
-    apply_reject_footer
-    postfix reload
+    apply_changes
   fi
+  apply_queue_actions
   sleep 2
 done
@@ -1,2 +0,0 @@
-#!/bin/sh
-exit 0
@@ -0,0 +1,47 @@
+#!/bin/bash
+# Local harness for queue-sync.sh: fake spool -> local rsync target, no Postfix/Docker/SSH needed.
+#   ./queue-sync-harness.sh [messages=100000] [size_bytes=4096]
+# Runs a full sync, an idle cycle, a small change (new + delivered messages) and checks the target matches the spool.
+set -euo pipefail
+MESSAGES="${1:-100000}"
+SIZE="${2:-4096}"
+WORK="$(mktemp -d)"
+trap 'rm -rf "$WORK"' EXIT
+export QUEUE_SYNC_SPOOL="$WORK/spool" QUEUE_SYNC_STATE_DIR="$WORK/state" QUEUE_SYNC_METRICS_FILE="$WORK/metrics.jsonl" QUEUE_SYNC_LAST_FILE="$WORK/last.json"
+mkdir -p "$WORK/spool" "$WORK/target"
+HERE="$(cd "$(dirname "$0")" && pwd)"
+# shellcheck source=queue-sync.sh
+source "$HERE/queue-sync.sh"
+DEST="$WORK/target/"
+postfix_ctl(){ echo "$(now_ms) $*" >> "$WORK/postfix.log"; }
+
+fill(){ # fill <dir> <count> <prefix>: hashed subdirectories like Postfix' deferred queue
+  local dir="$1" count="$2" prefix="$3" per h
+  per=$(( (count + 15) / 16 ))
+  for h in 0 1 2 3 4 5 6 7 8 9 A B C D E F; do
+    mkdir -p "$SPOOL/$dir/$h"
+    head -c $(( per * SIZE )) /dev/urandom | (cd "$SPOOL/$dir/$h" && split -b "$SIZE" -a 6 - "$prefix$h")
+  done
+}
+cycle(){ sync_cycle; echo "$1: $(cat "$LAST_FILE")"; }
+verify(){
+  local a="$WORK/a" b="$WORK/b"
+  (cd "$SPOOL" && find . -type f -printf '%p %s\n' | sort) > "$a"
+  (cd "$WORK/target" && find . -type f -printf '%p %s\n' | sort) > "$b"
+  cmp -s "$a" "$b" && echo "verify: target matches spool ($(wc -l < "$a") files)" || { echo "verify: MISMATCH"; diff "$a" "$b" | head; exit 1; }
+}
+
+echo "creating $MESSAGES messages of $SIZE bytes in $SPOOL"
+fill deferred "$MESSAGES" q
+mkdir -p "$SPOOL/active" "$SPOOL/incoming"
+
+cycle "initial full"
+verify
+cycle "idle"
+[ "$(grep -c stop "$WORK/postfix.log")" -eq 1 ] || { echo "idle cycle paused postfix"; exit 1; }
+fill incoming 160 n
+find "$SPOOL/deferred" -type f | sed -n 1,100p | xargs rm -f
+cycle "160 new + 100 delivered"
+verify
+cycle "idle"
+echo "postfix stop/start calls: $(grep -c stop "$WORK/postfix.log")"
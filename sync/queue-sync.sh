@@ -7,10 +7,96 @@ BACKEND_URL="http://127.0.0.1:8080"
 POSTFIX_CONTAINER_NAME="${POSTFIX_CONTAINER_NAME:-mail-relay-postfix-1}"
 KEEPALIVED_CONTAINER_NAME="${KEEPALIVED_CONTAINER_NAME:-mail-relay-keepalived-1}"
 LOCK_FILE=/tmp/queue-sync.lock
-mkdir -p /root/.ssh
-load_runtime(){ [ -f "$RUNTIME_JSON" ] || return 1; NODE_ID=$(jq -r '.node_id' "$RUNTIME_JSON"); VIP=$(jq -r '.vip_address' "$RUNTIME_JSON"); PEER=$(jq -r '.peer_node_ip' "$RUNTIME_JSON"); PEER_USER=$(jq -r '.peer_ssh_user // "root"' "$RUNTIME_JSON"); [ -f /runtime/id_rsa ] && cp /runtime/id_rsa /root/.ssh/id_rsa && chmod 600 /root/.ssh/id_rsa; [ -f /runtime/known_hosts ] && cp /runtime/known_hosts /root/.ssh/known_hosts; }
+SPOOL="${QUEUE_SYNC_SPOOL:-/var/spool/postfix}"
+STATE_DIR="${QUEUE_SYNC_STATE_DIR:-/runtime/queue-sync}"
+METRICS_FILE="${QUEUE_SYNC_METRICS_FILE:-/runtime/queue-sync-metrics.jsonl}"
+LAST_FILE="${QUEUE_SYNC_LAST_FILE:-/runtime/queue-sync-last.json}"
+QUEUE_DIRS="active bounce corrupt defer deferred flush hold incoming maildrop saved trace"
+DEST=""
+mkdir -p /root/.ssh "$STATE_DIR"
+load_runtime(){ [ -f "$RUNTIME_JSON" ] || return 1; NODE_ID=$(jq -r '.node_id' "$RUNTIME_JSON"); VIP=$(jq -r '.vip_address' "$RUNTIME_JSON"); PEER=$(jq -r '.peer_node_ip' "$RUNTIME_JSON"); PEER_USER=$(jq -r '.peer_ssh_user // "root"' "$RUNTIME_JSON"); DEST="${PEER_USER}@${PEER}:${SPOOL}/"; [ -f /runtime/id_rsa ] && cp /runtime/id_rsa /root/.ssh/id_rsa && chmod 600 /root/.ssh/id_rsa; [ -f /runtime/known_hosts ] && cp /runtime/known_hosts /root/.ssh/known_hosts; }
 is_vip_owner(){ docker exec "$KEEPALIVED_CONTAINER_NAME" ip -4 addr show 2>/dev/null | grep -q "${VIP}/"; }
 acquire_lock(){ curl -fsS -X POST "$BACKEND_URL/api/sync-lock/acquire" -H "content-type: application/json" -H "x-api-token: $API_TOKEN" -d "{\"node_id\":\"$NODE_ID\",\"is_vip_owner\":true}" >/dev/null; }
-safe_sync(){ flock -n 9 || return 0; acquire_lock || return 1; docker exec "$POSTFIX_CONTAINER_NAME" postfix stop || true; rsync -aH --delete --numeric-ids /var/spool/postfix/ "${PEER_USER}@${PEER}:/var/spool/postfix/"; docker exec "$POSTFIX_CONTAINER_NAME" postfix start || true; docker exec "$POSTFIX_CONTAINER_NAME" postqueue -f || true; }
-exec 9>"$LOCK_FILE"
-while true; do if load_runtime && is_vip_owner; then safe_sync || true; fi; sleep "$INTERVAL"; done
+postfix_ctl(){ docker exec "$POSTFIX_CONTAINER_NAME" "$@"; }
+now_ms(){ date +%s%3N; }
+
+# Manifest = one "path<TAB>size<TAB>mtime" line per queue file, sorted. Two equal manifests mean nothing to sync.
+build_manifest(){ (cd "$SPOOL" && find $QUEUE_DIRS -type f -printf '%p\t%s\t%T@\n' 2>/dev/null || true) | LC_ALL=C sort > "$1"; }
+# Paths that are new/changed in $2 or gone since $1; rsync --delete-missing-args removes the gone ones on the peer.
+manifest_delta(){ { LC_ALL=C comm -13 "$1" "$2" | cut -f1; LC_ALL=C comm -23 <(cut -f1 "$1") <(cut -f1 "$2"); } | LC_ALL=C sort -u; }
+# exit 24 = files vanished during the copy; expected while Postfix runs, the stopped catch-up pass covers them
+rsync_stats(){ local rc=0; rsync --stats "$@" > "$STATE_DIR/rsync.out" || rc=$?; [ "$rc" -eq 0 ] || [ "$rc" -eq 24 ] || return "$rc"; awk '/^Total bytes sent:/ { gsub(",", "", $4); print $4 }' "$STATE_DIR/rsync.out"; }
+transfer_list(){
+  [ -s "$1" ] || { echo 0; return 0; }
+  rsync_stats -aH --numeric-ids --files-from="$1" --delete-missing-args "$SPOOL/" "$DEST"
+}
+transfer_full(){
+  local dirs="" d
+  for d in $QUEUE_DIRS; do [ -d "$SPOOL/$d" ] && dirs="$dirs $d"; done
+  [ -n "$dirs" ] || { echo 0; return 0; }
+  (cd "$SPOOL" && rsync_stats -aHR --delete --numeric-ids $dirs "$DEST")
+}
+record_metrics(){
+  local line cycles=0 bytes_total=0 ms_total=0
+  # running totals ride along in the last-cycle file so the backend can export them as Prometheus counters
+  [ -f "$LAST_FILE" ] && read -r cycles bytes_total ms_total < <(jq -r '"\(.cycles // 0) \(.bytes_total // 0) \(.duration_ms_total // 0)"' "$LAST_FILE" 2>/dev/null)
+  line=$(printf '{"ts":%s,"changed":%s,"full":%s,"files":%s,"bytes":%s,"duration_ms":%s,"postfix_downtime_ms":%s,"cycles":%s,"bytes_total":%s,"duration_ms_total":%s}' \
+    "$(date +%s)" "$1" "$2" "$3" "$4" "$5" "$6" "$((${cycles:-0} + 1))" "$((${bytes_total:-0} + $4))" "$((${ms_total:-0} + $5))")
+  echo "$line" > "$LAST_FILE.tmp" && mv "$LAST_FILE.tmp" "$LAST_FILE"
+  if [ "$1" = true ]; then
+    echo "$line" >> "$METRICS_FILE"
+    [ "$(stat -c %s "$METRICS_FILE")" -lt 5242880 ] || { tail -n 10000 "$METRICS_FILE" > "$METRICS_FILE.tmp" && mv "$METRICS_FILE.tmp" "$METRICS_FILE"; }
+  fi
+}
+
+# One cycle: cheap manifest compare; on change copy the delta while Postfix runs, then stop Postfix only for the
+# catch-up of whatever changed during that copy.
+sync_cycle(){
+  local t0 synced="$STATE_DIR/synced.manifest" live="$STATE_DIR/live.manifest" final="$STATE_DIR/final.manifest" list="$STATE_DIR/delta.list"
+  local full=false bytes=0 b files d0 d1
+  t0=$(now_ms)
+  build_manifest "$live"
+  if [ -f "$synced" ] && cmp -s "$live" "$synced"; then
+    record_metrics false false 0 0 $(( $(now_ms) - t0 )) 0
+    return 0
+  fi
+  if [ -f "$synced" ]; then
+    manifest_delta "$synced" "$live" > "$list"
+    files=$(wc -l < "$list")
+    b=$(transfer_list "$list") || return 1; bytes=$((bytes + ${b:-0}))
+  else
+    full=true
+    files=$(wc -l < "$live")
+    b=$(transfer_full) || return 1; bytes=$((bytes + ${b:-0}))
+  fi
+  d0=$(now_ms)
+  postfix_ctl postfix stop >/dev/null 2>&1 || true
+  build_manifest "$final"
+  manifest_delta "$live" "$final" > "$list"
+  b=$(transfer_list "$list") || { postfix_ctl postfix start >/dev/null 2>&1 || true; return 1; }
+  bytes=$((bytes + ${b:-0}))
+  postfix_ctl postfix start >/dev/null 2>&1 || true
+  d1=$(now_ms)
+  postfix_ctl postqueue -f >/dev/null 2>&1 || true
+  mv "$final" "$synced"
+  record_metrics true "$full" "$files" "$bytes" $(( $(now_ms) - t0 )) $(( d1 - d0 ))
+}
+safe_sync(){ flock -n 9 || return 0; acquire_lock || return 1; sync_cycle; }
+
+main(){
+  local was_owner=false
+  exec 9>"$LOCK_FILE"
+  while true; do
+    if load_runtime && is_vip_owner; then
+      # freshly promoted (or restarted): the peer state is unknown, so start with a full sync
+      [ "$was_owner" = true ] && [ "$(cat "$STATE_DIR/peer" 2>/dev/null)" = "$DEST" ] || { rm -f "$STATE_DIR/synced.manifest"; echo "$DEST" > "$STATE_DIR/peer"; }
+      was_owner=true
+      safe_sync || true
+    else
+      was_owner=false
+    fi
+    sleep "$INTERVAL"
+  done
+}
+
+if [ "${BASH_SOURCE[0]}" = "$0" ]; then main; fi